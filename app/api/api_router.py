@@ -1,13 +1,25 @@
 # app/api/api_router.py
-import json
-from contextlib import asynccontextmanager
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+import asyncio
+from contextlib import asynccontextmanager, aclosing
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from app.services.medical.service import MedicalAgentService
 from app.services.financial_service import FinancialAgentService
+from app.services.llm_registry import llm_registry
+from app.services.tools.medical_tools import bpm_client, health_store, health_flight
+from app.services.tools.financial_tools import price_flight
+from app.services.medical.records import record_blobs
+from app.services.chart_pool import chart_pool
+from app.services.chart_cache import chart_cache
+from app.services.job_service import JobStore, ResearchJobManager, JobQueueFull
 from app.core.config import settings
 from app.core.security import get_api_key
+from app.utils.sse import encode_event, coalesce_stream, cancel_on_disconnect
+from app.utils.metrics import metrics
+from app.utils.concurrency import RunLimiter, RunQueueFull
+from app.utils.replay import ReplayRegistry
 
 from app.utils.logger import setup_logger
 import time
@@ -22,7 +34,7 @@ logger = setup_logger("ApiRouter")
 async def get_config():
     return {
         "llm_provider": settings.llm_provider,
-        "model_id": settings.aws_bedrock_model_id if settings.llm_provider == "bedrock" else "gemini-2.5-flash"
+        "model_id": llm_registry.resolve()[1]
     }
 
 
@@ -30,6 +42,8 @@ async def get_config():
 class ChatRequest(BaseModel):
     message: str
     userId: str = "default-user"
+    # 圖表輸出格式；json 代表由瀏覽器繪圖，未指定時使用 CHART_FORMAT
+    chartFormat: Optional[Literal["png", "webp", "svg", "json"]] = None
 
 
 class InvestRequest(BaseModel):
@@ -37,8 +51,45 @@ class InvestRequest(BaseModel):
     context: str = ""
 
 
+class BatchInvestRequest(BaseModel):
+    symbols: List[str] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(default=None, ge=1)
+
+
 _medical_service = MedicalAgentService()
 _financial_agent = FinancialAgentService()
+# 以 userId (即 LangGraph thread_id) 串行化執行，並限制每個 worker 的併發 Graph 數
+_run_limiter = RunLimiter(
+    max_inflight=settings.chat_max_inflight_runs,
+    thread_queue_size=settings.chat_thread_queue_size,
+    max_queued=settings.chat_max_queued_runs,
+    retry_after=settings.chat_retry_after_seconds)
+
+
+def _on_run_abandoned(stream):
+    metrics.incr("chat.abandoned_runs")
+    logger.info(f"[Request] 客戶端未重連，放棄執行 - User: {stream.owner}")
+
+
+# Graph 執行與 HTTP 連線分離：執行結果寫入緩衝區，斷線後可用 Last-Event-ID 續傳
+_replay_registry = ReplayRegistry(
+    max_events=settings.sse_replay_buffer_events,
+    ttl_seconds=settings.sse_replay_ttl_seconds,
+    grace_seconds=settings.sse_resume_grace_seconds,
+    max_runs=settings.sse_replay_max_runs,
+    on_abandon=_on_run_abandoned)
+
+
+async def _run_official_job(payload: dict, on_step):
+    return await _financial_agent.run_official_deep_logic(payload["symbol"], on_step=on_step)
+
+
+# DeepAgents 官方模式改為背景任務執行，HTTP 只負責提交與查詢
+_job_manager = ResearchJobManager(
+    JobStore(settings.research_job_db_path),
+    runners={"official_research": _run_official_job},
+    concurrency=settings.research_job_concurrency,
+    queue_size=settings.research_job_queue_size)
 
 
 @asynccontextmanager
@@ -46,31 +97,147 @@ async def lifespan(app):
     """
     封裝所有服務相關的生命週期邏輯。
     """
+    await bpm_client.start()
+    await record_blobs.gc()
+    await chart_pool.start()
+    await _job_manager.start()
     logger.info("[Lifespan] 系統服務準備就緒")
     yield
     logger.info("[Lifespan] 正在關閉所有服務資源...")
+    await _replay_registry.close()
+    await _job_manager.close()
+    await bpm_client.close()
+    await health_store.close()
+    await record_blobs.close()
+    await chart_pool.close()
     await _medical_service.close()
     if hasattr(_financial_agent, "close"):
         await _financial_agent.close()
 
 
+@router.get("/metrics")
+async def get_metrics():
+    """行程內的執行指標快照"""
+    return {
+        **metrics.snapshot(),
+        "chat_runs": _run_limiter.stats(),
+        "replay": _replay_registry.stats(),
+        "llm_pool": llm_registry.stats(),
+        "singleflight": {
+            "health_data": health_flight.stats(),
+            "stock_price": price_flight.stats()
+        },
+        "chart_pool": chart_pool.stats(),
+        "chart_cache": chart_cache.stats(),
+        "prefetch": _medical_service.prefetcher.stats() if _medical_service.prefetcher else None
+    }
+
+
+def _parse_last_event_id(value: str):
+    """Last-Event-ID 格式為 {run_id}:{seq}"""
+    run_id, _, seq = value.partition(":")
+    if not run_id or not seq.isdigit():
+        return None, None
+    return run_id, int(seq)
+
+
 @router.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
+    last_event_id = http_request.headers.get("last-event-id")
+
+    if last_event_id:
+        # 斷線重連：從緩衝區續傳同一次執行的輸出，不重新執行 Graph
+        run_id, after_seq = _parse_last_event_id(last_event_id)
+        stream = _replay_registry.get(run_id) if run_id else None
+        if (stream is None or stream.owner != request.userId
+                or not stream.can_resume(after_seq)):
+            raise HTTPException(status_code=410, detail="串流已過期，請重新發送訊息")
+        logger.info(f"[Request] 續傳串流 {run_id} (seq > {after_seq}) - User: {request.userId}")
+        metrics.incr("chat.resumed_streams")
+        return _stream_response(stream, after_seq, http_request)
+
     logger.info(f"[Request] 收到聊天請求 (串流模式) - User: {request.userId}")
 
+    # 在開始串流前先確認排隊容量，才能以 429 回應
+    try:
+        slot = _run_limiter.reserve(request.userId)
+    except RunQueueFull as e:
+        logger.warning(f"[Request] 拒絕請求 - User: {request.userId}, 原因: {e}")
+        raise HTTPException(status_code=429,
+                            detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+
+    async def serialized_run():
+        if slot.would_wait:
+            yield {"type": "status", "content": "前一個請求仍在處理中，排隊等待..."}
+        async with slot:
+            async for event in _medical_service.handle_chat(request.userId, request.message,
+                                                               chart_format=request.chartFormat):
+                yield event
+
+    # 呼叫後端服務 (Async Generator)，並合併連續的 stream chunk
+    events = coalesce_stream(
+        serialized_run(),
+        flush_interval_ms=settings.sse_flush_interval_ms,
+        max_chars=settings.sse_flush_max_chars)
+    stream = _replay_registry.start(request.userId, events, on_finish=slot.release)
+    return _stream_response(stream, 0, http_request)
+
+
+def _stream_response(stream, after_seq: int, http_request: Request):
+    """訂閱執行緩衝區並以 SSE 輸出；連線中斷只會結束訂閱，執行是否取消由寬限期決定"""
+
+    def on_disconnect():
+        metrics.incr("chat.client_disconnects")
+
     async def event_generator():
+        # 客戶端斷線時停止訂閱，無人重連時 ReplayRegistry 會取消底層 LangGraph 執行
+        events = cancel_on_disconnect(
+            stream.subscribe(after_seq),
+            http_request.is_disconnected,
+            poll_interval_ms=settings.sse_disconnect_poll_ms,
+            on_disconnect=on_disconnect)
         try:
-            # 呼叫後端服務 (Async Generator)
-            async for event in _medical_service.handle_chat(request.userId, request.message):
-                # 每個 event 都是 dict，將其轉為 JSON 字串並以 Server-Sent Events (SSE) 格式發送
-                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            async for seq, event in events:
+                # 每個 event 都是 dict，序列化後以 Server-Sent Events (SSE) 格式發送
+                yield encode_event(event, stream.event_id(seq))
+        except asyncio.CancelledError:
+            # 伺服器端 (uvicorn/starlette) 先偵測到斷線並取消了串流
+            on_disconnect()
+            raise
         except Exception as e:
             logger.error(f"[Streaming Error] {e}", exc_info=True)
-            yield f"data: {json.dumps({'type': 'error', 'content': str(e)}, ensure_ascii=False)}\n\n"
+            yield encode_event({'type': 'error', 'content': str(e)})
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
+@router.get("/graph")
+async def get_graph(request: Request):
+    """
+    回傳目前編譯版本的 Mermaid 流程圖，並以版本號作為 ETag。
+    """
+    diagram = await _medical_service.get_graph_diagram()
+    etag = f'"{diagram["version"]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(diagram, headers=headers)
+
+
+@router.get("/graph/{version}")
+async def get_graph_version(version: str):
+    """指定版本的流程圖內容不會再變動，可永久快取"""
+    diagram = await _medical_service.get_graph_diagram()
+    if diagram["version"] != version:
+        raise HTTPException(status_code=404, detail="流程圖版本不存在")
+    headers = {
+        "ETag": f'"{version}"',
+        "Cache-Control": "private, max-age=31536000, immutable"
+    }
+    return JSONResponse(diagram, headers=headers)
+
+
 @router.post("/deep-research/invest/manual")
 async def invest_manual(payload: InvestRequest):
     """
@@ -88,6 +255,48 @@ async def invest_manual(payload: InvestRequest):
         raise HTTPException(status_code=500, detail="深度分析過程發生異常")
 
 
+@router.post("/deep-research/invest/manual/batch")
+async def invest_manual_batch(payload: BatchInvestRequest, http_request: Request):
+    """
+    批次 (Watchlist) 手動模式：以 SSE 逐檔回傳完成的分析結果。
+    """
+    # 去除重複代號並保留原順序
+    symbols = list(dict.fromkeys(s.strip() for s in payload.symbols if s.strip()))
+    if not symbols:
+        raise HTTPException(status_code=422, detail="請至少提供一個標的代號")
+    if len(symbols) > settings.batch_max_symbols:
+        raise HTTPException(status_code=422,
+                            detail=f"單次最多 {settings.batch_max_symbols} 個標的")
+    concurrency = min(payload.concurrency or settings.batch_concurrency,
+                      settings.batch_concurrency)
+    logger.info(f"[API] 收到批次研究請求: {len(symbols)} 檔, 併發 {concurrency}")
+
+    async def batch_events():
+        completed = 0
+        # aclosing 確保客戶端斷線時取消尚未完成的標的
+        async with aclosing(_financial_agent.run_manual_batch(symbols, concurrency)) as results:
+            async for symbol, result, error in results:
+                completed += 1
+                if error:
+                    yield {"type": "error", "symbol": symbol, "content": "深度分析過程發生異常"}
+                else:
+                    yield {"type": "result", "symbol": symbol, "data": result}
+        yield {"type": "done", "total": len(symbols), "completed": completed}
+
+    async def event_generator():
+        events = cancel_on_disconnect(batch_events(),
+                                      http_request.is_disconnected,
+                                      poll_interval_ms=settings.sse_disconnect_poll_ms)
+        try:
+            async for event in events:
+                yield encode_event(event)
+        except Exception as e:
+            logger.error(f"[API] 批次分析失敗: {str(e)}", exc_info=True)
+            yield encode_event({"type": "error", "content": "批次分析過程發生異常"})
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
 @router.post("/deep-research/invest/official")
 async def invest_official(payload: InvestRequest):
     """封裝路徑 (DeepAgents)"""
@@ -96,3 +305,83 @@ async def invest_official(payload: InvestRequest):
         return {"mode": "Official DeepAgents", "result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/deep-research/invest/official/jobs", status_code=202)
+async def submit_official_job(payload: InvestRequest):
+    """提交 DeepAgents 研究任務，立即回傳 job_id"""
+    try:
+        job = await _job_manager.submit("official_research", payload.model_dump())
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429,
+                            detail=str(e),
+                            headers={"Retry-After": str(settings.chat_retry_after_seconds)})
+    logger.info(f"[API] 已提交研究任務 {job['job_id']}: {payload.symbol}")
+    return job
+
+
+async def _get_job_or_404(job_id: str) -> dict:
+    job = await _job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到此研究任務")
+    return job
+
+
+@router.get("/deep-research/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """查詢任務狀態與已完成的進度步驟"""
+    job = await _get_job_or_404(job_id)
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "payload": job["payload"],
+        "steps": job["steps"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+@router.get("/deep-research/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """取得任務結果；格式與同步版 /deep-research/invest/official 相同"""
+    job = await _get_job_or_404(job_id)
+    if job["status"] in ("queued", "running"):
+        return JSONResponse({"job_id": job_id, "status": job["status"]}, status_code=202)
+    if job["status"] == "failed":
+        return {"mode": "Official DeepAgents", "status": "failed", "error": job["error"]}
+    return {"mode": "Official DeepAgents", "status": "succeeded", "result": job["result"]}
+
+
+@router.get("/deep-research/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, http_request: Request):
+    """以 SSE 串流任務進度 (step / final / error)，支援 Last-Event-ID 續傳"""
+    # 先取記憶體串流再讀 SQLite，避免任務剛好在兩者之間結束
+    stream = _job_manager.live_stream(job_id)
+    job = await _get_job_or_404(job_id)
+
+    if stream is not None:
+        run_id, after_seq = _parse_last_event_id(http_request.headers.get("last-event-id", ""))
+        if run_id != job_id or not stream.can_resume(after_seq):
+            after_seq = 0
+
+        async def live_events():
+            events = cancel_on_disconnect(
+                stream.subscribe(after_seq),
+                http_request.is_disconnected,
+                poll_interval_ms=settings.sse_disconnect_poll_ms)
+            async for seq, event in events:
+                yield encode_event(event, stream.event_id(seq))
+
+        return StreamingResponse(live_events(), media_type="text/event-stream")
+
+    # 任務已結束 (或在重啟前完成)：由 SQLite 內容重建事件
+    async def stored_events():
+        for step in job["steps"]:
+            yield encode_event({"type": "step", "data": step})
+        if job["status"] == "succeeded":
+            yield encode_event({"type": "final", "data": job["result"]})
+        else:
+            yield encode_event({"type": "error", "content": job["error"] or "任務未完成"})
+
+    return StreamingResponse(stored_events(), media_type="text/event-stream")
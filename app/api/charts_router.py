@@ -0,0 +1,27 @@
+import re
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from app.services.chart_cache import chart_cache
+from app.services.charts import CHART_FORMATS
+
+# 圖表以 <img> 載入無法附帶 X-API-Key；檔名為以伺服器密鑰計算的 HMAC，無密鑰者無法由數據推算
+router = APIRouter()
+
+_CHART_NAME = re.compile(r"^([0-9a-f]{64})\.([a-z]+)$")
+
+
+@router.get("/charts/{name}")
+async def get_chart(name: str):
+    """回傳快取的圖表檔案；內容由雜湊決定，可永久快取"""
+    match = _CHART_NAME.match(name)
+    if not match or match.group(2) not in CHART_FORMATS:
+        raise HTTPException(status_code=404, detail="Chart not found")
+    digest, ext = match.groups()
+    path = chart_cache.get(digest, ext)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Chart not found")
+    return FileResponse(path,
+                        media_type=CHART_FORMATS[ext][1],
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
@@ -13,6 +13,99 @@ class Settings(BaseSettings):
     gemini_api_key: str
     #database_url: str
 
+    # 外部 BPM API 連線池：逾時秒數、連線上限、keep-alive、HTTP/2 (需安裝 h2) 與重試
+    external_api_timeout: float = 10.0
+    external_api_connect_timeout: float = 5.0
+    external_api_max_connections: int = 20
+    external_api_max_keepalive: int = 10
+    external_api_keepalive_expiry: float = 30.0
+    external_api_http2: bool = False
+    external_api_retries: int = 2
+    external_api_retry_backoff: float = 0.2
+    # 健康紀錄分頁：每頁筆數、同時抓取的頁數、單次查詢筆數上限與長區間切分的天數
+    health_fetch_page_size: int = 100
+    health_fetch_concurrency: int = 4
+    health_fetch_max_records: int = 2000
+    health_fetch_window_days: int = 90
+    # 本地量測紀錄快取：近期日期的短 TTL、量測日結束 settle_days 天後同步的日期使用長 TTL
+    health_cache_enabled: bool = True
+    health_cache_db_path: str = "./health_cache.sqlite"
+    health_cache_recent_ttl_seconds: int = 120
+    health_cache_settled_ttl_seconds: int = 7 * 86400
+    health_cache_settle_days: int = 2
+    # 量測紀錄 blob store：Graph State 只保存 handle，未引用的 blob 超過寬限期後回收
+    record_blob_db_path: str = "./record_blobs.sqlite"
+    record_blob_gc_grace_seconds: int = 7 * 86400
+    # 分析師的數據輸入："summary" 傳統計摘要 + 抽樣，"raw" 傳整份 JSON (供比較品質)
+    analyst_data_mode: str = "summary"
+    analyst_sample_size: int = 20
+    # 訊息含明確日期時，於 Router LLM 執行期間預先抓取健康數據
+    speculative_prefetch_enabled: bool = True
+    # 圖表繪製行程池 (0 表示直接在 event loop 中繪圖)
+    chart_render_workers: int = 2
+    chart_render_max_queue: int = 16
+    chart_render_timeout: float = 30.0
+    # 圖表輸出：png / webp / svg，或 json (回傳序列資料由瀏覽器繪製)；可被每次請求的 chartFormat 覆寫
+    # 點數超過 chart_max_points 時以 LTTB 降採樣
+    chart_format: str = "png"
+    chart_dpi: int = 100
+    chart_max_points: int = 500
+    # 圖表檔案快取 (內容定址，超過大小上限時依 LRU 刪除)
+    chart_cache_dir: str = "./chart_cache"
+    chart_cache_max_bytes: int = 200 * 1024 * 1024
+    # 圖表檔名的 HMAC 金鑰；未設定時沿用 app_auth_token
+    chart_url_secret: str | None = None
+
+    # LLM：llm_model 覆寫 Provider 的預設模型；llm_tier_models 指定各層級的模型，
+    # 例如 {"router": "gemini-2.5-flash-lite", "analysis": "gemini-2.5-pro"}
+    llm_model: str | None = None
+    llm_tier_models: dict[str, str] = {}
+    llm_temperature: float = 0
+    llm_max_connections: int = 20
+    # LLM 回應快取 (選用)：SQLite 路徑、項目上限，以及各節點的 TTL 秒數 (<= 0 表示不快取)
+    llm_cache_enabled: bool = False
+    llm_cache_db_path: str = "./llm_cache.sqlite"
+    llm_cache_max_entries: int = 5000
+    llm_cache_ttl_seconds: dict[str, int] = {
+        "default": 3600,
+        "device_expert": 86400,
+        "general_assistant": 86400,
+        "health_analyst": 600,
+    }
+
+    # Router 規則式快速路徑：信心分數達門檻時不呼叫 LLM
+    router_fast_path_enabled: bool = True
+    router_fast_path_min_confidence: float = 0.8
+    # 本地緊急預檢只檢查最近幾小時內的讀數
+    emergency_precheck_window_hours: float = 24
+    # Visualizer 規則式參數推導：明確的繪圖需求不呼叫 LLM
+    chart_fast_path_enabled: bool = True
+
+    # SSE 串流：合併連續 token 的時間窗 (毫秒) 與字元上限
+    sse_flush_interval_ms: int = 30
+    sse_flush_max_chars: int = 1024
+    # 檢查客戶端是否斷線的間隔 (毫秒)
+    sse_disconnect_poll_ms: int = 500
+    # SSE 續傳：每次執行緩衝的事件數、完成後保留秒數、斷線後等待重連的寬限秒數
+    sse_replay_buffer_events: int = 2000
+    sse_replay_ttl_seconds: int = 300
+    sse_replay_max_runs: int = 1000
+    sse_resume_grace_seconds: float = 15
+
+    # Graph 執行併發控制：同一 thread 的排隊上限、每個 worker 的執行上限與全域排隊上限
+    chat_thread_queue_size: int = 2
+    chat_max_inflight_runs: int = 16
+    chat_max_queued_runs: int = 64
+    chat_retry_after_seconds: int = 3
+
+    # DeepAgents 研究任務：SQLite 任務表路徑、背景併發上限與佇列長度
+    research_job_db_path: str = "./research_jobs.sqlite"
+    research_job_concurrency: int = 2
+    research_job_queue_size: int = 50
+    # 手動 LangGraph 批次 (Watchlist) 模式：單次最多代號數與併發數
+    batch_max_symbols: int = 100
+    batch_concurrency: int = 5
+
     # CORS
     backend_cors_origins: list[str] = [""]
 
@@ -0,0 +1,93 @@
+import hashlib
+import time
+from typing import Optional
+
+import aiosqlite
+
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("BlobStore")
+
+
+class BlobStore:
+    """
+    以內容雜湊 (sha256) 為鍵的 SQLite blob 儲存，讓 Graph State 只保存小型 handle。
+    - put() 相同內容只寫入一次，並把 owner (thread) 目前引用的 blob 指向它
+    - 沒有任何 owner 引用且超過 gc_grace_seconds 未使用的 blob 會被 gc() 回收
+      (保留寬限期，讓舊的 checkpoint 在短時間內仍可解析)
+    """
+
+    def __init__(self, db_path: str, gc_grace_seconds: int = 7 * 86400, gc_every: int = 200):
+        self.db_path = db_path
+        self.gc_grace_seconds = gc_grace_seconds
+        self.gc_every = gc_every
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._puts = 0
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._conn = await aiosqlite.connect(self.db_path)
+        await self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blob_refs (
+                owner TEXT PRIMARY KEY,
+                hash TEXT NOT NULL
+            );""")
+        await self._conn.commit()
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def put(self, owner: str, data: str) -> str:
+        await self.open()
+        digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        now = time.time()
+        cursor = await self._conn.execute(
+            "INSERT OR IGNORE INTO blobs (hash, data, size, last_used_at) VALUES (?, ?, ?, ?)",
+            (digest, data, len(data), now))
+        if cursor.rowcount == 0:
+            metrics.incr("blob_store.dedup_hits")
+            await self._conn.execute("UPDATE blobs SET last_used_at = ? WHERE hash = ?",
+                                     (now, digest))
+        else:
+            metrics.incr("blob_store.writes")
+        await self._conn.execute(
+            "INSERT OR REPLACE INTO blob_refs (owner, hash) VALUES (?, ?)", (owner, digest))
+        await self._conn.commit()
+
+        self._puts += 1
+        if self.gc_every and self._puts % self.gc_every == 0:
+            await self.gc()
+        return digest
+
+    async def get(self, digest: str) -> Optional[str]:
+        await self.open()
+        async with self._conn.execute("SELECT data FROM blobs WHERE hash = ?",
+                                      (digest, )) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            metrics.incr("blob_store.misses")
+            return None
+        return row[0]
+
+    async def gc(self) -> int:
+        """刪除未被引用且超過寬限期的 blob，回傳刪除數量"""
+        await self.open()
+        cursor = await self._conn.execute(
+            "DELETE FROM blobs WHERE last_used_at < ? "
+            "AND hash NOT IN (SELECT hash FROM blob_refs)",
+            (time.time() - self.gc_grace_seconds, ))
+        await self._conn.commit()
+        if cursor.rowcount:
+            logger.info(f"[BlobStore] 已回收 {cursor.rowcount} 個未引用的 blob")
+            metrics.incr("blob_store.collected", cursor.rowcount)
+        return cursor.rowcount
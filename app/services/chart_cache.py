@@ -0,0 +1,108 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+from typing import Optional
+
+from app.core.config import settings
+from app.utils.health_records import HealthRecords
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("ChartCache")
+
+
+class ChartCache:
+    """
+    以內容雜湊 (紀錄數據 + 繪圖參數) 命名的圖表檔案快取。
+    - 相同數據與參數的圖表只繪製一次，回應中以 /api/v1/charts/{hash}.{ext} 引用
+    - 檔名為以伺服器密鑰計算的 HMAC-SHA256，知道紀錄內容也無法推算出圖表網址
+    - 以檔案 mtime 作為 LRU 依據 (命中時更新)，總大小超過 max_bytes 時刪除最久未使用的檔案
+    """
+
+    def __init__(self, directory: str, secret: str, max_bytes: int = 200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._secret = secret.encode("utf-8")
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+
+    def key(self, records: HealthRecords, params: dict) -> str:
+        digest = hmac.new(self._secret, records.fingerprint().encode("ascii"), hashlib.sha256)
+        digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{digest}.{ext}")
+
+    def get(self, digest: str, ext: str) -> Optional[str]:
+        """回傳快取檔案路徑 (並更新 LRU 時間)，不存在時回傳 None"""
+        path = self.path(digest, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            metrics.incr("chart_cache.misses")
+            return None
+        metrics.incr("chart_cache.hits")
+        return path
+
+    def put(self, digest: str, ext: str, data: bytes) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(digest, ext)
+        # 先寫入暫存檔再改名，讀取端不會看到寫到一半的檔案
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        metrics.incr("chart_cache.writes")
+
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_size()
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+        return path
+
+    def _entries(self) -> list:
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            metrics.incr("chart_cache.evictions")
+        self._total = total
+
+    def stats(self) -> dict:
+        return {
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "hits": metrics.get("chart_cache.hits"),
+            "misses": metrics.get("chart_cache.misses"),
+            "evictions": metrics.get("chart_cache.evictions"),
+        }
+
+
+# 全域圖表快取
+chart_cache = ChartCache(settings.chart_cache_dir,
+                         secret=settings.chart_url_secret or settings.app_auth_token,
+                         max_bytes=settings.chart_cache_max_bytes)
@@ -0,0 +1,158 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from app.core.config import settings
+from app.services import charts
+from app.utils.health_records import HealthRecords
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("ChartPool")
+
+
+class ChartRenderBusy(Exception):
+    """繪圖佇列已滿"""
+
+
+class ChartRenderTimeout(Exception):
+    """繪圖超過時限"""
+
+
+class ChartRenderPool:
+    """
+    將 matplotlib 繪圖移到獨立行程執行，避免阻塞 event loop 上的其他 SSE 串流。
+    - worker 以 spawn 啟動，每個 worker 行程啟動時都會執行 initializer 載入 matplotlib 與字體；
+      start() 另外送出暖機工作，讓行程在第一個請求前啟動 (不保證每個 worker 都分到暖機工作)
+    - 執行中 + 等待中的工作超過 max_queue 時拋出 ChartRenderBusy
+    - 超過 timeout 或呼叫端被取消時，尚未開始的工作會被取消 (已開始的工作無法中斷，結果會被丟棄)
+    - worker 異常結束 (例如繪製大圖時 OOM) 導致 BrokenProcessPool 時，重建行程池並重試一次
+    workers <= 0 時直接在 event loop 中繪圖 (測試與除錯用)。
+    render_defaults 為每次繪圖的預設參數 (例如輸出格式與 dpi)，可被呼叫端覆寫。
+    """
+
+    def __init__(self,
+                 workers: int = 2,
+                 max_queue: int = 16,
+                 timeout: float = 30.0,
+                 render_defaults: Optional[dict] = None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.render_defaults = render_defaults or {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+    async def start(self):
+        if self._executor is not None or self.workers <= 0:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=charts.init_render_worker)
+        # 送出與 worker 數相同的暖機工作，觸發行程啟動 (initializer 已負責每個行程的初始化)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._executor, charts.init_render_worker) for _ in range(self.workers)
+        ], return_exceptions=True)
+        logger.info(f"[ChartPool] {self.workers} 個繪圖 worker 已就緒 "
+                    f"({(time.perf_counter() - started) * 1000:.0f} ms)")
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _restart(self, broken: ProcessPoolExecutor):
+        """以新的行程池取代已損壞的行程池 (多個請求同時失敗時只重建一次)"""
+        if self._executor is broken:
+            logger.warning("[ChartPool] 繪圖 worker 異常結束，重建行程池")
+            metrics.incr("chart_pool.restarts")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        await self.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """執行中 + 等待中的繪圖工作數"""
+        return self._pending
+
+    def resolve_params(self, params: dict) -> dict:
+        """套用預設參數後的完整繪圖參數 (也用於計算圖表快取的 key)"""
+        return {**self.render_defaults, **params}
+
+    async def render(self, records: HealthRecords, **params) -> str:
+        """繪圖並回傳 data URI (失敗時回傳錯誤訊息字串)"""
+        return await self._run(charts.render_job, records, self.resolve_params(params))
+
+    async def render_bytes(self, records: HealthRecords, **params) -> bytes:
+        """繪圖並回傳圖檔內容，失敗時拋出例外"""
+        return await self._run(charts.render_bytes_job, records, self.resolve_params(params))
+
+    async def _run(self, job, records: HealthRecords, params: dict):
+        if self.workers <= 0:
+            return job(records, params)
+        if self._pending >= self.max_queue:
+            metrics.incr("chart_pool.rejected")
+            raise ChartRenderBusy("繪圖佇列已滿，請稍後再試")
+        if self._executor is None:
+            await self.start()
+
+        self._pending += 1
+        metrics.set_gauge("chart_pool.queue_depth", self._pending)
+        started = time.perf_counter()
+        try:
+            try:
+                result = await self._submit(job, records, params)
+            except BrokenProcessPool:
+                # _submit 已重建行程池，重試一次
+                result = await self._submit(job, records, params)
+        finally:
+            self._pending -= 1
+            metrics.set_gauge("chart_pool.queue_depth", self._pending)
+        metrics.incr("chart_pool.rendered")
+        metrics.set_gauge("chart_pool.last_render_ms", round((time.perf_counter() - started) * 1000, 1))
+        return result
+
+    async def _submit(self, job, records: HealthRecords, params: dict):
+        executor = self._executor
+        try:
+            future = executor.submit(job, records, params)
+        except BrokenProcessPool:
+            await self._restart(executor)
+            raise
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("chart_pool.timeouts")
+            raise ChartRenderTimeout(f"繪圖超過 {self.timeout} 秒")
+        except BrokenProcessPool:
+            await self._restart(executor)
+            raise
+        finally:
+            future.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self._pending,
+            "max_queue": self.max_queue,
+            "rendered": metrics.get("chart_pool.rendered"),
+            "timeouts": metrics.get("chart_pool.timeouts"),
+            "rejected": metrics.get("chart_pool.rejected"),
+            "restarts": metrics.get("chart_pool.restarts"),
+        }
+
+
+# 全域繪圖行程池 (由 FastAPI lifespan 啟動與關閉)
+chart_pool = ChartRenderPool(workers=settings.chart_render_workers,
+                             max_queue=settings.chart_render_max_queue,
+                             timeout=settings.chart_render_timeout,
+                             render_defaults={
+                                 "fmt": charts.image_format(settings.chart_format),
+                                 "dpi": settings.chart_dpi,
+                                 "max_points": settings.chart_max_points,
+                             })
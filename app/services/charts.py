@@ -0,0 +1,228 @@
+import base64
+import io
+import os
+from functools import lru_cache
+from typing import List
+
+import matplotlib
+import matplotlib.style
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties, fontManager
+
+from app.utils.downsample import downsample_indices
+from app.utils.health_records import HealthRecords, VALUE_COLUMNS
+from app.utils.logger import setup_logger
+
+logger = setup_logger("Charts")
+
+
+@lru_cache(maxsize=1)
+def get_zh_font():
+    """只有在需要繪圖時才執行的字體加載邏輯"""
+    DOCKER_FONT_PATH = "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc"
+    try:
+        if os.path.exists(DOCKER_FONT_PATH):
+            return FontProperties(fname=DOCKER_FONT_PATH)
+
+        # 搜尋系統中的 Noto Sans
+        noto_font = next(
+            (f.fname
+             for f in fontManager.ttflist if "Noto Sans CJK" in f.name), None)
+        if noto_font:
+            return FontProperties(fname=noto_font)
+
+        # 安全退場機制：使用系統預設
+        return FontProperties(family=['sans-serif'])
+    except Exception as e:
+        logger.warning(f"字體加載失敗，使用預設值: {e}")
+        return FontProperties(family=['sans-serif'])
+
+
+# 輸出格式 -> (savefig format, MIME type)
+CHART_FORMATS = {
+    "png": ("png", "image/png"),
+    "webp": ("webp", "image/webp"),
+    "svg": ("svg", "image/svg+xml"),
+}
+# 不在伺服器繪圖，改回傳序列資料由瀏覽器繪製
+CHART_SPEC_FORMAT = "json"
+# 參考線 (欄位 -> 數值, 顏色)：收縮壓 120、舒張壓 80
+REFERENCE_LINES = {"sys": (120, "#c0392b"), "dia": (80, "#2980b9")}
+# 沿用原本的 seaborn-v0_8-muted 配色，但只套用在各自的 Axes 上，不修改全域 rcParams
+_COLOR_CYCLE = matplotlib.style.library["seaborn-v0_8-muted"]["axes.prop_cycle"]
+MAX_BAR_POINTS = 60
+
+
+class ChartDataError(ValueError):
+    """紀錄或參數不足以繪圖"""
+
+
+def image_format(fmt: str) -> str:
+    """伺服器繪圖使用的圖檔格式；json 等非圖檔格式改以 png 輸出"""
+    return fmt if fmt in CHART_FORMATS else "png"
+
+
+def _prepare_series(records: HealthRecords, chart_type: str, columns: List[str], max_points: int):
+    """依日期排序並以 LTTB 降採樣，回傳 (columns, dates, series)"""
+    if not len(records):
+        raise ChartDataError("數據量不足，無法生成圖表。")
+    columns = [c for c in columns if c in VALUE_COLUMNS]
+    dates = records.column("date")
+    order = np.argsort(dates, kind="stable")
+    dates = dates[order]
+    series = [records.column(c)[order].astype(np.float64) for c in columns]
+    x = np.where(np.isnat(dates), np.nan, dates.astype(np.int64)).astype(np.float64)
+    # 長條圖超過數十根就難以辨識，另外限制點數
+    limit = min(max_points, MAX_BAR_POINTS) if chart_type == "bar" else max_points
+    keep = downsample_indices(x, series, limit)
+    return columns, dates[keep], [values[keep] for values in series]
+
+
+def build_chart_spec(
+    records: HealthRecords,
+    title: str = "健康趨勢分析",
+    chart_type: str = "line",
+    columns: List[str] = ["sys", "dia"],
+    labels: List[str] = ["收縮壓", "舒張壓"],
+    colors: List[str] = ["#e74c3c", "#3498db"],
+    unit: str = "數值",
+    max_points: int = 500,
+) -> dict:
+    """
+    產生由瀏覽器繪製的圖表描述 (降採樣後的序列、參考線、標籤與單位)，不在伺服器繪圖。
+    x 為 ISO 日期字串 (缺值為 null)，各序列的 values 與 x 等長 (缺值為 null)。
+    """
+    columns, dates, series = _prepare_series(records, chart_type, columns, max_points)
+    palette = list(colors) + [c["color"] for c in _COLOR_CYCLE]
+    x = np.datetime_as_string(dates, unit="m")
+    return {
+        "type": chart_type,
+        "title": title,
+        "unit": unit,
+        "x": [None if d == "NaT" else d for d in x.tolist()],
+        "series": [{
+            "key": col,
+            "label": labels[i] if i < len(labels) else col,
+            "color": palette[i],
+            "values": [None if np.isnan(v) else round(v, 1) for v in values.tolist()],
+        } for i, (col, values) in enumerate(zip(columns, series))],
+        "thresholds": [{
+            "key": col,
+            "value": REFERENCE_LINES[col][0],
+            "color": REFERENCE_LINES[col][1],
+        } for col in columns if col in REFERENCE_LINES],
+        "points": len(dates),
+        "total": len(records),
+    }
+
+
+def render_health_chart(
+    records: HealthRecords,
+    title: str = "健康趨勢分析",
+    chart_type: str = "line",
+    columns: List[str] = ["sys", "dia"],
+    labels: List[str] = ["收縮壓", "舒張壓"],
+    colors: List[str] = ["#e74c3c", "#3498db"],
+    unit: str = "數值",
+    fmt: str = "png",
+    dpi: int = 100,
+    max_points: int = 500,
+) -> str:
+    """
+    以已解析的紀錄容器繪圖，回傳 data URI 或錯誤訊息 (參數同 render_chart_bytes)。
+    """
+    try:
+        data = render_chart_bytes(records, title, chart_type, columns, labels, colors, unit, fmt,
+                                  dpi, max_points)
+    except ChartDataError as e:
+        return str(e)
+    except Exception as e:
+        return f"圖表生成失敗: {str(e)}"
+    return f"data:{CHART_FORMATS[fmt][1]};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def render_chart_bytes(
+    records: HealthRecords,
+    title: str = "健康趨勢分析",
+    chart_type: str = "line",
+    columns: List[str] = ["sys", "dia"],
+    labels: List[str] = ["收縮壓", "舒張壓"],
+    colors: List[str] = ["#e74c3c", "#3498db"],
+    unit: str = "數值",
+    fmt: str = "png",
+    dpi: int = 100,
+    max_points: int = 500,
+) -> bytes:
+    """
+    以已解析的紀錄容器繪圖，回傳圖檔內容。
+    每次建立獨立的 Figure (不使用 pyplot 全域狀態)，可在多個執行緒中同時繪圖；
+    超過 max_points 的序列以 LTTB 降採樣。
+    """
+    if fmt not in CHART_FORMATS:
+        raise ChartDataError(f"圖表生成失敗: 不支援的格式 {fmt}")
+    columns, dates, series = _prepare_series(records, chart_type, columns, max_points)
+
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.set_prop_cycle(_COLOR_CYCLE)
+
+    #  核心繪圖邏輯：循環處理用戶要求的每一個指標
+    positions = np.arange(len(dates))
+    for i, (col, values) in enumerate(zip(columns, series)):
+        label = labels[i] if i < len(labels) else col
+        color = colors[i] if i < len(colors) else None
+
+        if chart_type == "bar":
+            # 多指標柱狀圖偏移計算
+            width = 0.8 / len(columns)
+            offset = (i - len(columns) / 2 + 0.5) * width
+            ax.bar(positions + offset, values, width, label=label, color=color, alpha=0.7)
+        elif chart_type == "scatter":
+            ax.scatter(dates, values, s=60, label=label, color=color, edgecolors="white",
+                       alpha=0.8)
+        else:  # line
+            ax.plot(dates, values, marker="o" if len(dates) <= 60 else None, label=label,
+                    color=color, linewidth=2)
+
+    if chart_type == "bar":
+        step = max(len(dates) // 20, 1)
+        ax.set_xticks(positions[::step])
+        ax.set_xticklabels(
+            [str(d)[5:10] for d in dates[::step]], rotation=45)
+    else:
+        fig.autofmt_xdate()
+
+    zh_font = get_zh_font()
+    ax.set_title(title, fontproperties=zh_font, fontsize=18, pad=16)
+    ax.set_xlabel("測量日期", fontproperties=zh_font, fontsize=12)
+    ax.set_ylabel(f"{unit}", fontproperties=zh_font, fontsize=12)
+    ax.legend(prop=zh_font, loc="upper right")
+    ax.grid(True, linestyle="--", alpha=0.5)
+    #  特殊參考線 (如果是血壓則保留標準線)
+    for col in columns:
+        if col in REFERENCE_LINES:
+            value, color = REFERENCE_LINES[col]
+            ax.axhline(y=value, color=color, linestyle=":", alpha=0.5)
+
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format=CHART_FORMATS[fmt][0], dpi=dpi, bbox_inches="tight")
+    return buf.getvalue()
+
+
+def init_render_worker():
+    """繪圖 worker 行程的初始化：預先載入字體，第一張圖不需等待"""
+    get_zh_font()
+
+
+def render_job(records: HealthRecords, params: dict) -> str:
+    """在 worker 行程中執行的繪圖工作 (參數需可 pickle)，回傳 data URI"""
+    return render_health_chart(records, **params)
+
+
+def render_bytes_job(records: HealthRecords, params: dict) -> bytes:
+    """在 worker 行程中執行的繪圖工作，回傳圖檔內容"""
+    return render_chart_bytes(records, **params)
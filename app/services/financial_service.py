@@ -1,13 +1,14 @@
 # app/services/financiak_service.py
 import os
+import asyncio
 from app.services.base import BaseAgent
 from deepagents import create_deep_agent
 from deepagents.backends.filesystem import FilesystemBackend
 from langgraph.graph import StateGraph, START, END
-from typing import TypedDict, List
+from typing import TypedDict, List, NotRequired
 from datetime import datetime
 from app.utils.logger import setup_logger
-from app.services.tools.financial_tools import get_stock_price, get_market_news
+from app.services.tools.financial_tools import get_stock_price, get_market_news, get_batch_stock_prices
 from app.services.tools.system_tools import load_specialized_skill
 
 logger = setup_logger("ApiRouter")
@@ -19,6 +20,9 @@ class FinanceState(TypedDict):
     analysis_report: str  # 分析師的評估
     risk_level: str  # 風險等級
     final_response: str  # 產出的最終建議內容
+    # 批次模式預先抓取的資料 (存在時研究節點不再重複呼叫工具)
+    price_info: NotRequired[str]
+    news_info: NotRequired[str]
 
 
 class FinancialAgentService(BaseAgent):
@@ -65,19 +69,28 @@ class FinancialAgentService(BaseAgent):
         # 研究節點：負責收集數據
         symbol = state["symbol"]
         logger.info(f"[Financial Agent] 正在研究: {symbol}")
-        # 格式校正：如果是 4 位數字，自動補後綴
-        search_symbol = symbol
-        if symbol.isdigit() and len(symbol) == 4:
-            search_symbol = f"{symbol}.TW"
-        search_query = f"{symbol} 股票 財經新聞"
-        # 執行工具
-        price_info = get_stock_price.invoke({"symbol": search_symbol})
-        news_info = get_market_news.invoke({"query": search_query})
+        # 執行工具 (批次模式已預先抓取時直接沿用)；同步工具移到執行緒，
+        # 讓多個 session 同時查詢同一檔股票時可由 singleflight 合併
+        price_info = state.get("price_info") or await asyncio.to_thread(
+            get_stock_price.invoke, {"symbol": self._search_symbol(symbol)})
+        news_info = state.get("news_info") or await asyncio.to_thread(
+            get_market_news.invoke, {"query": self._news_query(symbol)})
 
         # 彙整原始數據存入狀態
         combined_data = f"【股價數據】\n{price_info}\n\n【市場新聞】\n{news_info}"
         return {"data_raw": combined_data}
 
+    @staticmethod
+    def _search_symbol(symbol: str) -> str:
+        # 格式校正：如果是 4 位數字，自動補後綴
+        if symbol.isdigit() and len(symbol) == 4:
+            return f"{symbol}.TW"
+        return symbol
+
+    @staticmethod
+    def _news_query(symbol: str) -> str:
+        return f"{symbol} 股票 財經新聞"
+
     async def node_risk_analysis(self, state):
         logger.info("[Financial Agent] 正在進行風險評估...")
         skill_config = load_specialized_skill.invoke({"skill_name": "financial_expert"})
@@ -115,7 +128,7 @@ class FinancialAgentService(BaseAgent):
         return {"final_response": res.content}
 
     # 手動模式進入點
-    async def run_manual_logic(self, symbol: str):
+    async def run_manual_logic(self, symbol: str, prefetched: dict = None):
         logger.info(f"執行 [手動 LangGraph] 模式: {symbol}")
         initial_state = {
             "symbol": symbol,
@@ -123,6 +136,7 @@ class FinancialAgentService(BaseAgent):
             "analysis_report": "",
             "risk_level": "",
             "final_response": "",
+            **(prefetched or {}),
         }
         config = {
             "tags": ["financial_service", "manual_mode", f"symbol_{symbol}"],
@@ -134,8 +148,74 @@ class FinancialAgentService(BaseAgent):
         }
         return await self.manual_app.ainvoke(initial_state, config=config)
 
+    async def prefetch_market_data(self, symbols: List[str], concurrency: int = 5) -> dict:
+        """
+        批次模式：一次下載所有股價，新聞查詢則去重後以有限併發抓取。
+        回傳 {symbol: {"price_info": ..., "news_info": ...}}。
+        """
+        search_symbols = {symbol: self._search_symbol(symbol) for symbol in symbols}
+        unique_symbols = sorted(set(search_symbols.values()))
+        unique_queries = sorted({self._news_query(symbol) for symbol in symbols})
+        prices = await asyncio.to_thread(get_batch_stock_prices, unique_symbols)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_price(search_symbol):
+            if search_symbol in prices:
+                return prices[search_symbol]
+            # 批次下載缺漏時退回逐檔查詢
+            async with semaphore:
+                return await asyncio.to_thread(get_stock_price.invoke, {"symbol": search_symbol})
+
+        async def fetch_news(query):
+            async with semaphore:
+                return await asyncio.to_thread(get_market_news.invoke, {"query": query})
+
+        price_results, news_results = await asyncio.gather(
+            asyncio.gather(*(fetch_price(s) for s in unique_symbols)),
+            asyncio.gather(*(fetch_news(q) for q in unique_queries)),
+        )
+        price_map = dict(zip(unique_symbols, price_results))
+        news_map = dict(zip(unique_queries, news_results))
+        return {
+            symbol: {
+                "price_info": price_map[search_symbols[symbol]],
+                "news_info": news_map[self._news_query(symbol)],
+            }
+            for symbol in symbols
+        }
+
+    async def run_manual_batch(self, symbols: List[str], concurrency: int = 5):
+        """
+        批次 (Watchlist) 模式：共用行情與新聞抓取，再以有限併發執行 manual_app，
+        依完成順序逐檔 yield (symbol, result, error)。
+        """
+        logger.info(f"執行 [手動 LangGraph 批次] 模式: {len(symbols)} 檔")
+        prefetched = await self.prefetch_market_data(symbols, concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(symbol):
+            async with semaphore:
+                try:
+                    return symbol, await self.run_manual_logic(symbol, prefetched[symbol]), None
+                except Exception as e:
+                    logger.error(f"[Financial Agent] {symbol} 批次分析失敗: {e}")
+                    return symbol, None, str(e)
+
+        tasks = [asyncio.create_task(run_one(symbol)) for symbol in symbols]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
     # 官方 DeepAgents 模式進入點
-    async def run_official_deep_logic(self, symbol: str):
+    async def run_official_deep_logic(self, symbol: str, on_step=None):
+        """
+        on_step: (選填) async callback，每完成一個代理步驟 (模型推理 / 工具呼叫) 時呼叫，
+        供背景任務回報進度。
+        """
         logger.info(f"執行 [官方 DeepAgents] 模式: {symbol}")
         # 官方封裝通常使用標準的訊息格式
         input_data = {
@@ -154,10 +234,36 @@ class FinancialAgentService(BaseAgent):
                 "mode": "official"
             }
         }
-        result = await self.official_deep_agent.ainvoke(input_data, config=config)
+        if on_step is None:
+            result = await self.official_deep_agent.ainvoke(input_data, config=config)
+            steps = result.get("steps", [])
+        else:
+            result, steps = {}, []
+            async for mode, chunk in self.official_deep_agent.astream(
+                    input_data, config=config, stream_mode=["updates", "values"]):
+                if mode == "values":
+                    result = chunk
+                    continue
+                for node, update in (chunk or {}).items():
+                    step = self._describe_step(node, update)
+                    steps.append(step)
+                    await on_step(step)
         logger.debug(f"DEBUG OFFICIAL RESULT: {result}")
         # 提取最後一條訊息作為回應
         return {
             "final_response": result["messages"][-1].content,
-            "steps": result.get("steps", []),
+            "steps": steps,
         }
+
+    @staticmethod
+    def _describe_step(node: str, update) -> dict:
+        """將 DeepAgents 的節點更新轉為精簡的進度描述"""
+        details = []
+        messages = update.get("messages", []) if isinstance(update, dict) else []
+        for msg in messages:
+            tool_calls = getattr(msg, "tool_calls", None)
+            if tool_calls:
+                details.append("呼叫工具: " + ", ".join(tc["name"] for tc in tool_calls))
+            elif getattr(msg, "type", "") == "tool":
+                details.append(f"工具 {getattr(msg, 'name', '')} 已回傳")
+        return {"node": node, "detail": "; ".join(details) or node}
@@ -0,0 +1,157 @@
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import aiosqlite
+
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("HealthStore")
+
+# 結構變更時遞增；舊版本的快取資料表會被捨棄並重新向遠端同步
+_SCHEMA_VERSION = 2
+
+
+def _days(start_date: str, end_date: str) -> List[str]:
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+class HealthRecordStore:
+    """
+    以本地 SQLite 快取用戶的量測紀錄，並以「日」為單位記錄已同步的範圍 (coverage)。
+    - missing_ranges() 找出尚未同步或已過期的連續日期區間，只向遠端補抓這些區間
+    - 近期 (尚未穩定) 的日期使用短 TTL，量測日結束 settle_days 天後才同步的日期使用長 TTL
+    - 同步時整段替換該範圍的紀錄，遠端已刪除的量測也會一併移除
+    - 紀錄以 rowid 為鍵，同一時間的多筆量測 (例如連續量三次) 會全部保留
+    """
+
+    def __init__(self,
+                 db_path: str,
+                 recent_ttl_seconds: int = 120,
+                 settled_ttl_seconds: int = 7 * 86400,
+                 settle_days: int = 2):
+        self.db_path = db_path
+        self.recent_ttl_seconds = recent_ttl_seconds
+        self.settled_ttl_seconds = settled_ttl_seconds
+        self.settle_days = settle_days
+        self._conn: Optional[aiosqlite.Connection] = None
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._conn = await aiosqlite.connect(self.db_path)
+        self._conn.row_factory = aiosqlite.Row
+        async with self._conn.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        if version < _SCHEMA_VERSION:
+            # 僅為快取，直接捨棄舊結構，之後的查詢會重新同步
+            await self._conn.executescript("""
+                DROP TABLE IF EXISTS health_records;
+                DROP TABLE IF EXISTS health_coverage;""")
+            await self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        await self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS health_records (
+                user_id TEXT NOT NULL,
+                measured_at TEXT NOT NULL,
+                day TEXT NOT NULL,
+                sys INTEGER,
+                dia INTEGER,
+                pul INTEGER,
+                note TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_health_records_day ON health_records (user_id, day);
+            CREATE TABLE IF NOT EXISTS health_coverage (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (user_id, day)
+            );""")
+        await self._conn.commit()
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def _is_fresh(self, day: str, synced_at: float, now: float) -> bool:
+        day_end = datetime.combine(date.fromisoformat(day) + timedelta(days=1),
+                                   datetime.min.time()).timestamp()
+        settled = synced_at >= day_end + self.settle_days * 86400
+        ttl = self.settled_ttl_seconds if settled else self.recent_ttl_seconds
+        return now - synced_at < ttl
+
+    async def missing_ranges(self, user_id: str, start_date: str, end_date: str) -> List[tuple]:
+        """回傳需要向遠端同步的 (start, end) 區間列表"""
+        await self.open()
+        async with self._conn.execute(
+                "SELECT day, synced_at FROM health_coverage "
+                "WHERE user_id = ? AND day BETWEEN ? AND ?",
+            (user_id, start_date, end_date)) as cursor:
+            synced = {row["day"]: row["synced_at"] for row in await cursor.fetchall()}
+
+        now = time.time()
+        days = _days(start_date, end_date)
+        ranges = []
+        for day in days:
+            if day in synced and self._is_fresh(day, synced[day], now):
+                continue
+            if ranges and date.fromisoformat(ranges[-1][1]) + timedelta(days=1) == date.fromisoformat(day):
+                ranges[-1][1] = day
+            else:
+                ranges.append([day, day])
+
+        miss_days = sum(len(_days(s, e)) for s, e in ranges)
+        metrics.incr("health_store.hit_days", len(days) - miss_days)
+        metrics.incr("health_store.miss_days", miss_days)
+        return [tuple(r) for r in ranges]
+
+    async def replace_range(self,
+                            user_id: str,
+                            start_date: str,
+                            end_date: str,
+                            records: List[dict],
+                            complete: bool = True):
+        """以遠端結果取代該區間的本地紀錄；complete=False (例如被截斷) 時不標記為已同步"""
+        await self.open()
+        await self._conn.execute(
+            "DELETE FROM health_records WHERE user_id = ? AND day BETWEEN ? AND ?",
+            (user_id, start_date, end_date))
+        await self._conn.executemany(
+            "INSERT INTO health_records "
+            "(user_id, measured_at, day, sys, dia, pul, note) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(user_id, r["date"], r["date"][:10], r.get("sys"), r.get("dia"), r.get("pul"),
+              r.get("note", "")) for r in records if r.get("date")])
+        if complete:
+            now = time.time()
+            await self._conn.executemany(
+                "INSERT OR REPLACE INTO health_coverage (user_id, day, synced_at) VALUES (?, ?, ?)",
+                [(user_id, day, now) for day in _days(start_date, end_date)])
+        else:
+            await self._invalidate(user_id, start_date, end_date)
+        await self._conn.commit()
+
+    async def query(self, user_id: str, start_date: str, end_date: str) -> List[dict]:
+        await self.open()
+        async with self._conn.execute(
+                "SELECT measured_at, sys, dia, pul, note FROM health_records "
+                "WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY measured_at, rowid",
+            (user_id, start_date, end_date)) as cursor:
+            rows = await cursor.fetchall()
+        return [{
+            "date": row["measured_at"],
+            "sys": row["sys"],
+            "dia": row["dia"],
+            "pul": row["pul"],
+            "note": row["note"] or "",
+        } for row in rows]
+
+    async def _invalidate(self, user_id: str, start_date: Optional[str], end_date: Optional[str]):
+        if start_date and end_date:
+            await self._conn.execute(
+                "DELETE FROM health_coverage WHERE user_id = ? AND day BETWEEN ? AND ?",
+                (user_id, start_date, end_date))
+        else:
+            await self._conn.execute("DELETE FROM health_coverage WHERE user_id = ?", (user_id, ))
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+import aiosqlite
+
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+from app.utils.replay import RunStream
+
+logger = setup_logger("JobService")
+
+
+class JobQueueFull(Exception):
+    """任務佇列已滿"""
+
+
+class JobStore:
+    """以本地 SQLite 保存研究任務，重啟後仍可查詢已完成的結果"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[aiosqlite.Connection] = None
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._conn = await aiosqlite.connect(self.db_path)
+        self._conn.row_factory = aiosqlite.Row
+        await self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS research_jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                steps TEXT NOT NULL DEFAULT '[]',
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        await self._conn.commit()
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def insert(self, job: dict):
+        await self._conn.execute(
+            "INSERT INTO research_jobs (id, kind, payload, status, steps, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, '[]', ?, ?)",
+            (job["id"], job["kind"], json.dumps(job["payload"], ensure_ascii=False),
+             job["status"], job["created_at"], job["updated_at"]))
+        await self._conn.commit()
+
+    async def update(self, job_id: str, **fields):
+        for key in ("steps", "result"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False, default=str)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        await self._conn.execute(f"UPDATE research_jobs SET {columns} WHERE id = ?",
+                                 (*fields.values(), job_id))
+        await self._conn.commit()
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        async with self._conn.execute("SELECT * FROM research_jobs WHERE id = ?",
+                                      (job_id, )) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["steps"] = json.loads(job["steps"] or "[]")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    async def fail_unfinished(self, reason: str) -> int:
+        """上一次行程遺留的 queued / running 任務已無人執行，標記為失敗"""
+        cursor = await self._conn.execute(
+            "UPDATE research_jobs SET status = 'failed', error = ?, updated_at = ? "
+            "WHERE status IN ('queued', 'running')", (reason, time.time()))
+        await self._conn.commit()
+        return cursor.rowcount
+
+
+class ResearchJobManager:
+    """
+    研究任務的背景執行池：
+    - submit() 立即回傳 job_id，任務放入有界佇列
+    - 固定數量的 worker 依序執行，限制同時進行的代理數
+    - 進度步驟同時寫入 SQLite 與記憶體 RunStream，供輪詢或 SSE 串流
+    """
+
+    def __init__(self,
+                 store: JobStore,
+                 runners: Dict[str, Callable[[dict, Callable], Awaitable[dict]]],
+                 concurrency: int = 2,
+                 queue_size: int = 50):
+        self.store = store
+        self.runners = runners
+        self.concurrency = concurrency
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers: list[asyncio.Task] = []
+        self._streams: Dict[str, RunStream] = {}
+        # 佇列只會由 submit() 填入：持鎖完成「檢查容量 -> 寫入 SQLite -> 放入佇列」，
+        # 避免 await insert 期間其他請求搶走最後的空位
+        self._submit_lock = asyncio.Lock()
+
+    async def start(self):
+        await self.store.open()
+        stale = await self.store.fail_unfinished("服務重新啟動，任務已中斷")
+        if stale:
+            logger.warning(f"[Jobs] 已將 {stale} 筆中斷的任務標記為失敗")
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.concurrency)
+        ]
+        logger.info(f"[Jobs] 背景任務池已啟動，併發上限: {self.concurrency}")
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        if self._workers:
+            await asyncio.wait(self._workers)
+        self._workers = []
+        await self.store.close()
+
+    async def submit(self, kind: str, payload: dict) -> dict:
+        if kind not in self.runners:
+            raise ValueError(f"不支援的任務類型: {kind}")
+        async with self._submit_lock:
+            if self._queue.full():
+                metrics.incr("jobs.rejected")
+                raise JobQueueFull("研究任務佇列已滿，請稍後再試")
+
+            now = time.time()
+            job = {
+                "id": uuid.uuid4().hex,
+                "kind": kind,
+                "payload": payload,
+                "status": "queued",
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._streams[job["id"]] = RunStream(job["id"], kind, max_events=500)
+            await self.store.insert(job)
+            self._queue.put_nowait(job)
+        metrics.incr("jobs.submitted")
+        metrics.set_gauge("jobs.queued", self._queue.qsize())
+        return {"job_id": job["id"], "status": "queued"}
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.store.get(job_id)
+
+    def live_stream(self, job_id: str) -> Optional[RunStream]:
+        return self._streams.get(job_id)
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            metrics.set_gauge("jobs.queued", self._queue.qsize())
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: dict):
+        job_id = job["id"]
+        stream = self._streams[job_id]
+        steps = []
+
+        async def on_step(step: dict):
+            steps.append(step)
+            await self.store.update(job_id, steps=steps)
+            await stream.publish({"type": "step", "data": step})
+
+        logger.info(f"[Jobs] 開始執行任務 {job_id} ({job['kind']})")
+        await self.store.update(job_id, status="running")
+        await stream.publish({"type": "status", "content": "running"})
+        metrics.incr("jobs.started")
+        try:
+            result = await self.runners[job["kind"]](job["payload"], on_step)
+            await self.store.update(job_id, status="succeeded", result=result, steps=steps)
+            await stream.publish({"type": "final", "data": result})
+            metrics.incr("jobs.succeeded")
+        except asyncio.CancelledError:
+            await self.store.update(job_id, status="failed", error="任務已取消")
+            raise
+        except Exception as e:
+            logger.error(f"[Jobs] 任務 {job_id} 失敗: {e}", exc_info=True)
+            await self.store.update(job_id, status="failed", error=str(e))
+            await stream.publish({"type": "error", "content": str(e)})
+            metrics.incr("jobs.failed")
+        finally:
+            await stream.finish()
+            # 完成後結果以 SQLite 為準，記憶體串流不再保留
+            self._streams.pop(job_id, None)
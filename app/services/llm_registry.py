@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import ChatOpenAI
+from langchain_aws import ChatBedrock
+
+from app.core.config import settings
+from app.utils.llm_cache import SQLiteLLMCache
+from app.utils.logger import setup_logger
+
+logger = setup_logger("LLMRegistry")
+
+# 各 Provider 未指定模型時的預設值
+_DEFAULT_MODELS = {
+    "google": "gemini-2.5-flash",
+    "openai": "gpt-4o",
+}
+
+
+class LLMRegistry:
+    """
+    行程內共用的 LLM 用戶端池。
+    - 以 (provider, model, 參數) 為鍵快取 Chat Model，相同設定的服務共用同一個實例
+    - tier (例如 router / analysis) 對應 settings.llm_tier_models，未設定時沿用預設模型
+    - 同一 Provider 的不同模型共用底層 HTTP / boto3 用戶端 (Google 由 SDK 自行管理)
+    - 啟用 llm_cache_enabled 時，所有用戶端共用同一個 SQLite 回應快取
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple, object] = {}
+        self._transports: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._build_seconds = 0.0
+        self._cache: Optional[SQLiteLLMCache] = None
+
+    @property
+    def cache(self) -> Optional[SQLiteLLMCache]:
+        if not settings.llm_cache_enabled:
+            return None
+        if self._cache is None:
+            self._cache = SQLiteLLMCache(settings.llm_cache_db_path,
+                                         ttl_seconds=settings.llm_cache_ttl_seconds,
+                                         max_entries=settings.llm_cache_max_entries)
+        return self._cache
+
+    def has_tier(self, tier: str) -> bool:
+        """該層級是否另外指定了模型"""
+        return tier in settings.llm_tier_models
+
+    def resolve(self, tier: str = "default") -> Tuple[str, str]:
+        provider = settings.llm_provider.lower()
+        model = settings.llm_tier_models.get(tier) or settings.llm_model
+        if not model:
+            model = settings.aws_bedrock_model_id if provider == "bedrock" else _DEFAULT_MODELS.get(provider)
+        return provider, model
+
+    def get(self, tier: str = "default", **params):
+        """取得指定層級的 LLM 實例，params 會覆寫預設參數 (例如 temperature)"""
+        provider, model = self.resolve(tier)
+        params = {"temperature": settings.llm_temperature, **params}
+        key = (provider, model, tuple(sorted(params.items())))
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._hits += 1
+                return client
+
+            started = time.perf_counter()
+            client = self._build(provider, model, params)
+            if self.cache is not None:
+                client.cache = self.cache
+            elapsed = time.perf_counter() - started
+            self._clients[key] = client
+            self._misses += 1
+            self._build_seconds += elapsed
+        logger.info(f"[LLM] 建立 {provider}/{model} 用戶端 (tier: {tier})，耗時 {elapsed:.3f}s")
+        return client
+
+    def _build(self, provider: str, model: str, params: dict):
+        if provider == "google":
+            return ChatGoogleGenerativeAI(model=model,
+                                          google_api_key=settings.gemini_api_key,
+                                          **params)
+        elif provider == "openai":
+            transport = self._transports.get("openai")
+            if transport is None:
+                import httpx
+                limits = httpx.Limits(max_connections=settings.llm_max_connections,
+                                      max_keepalive_connections=settings.llm_max_connections)
+                transport = self._transports["openai"] = {
+                    "http_client": httpx.Client(limits=limits),
+                    "http_async_client": httpx.AsyncClient(limits=limits),
+                }
+            return ChatOpenAI(model=model,
+                              api_key=os.getenv("OPENAI_API_KEY"),
+                              **transport,
+                              **params)
+        elif provider == "bedrock":
+            transport = self._transports.get("bedrock", {})
+            llm = ChatBedrock(model_id=model,
+                              region_name=settings.aws_region,
+                              aws_access_key_id=settings.aws_access_key_id,
+                              aws_secret_access_key=settings.aws_secret_access_key,
+                              model_kwargs=params,
+                              **transport)
+            if not transport:
+                self._transports["bedrock"] = {
+                    "client": llm.client,
+                    "bedrock_client": llm.bedrock_client,
+                }
+            return llm
+        else:
+            raise ValueError(f"不支援的 LLM Provider: {provider}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "models": sorted({f"{k[0]}/{k[1]}" for k in self._clients}),
+                "hits": self._hits,
+                "misses": self._misses,
+                "build_seconds": round(self._build_seconds, 3),
+                "cache": self._cache.stats() if self._cache else None,
+            }
+
+    def clear(self):
+        """清空快取 (主要供測試使用)"""
+        with self._lock:
+            self._clients.clear()
+            self._transports.clear()
+            self._hits = self._misses = 0
+            self._build_seconds = 0.0
+
+
+# 全域單例物件
+llm_registry = LLMRegistry()
@@ -1,5 +1,3 @@
-import re
-import json
 from datetime import datetime
 from langgraph.types import Command
 from langgraph.graph import END
@@ -7,6 +5,12 @@ from app.services.tools.medical_tools import get_user_health_data
 from app.services.tools.system_tools import load_specialized_skill
 from app.services.medical.state import AgentState
 from app.utils.logger import setup_logger
+from app.utils.date_parser import parse_date_range
+from app.services.medical.records import store_records, resolve_record_set
+from app.utils.health_records import HealthRecords
+from app.utils.health_stats import build_analysis_input, detect_emergencies
+from app.utils.metrics import metrics
+from app.core.config import settings
 
 logger = setup_logger("AgentService")
 
@@ -15,8 +19,10 @@ from app.utils.prompt_manager import prompt_manager
 
 class HealthAnalystNodes:
 
-    def __init__(self, llm):
+    def __init__(self, llm, prefetcher=None):
         self.llm = llm
+        # HealthDataPrefetcher：Router 執行期間已預先抓取的數據
+        self.prefetcher = prefetcher
 
     async def node_check_date(self, state: AgentState):
         """
@@ -26,25 +32,25 @@ class HealthAnalystNodes:
         query_start = state.get("query_start")
         input_message = state.get("input_message", "")
 
-        # 簡單的日期提取邏輯 (例如: 2024-03-01 或 昨天/今天)
-        # 這裡假設如果輸入中包含數字或特定關鍵字，就視為有提供時間資訊
-        date_pattern = r"\d{4}-\d{2}-\d{2}|昨天|今天|前天|上週|這週|最近|剛才"
-        has_date_info = re.search(date_pattern, input_message)
-        
         # 只有在需要查詢數據的意圖下，才檢查日期
-        if intent in ["health_query", "health_analyst"]:
-            # 如果 Router 沒解析出日期，且訊息中也沒有明確的日期格式 (YYYY-MM-DD)
-            # 我們不再信任「最近」、「這週」等模糊詞彙，因為這會導致 API 抓取過多資料
-            strict_date_pattern = r"\d{4}-\d{2}-\d{2}"
-            has_strict_date = re.search(strict_date_pattern, input_message)
-            
-            if not query_start and not has_strict_date:
-                logger.info("[Validation] 缺失明確查詢日期，觸發中斷點。")
+        if intent in ["health_query", "health_analyst"] and not query_start:
+            # Router 沒解析出日期時，以本地解析器補上 (「最近」等沒有範圍的模糊說法不算)，
+            # 避免 API 抓取過多資料
+            date_range = parse_date_range(input_message)
+            if date_range:
+                logger.info(f"[Validation] 本地解析日期: {date_range[0]} ~ {date_range[1]}")
                 return {
-                    "final_response": "您想要查詢哪一段時間的紀錄呢？（例如：昨天、上週五，或具體日期如 2024-03-01）",
-                    "is_data_missing": True,
-                    "intent": "interrupt"
+                    "query_start": date_range[0],
+                    "query_end": date_range[1],
+                    "is_data_missing": False
                 }
+
+            logger.info("[Validation] 缺失明確查詢日期，觸發中斷點。")
+            return {
+                "final_response": "您想要查詢哪一段時間的紀錄呢？（例如：昨天、上週五，或具體日期如 2024-03-01）",
+                "is_data_missing": True,
+                "intent": "interrupt"
+            }
         
         return {"is_data_missing": False}
 
@@ -60,25 +66,36 @@ class HealthAnalystNodes:
         
         logger.info(f"[Debug] Fetching records for intent: {intent}, range: {start} ~ {end}")
 
-        # 呼叫工具 (此處不消耗 Gemini 配額)
-        raw_response = await get_user_health_data.ainvoke({
-            "user_id": user_id,
-            "start_date": start,
-            "end_date": end,
-        })
+        # 優先認領 Router 執行期間的預取結果，範圍不符時才自行呼叫工具 (此處不消耗 Gemini 配額)
+        raw_response = None
+        if self.prefetcher is not None:
+            raw_response = await self.prefetcher.adopt(user_id, start, end)
+        if raw_response is None:
+            raw_response = await get_user_health_data.ainvoke({
+                "user_id": user_id,
+                "start_date": start,
+                "end_date": end,
+            })
         
-        count = 0
-        records = []
-        try:
-            data = (json.loads(raw_response)
-                    if isinstance(raw_response, str) else raw_response)
-            if data.get("status") == "success":
-                records = data.get("history", [])
-                count = data.get("total", 0)
-        except Exception as e:
-            logger.error(f"[Fetch Error] JSON 解析失敗: {e}")
+        # 只在這裡解析一次，之後的節點共用同一個欄位式容器
+        records = HealthRecords.from_json(raw_response)
+        if records.status != "success":
+            logger.error(f"[Fetch Error] 取得紀錄失敗: {records.meta.get('message')}")
+            records = HealthRecords.empty()
+        count = records.total
+
+        # 紀錄寫入 blob store，State 只保存 handle，避免每個 superstep 都序列化整份 JSON
+        records_ref = None
+        if len(records):
+            records_ref = await store_records(user_id, records, start, end)
 
-        ui_data = {"records": records, "total": count}
+        # 本地規則先行判斷近期讀數的緊急狀況，不需等待 LLM 分析完成
+        alerts = detect_emergencies(records, settings.emergency_precheck_window_hours)
+        if alerts:
+            metrics.incr("emergency.precheck")
+            logger.warning(f"[Emergency] 用戶 {user_id} 命中緊急規則: {[a['rule'] for a in alerts]}")
+
+        ui_data = {"total": count}
         time_display = f"{start} 至 {end}" if start and end else "最近"
 
         # 如果是純查詢，準備好最終回覆 (由 Edge 決定是否結束)
@@ -89,9 +106,12 @@ class HealthAnalystNodes:
                 final_response = f"我在 {time_display} 期間找不到您的量測紀錄。"
             
         return {
-            "context_data": raw_response,
+            "context_data": None,
+            "records_ref": records_ref,
             "data_count": count,
             "is_data_missing": count == 0,
+            "is_emergency": bool(alerts),
+            "emergency_alerts": alerts or None,
             "ui_data": ui_data,
             "final_response": final_response
         }
@@ -101,73 +121,77 @@ class HealthAnalystNodes:
         醫學健康分析節點：負責獲取數據、執行 LLM 臨床分析並判斷風險等級。
         """
 
-        raw_data = state.get("context_data")
+        # blob 被回收時會重新抓取並換成新的 handle，需寫回 State
+        records, records_ref = await resolve_record_set(state)
         ui_data = state.get("ui_data")
         
-        if not raw_data or state.get("data_count", 0) == 0:
+        if records is None or state.get("data_count", 0) == 0:
             time_range = f"{state.get('query_start')} 至 {state.get('query_end')}"
             return {
                 "final_response": f"我在該時段（{time_range}）找不到您的紀錄，無法進行分析。",
                 "is_emergency": False,
-                "context_data": raw_data,
                 "is_data_missing": True
             }
             
-        data_list = []
-        parsed_json = {}
-        try:
-            # 假設 raw_data 是字串格式，先轉 JSON
-            parsed_json = (json.loads(raw_data)
-                           if isinstance(raw_data, str) else raw_data)
-            data_list = parsed_json.get("history", [])
-        except Exception as e:
-            logger.error(f"解析資料失敗: {e}")
-            data_list = []
-            
         # 若無資料，直接中斷流程並回覆
-        if not data_list:
+        if not len(records):
             time_range_str = f"{state.get('query_start')} 至 {state.get('query_end')}"
             return {
                 "final_response":
                 f"我在系統中找不到您在該時段（{time_range_str}）的量測紀錄。\n\n💡 **建議**：您可以檢查設備是否上傳成功，或嘗試查詢其他日期範圍。",
                 "is_emergency": False,
-                "context_data": raw_data,  # 依然存入 state 避免重複抓取
                 "is_data_missing": True
             }
         
+        precheck_alerts = state.get("emergency_alerts")
+        precheck_emergency = bool(precheck_alerts)
+        precheck_text = "未命中緊急規則"
+        if precheck_alerts:
+            precheck_text = "\n".join(
+                f"- {a['description']}：{a['count']} 筆，最近一筆 {a['latest']}" for a in precheck_alerts)
+
         # 從 State 讀取已經載入好的技能指令
         skill_info = state.get("skill_instructions") or "請根據數據進行專業分析。"
         
+        # 預設只傳統計摘要與有限抽樣，prompt 長度不隨讀數筆數線性成長
+        mode = settings.analyst_data_mode
+        data_block = build_analysis_input(records, mode, settings.analyst_sample_size)
+        metrics.incr(f"analyst.mode.{mode}")
+        metrics.set_gauge("analyst.last_data_chars", len(data_block))
+
         # 使用 PromptManager 模板
         prompt_template = prompt_manager.get_template("health_analyst")
         full_prompt = prompt_template.format_messages(
             skill_info=skill_info,
-            raw_data=raw_data,
+            raw_data=data_block,
+            precheck=precheck_text,
             input_message=state['input_message']
         )
         
         try:
             res = await self.llm.ainvoke(full_prompt)
             # 後續正常處理
-            can_visualize = len(data_list) >= 5
+            can_visualize = len(records) >= 5
             logger.debug(f"[LLM Raw] 分析師回覆原文: {res.content}")
             
-            is_emergency = "[EMERGENCY]" in res.content
+            # LLM 可確認或修正本地預檢結果：明確標示 [NORMAL] 時才解除預檢的警示
+            is_emergency = "[EMERGENCY]" in res.content or (
+                precheck_emergency and "[NORMAL]" not in res.content)
+            if precheck_emergency != is_emergency:
+                metrics.incr("emergency.llm_override")
             clean_content = res.content.replace("[EMERGENCY]",
                                                 "").replace("[NORMAL]", "")
 
             if can_visualize:
-                clean_content += "\n\n💡 **需要我為您繪製趨勢分析圖表嗎？**"
+                # 提議中明確寫出指標，使用者確認時 visualizer 可直接以規則決定繪圖參數
+                clean_content += "\n\n💡 **需要我為您繪製血壓趨勢圖表嗎？**"
 
             return {
                 "final_response": clean_content,
                 "analysis_summary": clean_content,
                 "is_emergency": is_emergency,
-                "context_data": raw_data,
-                "ui_data": ui_data or {
-                    "records": parsed_json.get("history", []),
-                    "total": parsed_json.get("total", 0)
-                },
+                "records_ref": records_ref,
+                "ui_data": ui_data or {"total": records.total},
                 "is_data_missing": False
             }
             
@@ -179,10 +203,8 @@ class HealthAnalystNodes:
             
             return {
                 "final_response": error_msg,
-                "is_emergency": False,
-                "ui_data": ui_data or {
-                    "records": parsed_json.get("history", []),
-                    "total": parsed_json.get("total", 0)
-                },
+                "is_emergency": precheck_emergency,
+                "records_ref": records_ref,
+                "ui_data": ui_data or {"total": records.total},
                 "is_data_missing": False # 雖然分析失敗，但有抓到數據，所以不是資料缺失
             }
@@ -0,0 +1,98 @@
+import re
+from typing import List, Optional
+
+import numpy as np
+
+from app.schemas.agent import ChartParams
+from app.utils.health_records import HealthRecords, VALUE_COLUMNS
+
+# 指標關鍵字 -> 欄位 (「血壓」代表收縮壓 + 舒張壓)
+_METRICS = [
+    (re.compile(r"心率|心跳|脈搏|脈率|pulse|heart\s*rate|\bbpm\b"), ("pul",)),
+    (re.compile(r"收縮壓|高壓|\bsys\b"), ("sys",)),
+    (re.compile(r"舒張壓|低壓|\bdia\b"), ("dia",)),
+    (re.compile(r"血壓|blood\s*pressure"), ("sys", "dia")),
+]
+# 圖表類型關鍵字
+_CHART_TYPES = [
+    (re.compile(r"長條|柱狀|直條|\bbar\b"), "bar"),
+    (re.compile(r"散佈|散布|散點|分布|分佈|scatter"), "scatter"),
+    (re.compile(r"折線|曲線|\bline\b"), "line"),
+]
+# 資料中沒有、需要 LLM 判斷的指標，以及排除語氣 (「不要心率」)
+_UNKNOWN_METRIC = re.compile(r"體重|血糖|體溫|血氧|膽固醇|bmi|weight|glucose|spo2")
+_NEGATION = re.compile(r"(不要|不用|不需要|除了|排除|去掉|拿掉|不含)\s*\S{0,2}(心率|心跳|脈搏|血壓|收縮壓|舒張壓)")
+# 分析摘要中提議繪圖的句子
+_CHART_OFFER = re.compile(r"[^。！？\n]*(圖|chart|plot)[^。！？\n]*")
+
+_LABELS = {"sys": "收縮壓", "dia": "舒張壓", "pul": "心率"}
+_UNITS = {"sys": "mmHg", "dia": "mmHg", "pul": "bpm"}
+_TITLE_SUFFIX = {"line": "趨勢", "bar": "對比", "scatter": "分布"}
+
+
+def _find_columns(text: str) -> List[str]:
+    columns = []
+    for pattern, cols in _METRICS:
+        if pattern.search(text):
+            columns.extend(c for c in cols if c not in columns)
+    return columns
+
+
+def _find_chart_types(text: str) -> set:
+    return {chart_type for pattern, chart_type in _CHART_TYPES if pattern.search(text)}
+
+
+def _has_data(records: HealthRecords, column: str) -> bool:
+    return bool((~np.isnan(records.column(column))).any())
+
+
+def infer_chart_params(message: str,
+                       records: HealthRecords,
+                       analysis_summary: Optional[str] = None) -> Optional[ChartParams]:
+    """
+    以規則推導繪圖參數，取代 visualizer 的 LLM 呼叫：
+    - 指標：用戶訊息 > 先前分析中提議繪圖的句子
+    - 類型：長條 / 散佈 / 折線關鍵字 (同樣依序參考訊息與提議)，未指定時為折線
+    - 只保留數據中確實有值的欄位
+    訊息與提議都沒有指名指標、遇到排除語氣、未知指標、互相衝突的圖表類型或指定的指標沒有數據時
+    回傳 None，交由 LLM 判斷。
+    """
+    text = message.strip().lower()
+    if _UNKNOWN_METRIC.search(text) or _NEGATION.search(text):
+        return None
+    # 用戶只回覆「好」等確認語時，以先前分析中最後一個提議繪圖的句子補足指標與類型
+    offer = ""
+    if analysis_summary:
+        offers = [m.group(0) for m in _CHART_OFFER.finditer(analysis_summary.lower())]
+        offer = offers[-1] if offers else ""
+        if _UNKNOWN_METRIC.search(offer):
+            return None
+
+    chart_types = _find_chart_types(text) or _find_chart_types(offer)
+    if len(chart_types) > 1:
+        return None
+    chart_type = chart_types.pop() if chart_types else "line"
+
+    columns = _find_columns(text)
+    explicit = bool(columns)
+    columns = columns or _find_columns(offer)
+    if not columns:
+        return None
+
+    available = [c for c in columns if c in VALUE_COLUMNS and _has_data(records, c)]
+    if not available or (explicit and len(available) < len(columns)):
+        return None
+
+    labels = [_LABELS[c] for c in available]
+    units = list(dict.fromkeys(_UNITS[c] for c in available))
+    name = "血壓" if available == ["sys", "dia"] else "、".join(labels)
+    title = f"{name}{_TITLE_SUFFIX[chart_type]}"
+    dates = records.column("date")
+    dates = dates[~np.isnat(dates)]
+    if dates.size:
+        title += f" ({str(dates.min())[:10]} ~ {str(dates.max())[:10]})"
+    return ChartParams(chart_type=chart_type,
+                       columns=available,
+                       labels=labels,
+                       unit=" / ".join(units),
+                       title=title)
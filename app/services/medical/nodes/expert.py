@@ -1,12 +1,20 @@
+import asyncio
+from app.core.config import settings
 from app.services.tools.system_tools import load_specialized_skill
 from app.services.tools.medical_tools import (
     get_device_knowledge,
-    plot_health_chart,
     get_user_health_data,
 )
+from app.services.chart_pool import chart_pool, ChartRenderBusy, ChartRenderTimeout
+from app.services.chart_cache import chart_cache
+from app.services.charts import CHART_SPEC_FORMAT, ChartDataError, build_chart_spec, image_format
 from app.schemas.agent import ChartParams
 from app.services.medical.state import AgentState
+from app.services.medical.records import resolve_record_set, store_records
+from app.services.medical.nodes.chart_inference import infer_chart_params
+from app.utils.health_records import HealthRecords
 from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
 
 logger = setup_logger("AgentService")
 
@@ -39,54 +47,116 @@ class ExpertNodes:
         res = await self.llm.ainvoke(full_prompt)
         return {"final_response": res.content}
 
+    async def _fetch_range(self, user_id: str, start, end):
+        """抓取指定區間的紀錄並寫入 blob store，回傳 (紀錄, handle)"""
+        logger.info(f"[Visualizer] 抓取繪圖區間 {start} ~ {end}")
+        records = HealthRecords.from_json(await get_user_health_data.ainvoke({
+            "user_id": user_id,
+            "start_date": start,
+            "end_date": end,
+        }))
+        if records.status != "success" or not len(records):
+            return HealthRecords.empty(), None
+        return records, await store_records(user_id, records, start, end)
+
     async def node_visualizer(self, state: AgentState):
         """繪圖專家節點：動態判斷指標並調用工具產出圖表"""
         # 取得數據
-        raw_data = state.get("context_data")
-        if not raw_data:
-            raw_data = await get_user_health_data.ainvoke({"user_id": state["user_id"]})
+        # 本輪指定了與 State 中紀錄不同的區間 (例如「畫上個月的圖」) 時重新抓取該區間，
+        # 否則沿用 State 中的紀錄 handle (例如上一輪分析過的區間)
+        start, end = state.get("query_start"), state.get("query_end")
+        ref = state.get("records_ref")
+        if (start or end) and not (ref and (ref.get("start"), ref.get("end")) == (start, end)):
+            records, records_ref = await self._fetch_range(state["user_id"], start, end)
+        else:
+            # blob 被回收時會重新抓取並換成新的 handle，需寫回 State
+            records, records_ref = await resolve_record_set(state)
+        if records is None:
+            records, records_ref = await self._fetch_range(state["user_id"], None, None)
             logger.warning(
                 f"[Visualizer] State 中無數據，已重新抓取用戶 {state['user_id']} 數據"
             )
+        # 沒有取得新 handle (例如抓取失敗) 時不覆寫 State 中原有的 records_ref
+        ref_update = {"records_ref": records_ref} if records_ref else {}
         # 取得用戶當前的需求
         user_intent = state["input_message"]
         analysis_summary = state.get("analysis_summary", "無先前的分析紀錄")
 
-        # 使用 with_structured_output 確保 LLM 回傳的是 ChartParams 物件而非字串
-        structured_llm = self.llm.with_structured_output(ChartParams)
-        # 升級指令：讓 LLM 決定要畫什麼指標，並參考先前的分析結果
-        data_sample = raw_data[:500]  # 擷取部分數據供 LLM 參考
-        
-        # 使用 PromptManager 模板
-        prompt_template = prompt_manager.get_template("visualizer")
-        full_prompt = prompt_template.format_messages(
-            user_intent=user_intent,
-            analysis_summary=analysis_summary,
-            data_sample=data_sample
-        )
+        params = None
+        if settings.chart_fast_path_enabled:
+            # 明確的需求 (指標、圖表類型) 以規則推導參數，這一輪只受繪圖時間影響
+            params = infer_chart_params(user_intent, records, state.get("analysis_summary"))
+        if params is not None:
+            metrics.incr("visualizer.fast_path")
+            logger.info(f"[Visualizer FastPath] {params.chart_type} {params.columns}")
+        else:
+            metrics.incr("visualizer.llm")
+            # 使用 with_structured_output 確保 LLM 回傳的是 ChartParams 物件而非字串
+            structured_llm = self.llm.with_structured_output(ChartParams)
+            # 升級指令：讓 LLM 決定要畫什麼指標，並參考先前的分析結果
+            data_sample = records.preview()  # 擷取部分數據供 LLM 參考
 
-        # 獲取 LLM 決策
-        params: ChartParams = await structured_llm.ainvoke(full_prompt)
-        # 執行繪圖工具 (傳入動態參數)
-        chart_base64 = plot_health_chart.invoke(
-            {
-                "data": raw_data,
-                "title": params.title,
-                "chart_type": params.chart_type,
-                "columns": params.columns,
-                "labels": params.labels,
-                "unit": params.unit,
-            }
-        )
+            # 使用 PromptManager 模板
+            prompt_template = prompt_manager.get_template("visualizer")
+            full_prompt = prompt_template.format_messages(
+                user_intent=user_intent,
+                analysis_summary=analysis_summary,
+                data_sample=data_sample
+            )
+
+            # 獲取 LLM 決策
+            params: ChartParams = await structured_llm.ainvoke(full_prompt)
 
-        # 封裝回傳
         chart_type_zh = {"line": "折線", "bar": "長條", "scatter": "散佈"}.get(
             params.chart_type, "趨勢"
         )
-        final_text = (
+        summary_text = (
             f"**已根據您的要求生成{chart_type_zh}圖表**：\n"
-            f"分析指標：{', '.join(params.labels)}\n\n"
-            f"![Health Chart]({chart_base64})"
+            f"分析指標：{', '.join(params.labels)}"
         )
+        fmt = state.get("chart_format") or settings.chart_format
+        if fmt == CHART_SPEC_FORMAT:
+            # 只回傳降採樣後的序列資料，由瀏覽器繪圖，伺服器不做任何點陣化
+            try:
+                spec = build_chart_spec(records,
+                                        title=params.title,
+                                        chart_type=params.chart_type,
+                                        columns=params.columns,
+                                        labels=params.labels,
+                                        unit=params.unit,
+                                        max_points=settings.chart_max_points)
+            except ChartDataError as e:
+                return {"final_response": str(e)}
+            metrics.incr("visualizer.client_spec")
+            return {"final_response": summary_text, "ui_data": {"chart": spec}, **ref_update}
+
+        # 相同數據與參數的圖表直接沿用快取；繪圖在行程池中執行，不阻塞其他對話的串流
+        chart_params = chart_pool.resolve_params({
+            "title": params.title,
+            "chart_type": params.chart_type,
+            "columns": params.columns,
+            "labels": params.labels,
+            "unit": params.unit,
+            "fmt": image_format(fmt),
+        })
+        digest = chart_cache.key(records, chart_params)
+        ext = chart_params["fmt"]
+        try:
+            if chart_cache.get(digest, ext) is None:
+                data = await chart_pool.render_bytes(records, **chart_params)
+                await asyncio.to_thread(chart_cache.put, digest, ext, data)
+        except (ChartRenderBusy, ChartRenderTimeout) as e:
+            logger.warning(f"[Visualizer] 繪圖未完成: {e}")
+            return {"final_response": "⚠️ 目前繪圖服務忙碌中，請稍後再試一次。"}
+        except ChartDataError as e:
+            return {"final_response": str(e)}
+        except Exception as e:
+            logger.error(f"[Visualizer] 繪圖失敗: {e}")
+            return {"final_response": f"圖表生成失敗: {e}"}
+        # 回應只保存圖表 URL，checkpoint 與 SSE 不再夾帶 base64 圖檔
+        chart_url = f"/api/v1/charts/{digest}.{ext}"
+
+        # 封裝回傳
+        final_text = f"{summary_text}\n\n![Health Chart]({chart_url})"
 
-        return {"final_response": final_text}
+        return {"final_response": final_text, **ref_update}
@@ -0,0 +1,115 @@
+import re
+from typing import Optional
+
+from app.utils.logger import setup_logger
+
+logger = setup_logger("AgentService")
+
+# 錯誤代碼 (例如 Err 3、ERR-1、error:2) 或明確詢問故障碼
+_ERROR_CODE = re.compile(r"(?<![a-z])err(?:or)?\s*[-:_]?\s*\d{1,3}|錯誤碼|錯誤代碼|故障碼")
+# 問候與道謝，整句只有這些內容時才成立
+_GREETING = re.compile(
+    r"(你好|您好|哈囉|嗨|hi|hello|hey|早安|午安|晚安|謝謝|感謝|多謝|thanks|thank you|掰掰|再見|bye)"
+    r"(啊|呀|喔|囉|你|您|啦)*")
+# 繪圖相關用語 (以詞為單位，避免「畫面」「計畫」等詞被誤判)
+_CHART_TERMS = r"畫圖|畫出|畫個|畫張|畫一[張個下]|幫我畫|幫忙畫|請畫|畫.{0,8}圖|繪製|繪圖|圖表|趨勢圖|chart|plot"
+# AI 上一句話是否在詢問要不要繪圖
+_CHART_OFFER = re.compile(_CHART_TERMS)
+_QUESTION = re.compile(r"[？?]|嗎")
+# 對繪圖提議的確認 / 拒絕：整句 (去除標點後) 只有這些短語與語助詞時才成立
+_REPLY_PARTICLES = r"(?:的|啊|呀|吧|喔|哦|囉|啦|了|呢|你|您|謝謝|感謝)*"
+_AFFIRM = re.compile(r"(?:(?:好|可以|要|確認|確定|ok|okay|yes|sure|嗯|對|是|麻煩|沒問題|行|畫吧|請畫|幫我畫|畫)"
+                     + _REPLY_PARTICLES + r")+")
+_DECLINE = re.compile(r"(?:(?:不用|不要|不需要|先不用|先不要|暫時不用|算了|免了|no|不)" + _REPLY_PARTICLES + r")+")
+# 直接要求畫圖
+_CHART_REQUEST = re.compile(_CHART_TERMS)
+# 需要評估 (health_analyst) 而非單純查詢 (health_query) 的用語
+_ANALYSIS = re.compile(r"分析|評估|正常|異常|偏高|偏低|太高|太低|怎麼樣|如何|為什麼|建議|風險|嚴重")
+_PUNCT = re.compile(r"[\s，。！？、,.!?~～…]+")
+
+# 各意圖在規則命中時的信心分數
+_CONFIDENCE = {
+    "confirm_chart": 0.95,
+    "decline_chart": 0.9,
+    "error_code": 0.95,
+    "greeting": 0.95,
+    "device_keyword": 0.85,
+    "chart_request": 0.85,
+    # 數據查詢需要日期：本地解析出日期才直接採用，否則交給 LLM
+    "health_keyword": 0.6,
+    "health_keyword_dated": 0.9,
+    "follow_up_date": 0.85,
+}
+_HEALTH_INTENTS = ("health_query", "health_analyst")
+
+
+class FastRouter:
+    """
+    Router 的規則式前置分類器，在呼叫 LLM 之前處理明顯的意圖：
+    - 用戶對「要不要畫圖」的確認 / 拒絕
+    - 錯誤代碼與設備關鍵字 (關鍵字來自 skills/registry.json 的 keywords 欄位)
+    - 單純的問候與道謝
+    - 健康數據關鍵字或延續上一輪數據查詢的追問 (搭配本地解析的日期區間)
+    回傳 (intent, confidence, reason)；無法判斷時回傳 None，由 LLM 處理。
+    """
+
+    def __init__(self, valid_ids: list, skills_registry: Optional[dict] = None):
+        self.valid_ids = set(valid_ids)
+        self.keywords = {}
+        for skill in (skills_registry or {}).get("skills", []):
+            words = [w.lower() for w in skill.get("keywords", [])]
+            if words:
+                self.keywords[skill["id"]] = sorted(words, key=len, reverse=True)
+
+    def classify(self,
+                 message: str,
+                 last_ai_message: str = "",
+                 last_intent: Optional[str] = None,
+                 date_range: Optional[tuple] = None) -> Optional[tuple]:
+        text = message.strip().lower()
+        compact = _PUNCT.sub("", text)
+        if not compact:
+            return None
+
+        # 1. 回應上一輪的繪圖提議
+        if last_ai_message and _CHART_OFFER.search(last_ai_message) and _QUESTION.search(
+                last_ai_message[-20:]):
+            if _DECLINE.fullmatch(compact):
+                return self._result("general", "decline_chart", "用戶拒絕繪圖提議")
+            if _AFFIRM.fullmatch(compact):
+                return self._result("visualizer", "confirm_chart", "用戶同意繪圖提議")
+
+        # 2. 錯誤代碼
+        if _ERROR_CODE.search(text):
+            return self._result("device_expert", "error_code", "訊息包含設備錯誤代碼")
+
+        # 3. 問候 / 道謝
+        if _GREETING.fullmatch(compact):
+            return self._result("general", "greeting", "單純的問候或道謝")
+
+        # 4. 技能關鍵字 (設備關鍵字先比對並移除，避免「血壓計」被當成「血壓」)
+        remaining = text
+        device_hits = [w for w in self.keywords.get("device_expert", []) if w in remaining]
+        for word in device_hits:
+            remaining = remaining.replace(word, " ")
+        health_hits = [w for w in self.keywords.get("health_analyst", []) if w in remaining]
+
+        if _CHART_REQUEST.search(text) and not device_hits:
+            return self._result("visualizer", "chart_request", "用戶要求繪製圖表")
+        if device_hits and not health_hits:
+            return self._result("device_expert", "device_keyword",
+                                f"命中設備關鍵字: {device_hits[0]}")
+        if health_hits and not device_hits:
+            intent = "health_analyst" if _ANALYSIS.search(text) else "health_query"
+            rule = "health_keyword_dated" if date_range else "health_keyword"
+            return self._result(intent, rule, f"命中健康數據關鍵字: {health_hits[0]}")
+
+        # 5. 只補充日期的追問 (例如「那昨天呢？」)，延續上一輪的數據查詢意圖
+        if date_range and not device_hits and last_intent in _HEALTH_INTENTS:
+            return self._result(last_intent, "follow_up_date", "延續上一輪的數據查詢並更換日期")
+        return None
+
+    def _result(self, intent: str, rule: str, reason: str) -> Optional[tuple]:
+        if intent not in self.valid_ids:
+            return None
+        return intent, _CONFIDENCE[rule], reason
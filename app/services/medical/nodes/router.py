@@ -4,6 +4,10 @@ from datetime import datetime
 from langchain_core.messages import AIMessage
 from app.services.medical.state import AgentState
 from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+from app.core.config import settings
+from app.services.medical.nodes.fast_router import FastRouter
+from app.utils.date_parser import parse_date_range
 from langgraph.types import Command
 
 logger = setup_logger("AgentService")
@@ -18,6 +22,8 @@ class RouterOutput(BaseModel):
     query_end: Optional[str] = Field(
         default=None, description="解析出的查詢結束日期，格式為 YYYY-MM-DD")
     reasoning: str = Field(description="判定意圖與日期的簡短理由")
+    confidence: Optional[float] = Field(
+        default=None, description="規則式判斷的信心分數 (0~1)，LLM 不需填寫")
 
 
 from app.utils.prompt_manager import prompt_manager
@@ -25,12 +31,38 @@ from app.services.tools.system_tools import load_specialized_skill
 
 class RouterNode:
 
-    def __init__(self, llm, manifest: str, valid_ids: list):
+    def __init__(self, llm, manifest: str, valid_ids: list, skills_registry: Optional[dict] = None):
         self.llm = llm
         self.manifest = manifest
         self.valid_ids = valid_ids
+        self.fast_router = FastRouter(valid_ids, skills_registry)
 
-    async def node_router(self, state: AgentState) -> dict:
+    @staticmethod
+    def _parse_dates(message: str) -> Optional[tuple]:
+        """本地解析日期區間；中斷恢復時補充的日期優先於原始訊息"""
+        original, _, supplement = message.partition("(補充資訊:")
+        return parse_date_range(supplement) or parse_date_range(original)
+
+    def _fast_path(self, message: str, last_ai_message: str, last_intent: Optional[str],
+                   date_range: Optional[tuple]) -> Optional[RouterOutput]:
+        """規則式前置分類，信心分數達門檻時直接採用，不呼叫 LLM"""
+        if not settings.router_fast_path_enabled:
+            return None
+        result = self.fast_router.classify(message, last_ai_message, last_intent, date_range)
+        if result is None:
+            return None
+        intent, confidence, reason = result
+        if confidence < settings.router_fast_path_min_confidence:
+            logger.info(f"[Router FastPath] {intent} 信心不足 ({confidence})，交由 LLM 判斷")
+            return None
+        query_start, query_end = date_range if date_range else (None, None)
+        return RouterOutput(intent=intent,
+                            query_start=query_start,
+                            query_end=query_end,
+                            reasoning=reason,
+                            confidence=confidence)
+
+    async def node_router(self, state: AgentState) -> Command:
         """統一意圖路由：合併意圖判定與日期解析"""
         user_input = state["input_message"].strip().lower()
         current_date = datetime.now().strftime("%Y-%m-%d")
@@ -44,20 +76,35 @@ class RouterNode:
             "query_start": None,
             "query_end": None,
             "is_data_missing": False,
+            "is_emergency": False,
+            "emergency_alerts": None,
             "final_response": "",
             "last_processed_input": user_input
         }
 
-        # 1. 獲取最後一則 AI 訊息作為上下文參考
+        # 1. 獲取上一輪的 AI 回覆作為上下文參考
+        # 節點只寫入 final_response (不會 append AIMessage)，messages 中沒有 AI 訊息時改用上一輪的 final_response
         last_ai_message = ""
         if state.get("messages"):
             for m in reversed(state["messages"]):
                 if isinstance(m, AIMessage):
-                    last_ai_message = m.content
+                    last_ai_message = m.content if isinstance(m.content, str) else str(m.content)
                     break
+        if not last_ai_message and state.get("final_response"):
+            previous = state["final_response"]
+            last_ai_message = previous if isinstance(previous, str) else str(previous)
 
-        # 2. LLM 統一判斷邏輯 (Structured Output)
         last_intent = state.get("last_intent", "general")
+        date_range = self._parse_dates(state["input_message"])
+        fast = self._fast_path(state["input_message"], last_ai_message, last_intent, date_range)
+        if fast is not None:
+            metrics.incr("router.fast_path")
+            metrics.incr(f"router.fast_path.{fast.intent}")
+            logger.info(f"[Router FastPath] 識別意圖: {fast.intent} ({fast.confidence}) - {fast.reasoning}")
+            return Command(update=self._build_update(reset_fields, fast))
+        metrics.incr("router.llm")
+
+        # 2. LLM 統一判斷邏輯 (Structured Output)
         structured_llm = self.llm.with_structured_output(RouterOutput)
 
         # 從 PromptManager 獲取模板
@@ -72,26 +119,32 @@ class RouterNode:
 
         try:
             res: RouterOutput = await structured_llm.ainvoke(full_prompt)
-            final_intent = res.intent
+            if date_range:
+                # 本地解析的日期是確定性的結果，優先於 LLM 的推算
+                res.query_start, res.query_end = date_range
             logger.info(
-                f"[Router Decision] 識別意圖: {final_intent}, 解析日期: {res.query_start} ~ {res.query_end}"
+                f"[Router Decision] 識別意圖: {res.intent}, 解析日期: {res.query_start} ~ {res.query_end}"
             )
-
-            # 動態準備 Skill 指令 (Skill Prep)
-            skill_instructions = None
-            if final_intent in ["health_analyst", "device_expert"]:
-                skill_instructions = load_specialized_skill.invoke(
-                    {"skill_name": final_intent})
-
-            # 合併重置欄位與新解析的結果
-            return {
-                **reset_fields,
-                "intent": final_intent,
-                "last_intent": final_intent,
-                "query_start": res.query_start,
-                "query_end": res.query_end,
-                "skill_instructions": skill_instructions,
-            }
+            return Command(update=self._build_update(reset_fields, res))
         except Exception as e:
             logger.error(f"[Router Error] LLM 呼叫失敗: {e}")
-            return {**reset_fields, "intent": "general"}
+            return Command(update={**reset_fields, "intent": "general"})
+
+    def _build_update(self, reset_fields: dict, res: RouterOutput) -> dict:
+        final_intent = res.intent
+
+        # 動態準備 Skill 指令 (Skill Prep)
+        skill_instructions = None
+        if final_intent in ["health_analyst", "device_expert"]:
+            skill_instructions = load_specialized_skill.invoke(
+                {"skill_name": final_intent})
+
+        # 合併重置欄位與新解析的結果
+        return {
+            **reset_fields,
+            "intent": final_intent,
+            "last_intent": final_intent,
+            "query_start": res.query_start,
+            "query_end": res.query_end,
+            "skill_instructions": skill_instructions,
+        }
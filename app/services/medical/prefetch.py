@@ -0,0 +1,113 @@
+import asyncio
+import re
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.medical.nodes.fast_router import FastRouter
+from app.services.tools.medical_tools import get_user_health_data
+from app.utils.date_parser import parse_date_range
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("AgentService")
+
+_HEALTH_INTENTS = ("health_query", "health_analyst")
+# 規則無法判斷意圖時，訊息看起來與量測數據有關才值得預取
+_DATA_HINT = re.compile(r"血壓|心率|心跳|脈搏|紀錄|記錄|數據|數值|量測|測量|狀況|狀態|健康")
+
+
+def _drop(task: asyncio.Task):
+    """取消不再需要的預取；已失敗的 Task 取出例外，避免 "exception was never retrieved" """
+    if task.done():
+        if not task.cancelled():
+            task.exception()
+    else:
+        task.cancel()
+
+
+class HealthDataPrefetcher:
+    """
+    在 Router LLM 執行期間預先抓取健康數據 (speculative prefetch)。
+    - 只針對含明確日期、但 FastRouter 無法以足夠信心判斷 (即將呼叫 Router LLM) 的訊息；
+      規則已能決定意圖時 fetch_records 緊接著執行，預取沒有可重疊的延遲
+    - 規則傾向數據查詢、訊息含數據相關用語或上一輪是數據查詢時才啟動
+    - fetch_records 以相同的 (user_id, start, end) 認領結果 (命中)；範圍不同時捨棄
+    - 本輪結束仍未被認領的預取視為浪費，只取消等待 (共用的遠端請求由 SingleFlight 保護)
+    """
+
+    def __init__(self, fast_router: FastRouter):
+        self.fast_router = fast_router
+        self._pending: Dict[str, Tuple[tuple, asyncio.Task]] = {}
+
+    def maybe_start(self,
+                    user_id: str,
+                    message: str,
+                    last_intent: Optional[str] = None,
+                    awaiting_date: bool = False) -> bool:
+        """判斷是否值得預取；awaiting_date 表示正在回覆日期中斷 (意圖已確定為數據查詢)"""
+        date_range = parse_date_range(message)
+        if not date_range:
+            return False
+        if not awaiting_date:
+            result = None
+            if settings.router_fast_path_enabled:
+                result = self.fast_router.classify(message, last_intent=last_intent,
+                                                   date_range=date_range)
+            if result and result[1] >= settings.router_fast_path_min_confidence:
+                # Router 不會呼叫 LLM，沒有可以重疊的等待時間
+                return False
+            if result and result[0] not in _HEALTH_INTENTS:
+                return False
+            if not result and not (_DATA_HINT.search(message) or last_intent in _HEALTH_INTENTS):
+                return False
+
+        self.discard(user_id)
+        start, end = date_range
+        task = asyncio.create_task(
+            get_user_health_data.ainvoke({
+                "user_id": user_id,
+                "start_date": start,
+                "end_date": end
+            }))
+        self._pending[user_id] = ((start, end), task)
+        metrics.incr("prefetch.started")
+        logger.info(f"[Prefetch] 預先抓取用戶 {user_id} 數據: {start} ~ {end}")
+        return True
+
+    async def adopt(self, user_id: str, start: Optional[str], end: Optional[str]) -> Optional[str]:
+        """fetch_records 呼叫：範圍相符時回傳預取結果，否則回傳 None 由節點自行抓取"""
+        pending = self._pending.pop(user_id, None)
+        if pending is None:
+            return None
+        key, task = pending
+        if key != (start, end):
+            metrics.incr("prefetch.mismatched")
+            _drop(task)
+            return None
+        try:
+            result = await task
+        except Exception as exc:
+            logger.warning(f"[Prefetch] 預取失敗，改由節點重新抓取: {exc}")
+            metrics.incr("prefetch.errors")
+            return None
+        metrics.incr("prefetch.hits")
+        return result
+
+    def discard(self, user_id: str):
+        """本輪結束時呼叫，未被認領的預取計為浪費"""
+        pending = self._pending.pop(user_id, None)
+        if pending is not None:
+            metrics.incr("prefetch.wasted")
+            _drop(pending[1])
+
+    def stats(self) -> dict:
+        started = metrics.get("prefetch.started")
+        hits = metrics.get("prefetch.hits")
+        return {
+            "pending": len(self._pending),
+            "started": started,
+            "hits": hits,
+            "mismatched": metrics.get("prefetch.mismatched"),
+            "wasted": metrics.get("prefetch.wasted"),
+            "hit_rate": round(hits / started, 3) if started else None,
+        }
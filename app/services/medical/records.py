@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.core.config import settings
+from app.services.blob_store import BlobStore
+from app.services.tools.medical_tools import get_user_health_data
+from app.utils.health_records import HealthRecords
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("AgentService")
+
+# 量測紀錄的內容定址儲存 (由 FastAPI lifespan 開啟與關閉)
+record_blobs = BlobStore(settings.record_blob_db_path,
+                         gc_grace_seconds=settings.record_blob_gc_grace_seconds)
+
+# 已解析的紀錄容器 (blob hash -> HealthRecords)，同一份數據在分析、繪圖與回傳時只解析一次
+_PARSED_CACHE_SIZE = 32
+_parsed: "OrderedDict[str, HealthRecords]" = OrderedDict()
+
+
+def _remember(digest: str, records: HealthRecords):
+    _parsed[digest] = records
+    _parsed.move_to_end(digest)
+    while len(_parsed) > _PARSED_CACHE_SIZE:
+        _parsed.popitem(last=False)
+
+
+async def store_records(user_id: str, records: HealthRecords, start: Optional[str],
+                        end: Optional[str]) -> dict:
+    """寫入已解析的紀錄，回傳存入 State 的 handle"""
+    digest = await record_blobs.put(user_id, records.to_json())
+    _remember(digest, records)
+    return {"hash": digest, "user_id": user_id, "start": start, "end": end, "count": records.total}
+
+
+async def _refetch(ref: dict) -> Tuple[HealthRecords, dict]:
+    """blob 已被回收：依 handle 的範圍重新抓取，並以與 store_records 相同的序列化重新寫入"""
+    logger.warning(f"[Records] handle {ref['hash'][:12]} 已失效，重新抓取 {ref['start']} ~ {ref['end']}")
+    metrics.incr("records.refetches")
+    raw = await get_user_health_data.ainvoke({
+        "user_id": ref["user_id"],
+        "start_date": ref["start"],
+        "end_date": ref["end"],
+    })
+    records = HealthRecords.from_json(raw)
+    new_ref = await store_records(ref["user_id"], records, ref["start"], ref["end"])
+    return records, new_ref
+
+
+async def load_records(state: dict) -> Optional[str]:
+    """
+    解析 State 中的紀錄 handle，取回原始 JSON 字串。
+    blob 已被回收時依 handle 的範圍重新抓取；舊版 State 則沿用 context_data。
+    """
+    ref = state.get("records_ref")
+    if not ref:
+        return state.get("context_data")
+
+    raw = await record_blobs.get(ref["hash"])
+    if raw is not None:
+        return raw
+    records, _ = await _refetch(ref)
+    return records.to_json()
+
+
+async def resolve_record_set(state: dict) -> Tuple[Optional[HealthRecords], Optional[dict]]:
+    """
+    回傳 (解析後的紀錄, 目前有效的 handle)，解析結果依 blob hash 快取。
+    blob 被回收而重新抓取時 handle 會換成新的 hash，節點應將它寫回 State 的 records_ref，
+    之後的讀取才不會每次都重新抓取。
+    """
+    ref = state.get("records_ref")
+    if ref and ref["hash"] in _parsed:
+        metrics.incr("records.parse_cache_hits")
+        _parsed.move_to_end(ref["hash"])
+        return _parsed[ref["hash"]], ref
+
+    if not ref:
+        raw = state.get("context_data")
+        if not raw:
+            return None, None
+        metrics.incr("records.parses")
+        return HealthRecords.from_json(raw), None
+
+    raw = await record_blobs.get(ref["hash"])
+    if raw is None:
+        return await _refetch(ref)
+    records = HealthRecords.from_json(raw)
+    metrics.incr("records.parses")
+    _remember(ref["hash"], records)
+    return records, ref
+
+
+async def load_record_set(state: dict) -> Optional[HealthRecords]:
+    """與 load_records 相同，但回傳解析後的 HealthRecords (依 blob hash 快取)"""
+    records, _ = await resolve_record_set(state)
+    return records
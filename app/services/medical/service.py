@@ -1,4 +1,6 @@
 import asyncio
+import hashlib
+from typing import Optional
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
@@ -8,11 +10,15 @@ from contextlib import AsyncExitStack
 from app.services.base import BaseAgent
 
 from app.utils.logger import setup_logger
+from app.utils.date_parser import parse_date_range
 from app.utils.registry_loader import load_skills_registry, get_manifest_for_prompt
 from app.services.medical.nodes.router import RouterNode
 from app.services.medical.nodes.analyst import HealthAnalystNodes
 from app.services.medical.nodes.expert import ExpertNodes
 from app.services.medical.state import AgentState
+from app.services.medical.records import load_record_set
+from app.services.medical.prefetch import HealthDataPrefetcher
+from app.core.config import settings
 
 logger = setup_logger("AgentService")
 
@@ -27,6 +33,11 @@ class MedicalAgentService(BaseAgent):
         self.db_path = "./state_db.sqlite"
         self.memory = None
         self.app = None
+        # Mermaid 圖只在編譯後生成一次，以內容雜湊作為版本號
+        self.graph_mermaid = None
+        self.graph_version = None
+        self._graph_nodes = set()
+        self.prefetcher = None
         self._exit_stack: AsyncExitStack = AsyncExitStack()
         self._init_lock = asyncio.Lock()
 
@@ -37,8 +48,26 @@ class MedicalAgentService(BaseAgent):
                     AsyncSqliteSaver.from_conn_string(self.db_path))
                 workflow = self._build_workflow()
                 self.app = workflow.compile(checkpointer=self.memory)
+                self._cache_graph_diagram()
                 logger.info("[System] LangGraph App 已編譯並啟用 Checkpointer")
 
+    def _cache_graph_diagram(self):
+        """為已編譯的 Graph 生成一次 Mermaid 原始碼並計算版本號"""
+        graph = self.app.get_graph()
+        self.graph_mermaid = graph.draw_mermaid()
+        self.graph_version = hashlib.sha256(
+            self.graph_mermaid.encode("utf-8")).hexdigest()[:12]
+        self._graph_nodes = set(graph.nodes)
+        logger.info(f"[System] Mermaid 流程圖已快取，版本: {self.graph_version}")
+
+    async def get_graph_diagram(self) -> dict:
+        """回傳快取的流程圖，供 /graph 端點使用"""
+        if self.app is None:
+            await self.initialize()
+        if self.graph_version is None:
+            self._cache_graph_diagram()
+        return {"version": self.graph_version, "mermaid": self.graph_mermaid}
+
     def _build_workflow(self):
         graph = StateGraph(AgentState)
         manifest = get_manifest_for_prompt(self.skills_registry)
@@ -46,8 +75,11 @@ class MedicalAgentService(BaseAgent):
         valid_ids.extend(
             ["visualizer", "general", "health_analyst", "health_query"])
 
-        router_manager = RouterNode(self.llm, manifest, valid_ids)
-        analyst = HealthAnalystNodes(self.llm)
+        # 路由使用便宜的 router 層級，健康分析使用 analysis 層級 (未設定時皆為預設模型)
+        router_manager = RouterNode(self.get_llm("router"), manifest, valid_ids,
+                                    self.skills_registry)
+        self.prefetcher = HealthDataPrefetcher(router_manager.fast_router)
+        analyst = HealthAnalystNodes(self.get_llm("analysis"), self.prefetcher)
         expert = ExpertNodes(self.llm)
 
         # 定義節點
@@ -128,11 +160,22 @@ class MedicalAgentService(BaseAgent):
                     "question": question,
                     "missing_field": "date_range"
                 })
-                # 恢復執行後，強行跳轉回 router 重新解析
+                supplemented = f"{state['input_message']} (補充資訊: {user_input})"
+                date_range = parse_date_range(str(user_input))
+                if date_range:
+                    # 補充的日期可直接解析時，不必回到 router 再呼叫一次 LLM
+                    logger.info(f"[Resume] 已解析補充日期: {date_range[0]} ~ {date_range[1]}")
+                    return {
+                        "input_message": supplemented,
+                        "is_data_missing": False,
+                        "query_start": date_range[0],
+                        "query_end": date_range[1]
+                    }
+                # 無法解析時，強行跳轉回 router 重新解析
                 return Command(
                     goto="router",
                     update={
-                        "input_message": f"{state['input_message']} (補充資訊: {user_input})",
+                        "input_message": supplemented,
                         "is_data_missing": False,
                         "query_start": None,
                         "query_end": None
@@ -165,65 +208,108 @@ class MedicalAgentService(BaseAgent):
             return "".join(text_parts)
         return str(content) if content else ""
 
-    async def handle_chat(self, user_id: str, message: str):
+    async def _hydrate_ui_data(self, final_output: dict):
+        """State 只保存紀錄 handle，推送給前端前才解析出完整紀錄"""
+        ui_data = final_output.get("ui_data")
+        if not ui_data or "records" in ui_data or "chart" in ui_data:
+            return ui_data
+        records = await load_record_set(final_output)
+        if records is None:
+            return ui_data
+        return {**ui_data, "records": records.to_history()}
+
+    async def handle_chat(self, user_id: str, message: str, chart_format: Optional[str] = None):
         """ 串流處理邏輯 """
         if self.app is None:
             await self.initialize()
+        if self.graph_version is None:
+            self._cache_graph_diagram()
 
         config = {"configurable": {"thread_id": user_id}}
         state = await self.app.aget_state(config)
 
-        if state.next:
+        # 只有在等待 interrupt 回覆時才 resume；若上一輪是被取消的執行 (next 有值但沒有中斷)，
+        # 則以新的輸入重新開始，捨棄未完成的節點
+        has_interrupt = any(task.interrupts for task in state.tasks)
+        if settings.speculative_prefetch_enabled:
+            # 與 Router LLM 並行抓取數據，由 fetch_records 認領
+            self.prefetcher.maybe_start(user_id, message,
+                                        last_intent=state.values.get("last_intent"),
+                                        awaiting_date=bool(state.next and has_interrupt))
+        if state.next and has_interrupt:
             logger.info(f"[Resume] 恢復執行 Thread: {user_id}")
-            input_data = Command(resume=message)
+            # 本次請求指定的圖表格式隨 resume 一併寫入，未指定時沿用原本的設定
+            update = {"chart_format": chart_format} if chart_format else None
+            input_data = Command(resume=message, update=update)
         else:
+            if state.next:
+                logger.info(f"[Recover] Thread {user_id} 上一輪執行未完成，捨棄節點 {state.next} 並重新開始")
             input_data = {
                 "user_id": user_id,
                 "input_message": message,
                 "messages": [HumanMessage(content=message)],
+                "chart_format": chart_format,
             }
 
-        async for event in self.app.astream_events(input_data, config, version="v2"):
-            kind = event["event"]
-            node_name = event.get("metadata", {}).get("langgraph_node", "")
-
-            if kind == "on_chat_model_stream":
-                if node_name == "router":
-                    continue
-                # 關鍵修正：標準化內容格式
-                content = self._normalize_content(event["data"]["chunk"].content)
-                if content:
-                    yield {"type": "stream", "content": content}
-
-            elif kind == "on_chain_start":
-                name = event.get("name", "")
-                if name == "router":
-                    yield {"type": "status", "content": "正在分析您的意圖..."}
-                elif name == "fetch_records":
-                    yield {"type": "status", "content": "正在查詢健康數據庫..."}
-                elif name == "health_analyst":
-                    yield {"type": "status", "content": "正在進行醫學數據分析..."}
-                
-                mermaid_graph = self.app.get_graph().draw_mermaid()
-                yield {"type": "graph", "content": mermaid_graph, "node": name}
+        try:
+            async for event in self.app.astream_events(input_data, config, version="v2"):
+                kind = event["event"]
+                node_name = event.get("metadata", {}).get("langgraph_node", "")
+
+                if kind == "on_chat_model_stream":
+                    if node_name == "router":
+                        continue
+                    # 關鍵修正：標準化內容格式
+                    content = self._normalize_content(event["data"]["chunk"].content)
+                    if content:
+                        yield {"type": "stream", "content": content}
+
+                elif kind == "on_chain_start":
+                    name = event.get("name", "")
+                    if name == "router":
+                        yield {"type": "status", "content": "正在分析您的意圖..."}
+                    elif name == "fetch_records":
+                        yield {"type": "status", "content": "正在查詢健康數據庫..."}
+                    elif name == "health_analyst":
+                        yield {"type": "status", "content": "正在進行醫學數據分析..."}
+
+                    # 只推送節點增量事件，流程圖本身由前端透過 /graph 端點取得一次
+                    if name == node_name and name in self._graph_nodes:
+                        yield {"type": "node", "node": name, "graph_version": self.graph_version}
+
+                elif kind == "on_chain_end" and event["name"] == "fetch_records" == node_name:
+                    # 本地規則命中時立即推送警示，不等分析師 LLM 完成
+                    output = event["data"].get("output")
+                    alerts = output.get("emergency_alerts") if isinstance(output, dict) else None
+                    if alerts:
+                        yield {
+                            "type": "emergency",
+                            "content": "⚠️ 偵測到血壓或心率數值異常，請立即尋求專業醫療協助或撥打急救電話。",
+                            "alerts": alerts
+                        }
 
-            elif kind == "on_chain_end" and event["name"] == "LangGraph":
-                final_output = event["data"]["output"]
-                mermaid_graph = self.app.get_graph().draw_mermaid()
-                
-                if isinstance(final_output, dict) and "final_response" in final_output:
-                    # 關鍵修正：標準化最終回覆內容
-                    final_text = self._normalize_content(final_output.get("final_response", ""))
-                    compat_data = {
-                        "text": final_text,
-                        "graph": mermaid_graph,
-                        "intent": final_output.get("intent", "general"),
-                        "is_emergency": final_output.get("is_emergency", False),
-                        "ui_data": final_output.get("ui_data")
-                    }
-                    yield {"type": "final", "data": compat_data}
-                else:
-                    yield {"type": "graph", "content": mermaid_graph}
+                elif kind == "on_chain_end" and event["name"] == "LangGraph":
+                    final_output = event["data"]["output"]
+
+                    if isinstance(final_output, dict) and "final_response" in final_output:
+                        # 關鍵修正：標準化最終回覆內容
+                        final_text = self._normalize_content(final_output.get("final_response", ""))
+                        ui_data = await self._hydrate_ui_data(final_output)
+                        compat_data = {
+                            "text": final_text,
+                            "graph_version": self.graph_version,
+                            "intent": final_output.get("intent", "general"),
+                            "is_emergency": final_output.get("is_emergency", False),
+                            "ui_data": ui_data
+                        }
+                        yield {"type": "final", "data": compat_data}
+        except asyncio.CancelledError:
+            # 客戶端斷線時由 API 層取消；Checkpointer 只保存已完成的 superstep，
+            # 下一輪會透過上方的 Recover 流程重新開始
+            logger.warning(f"[Cancel] Thread {user_id} 的執行已被取消")
+            raise
+        finally:
+            self.prefetcher.discard(user_id)
 
         new_state = await self.app.aget_state(config)
         if new_state.next and new_state.tasks:
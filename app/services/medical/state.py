@@ -29,11 +29,17 @@ class AgentState(TypedDict):
 
     # 風險標記
     is_emergency: Annotated[bool, last_value]
+    # 本地規則 (health_stats.EMERGENCY_RULES) 命中的緊急讀數，於 fetch_records 產生
+    emergency_alerts: Annotated[Optional[List[Dict[str, Any]]], last_value]
 
     # API 查詢參數與結果
     query_start: Annotated[Optional[str], last_value]
     query_end: Annotated[Optional[str], last_value]
-    context_data: Annotated[Optional[str], last_value]  # 存放 API 回傳的原始 JSON 字串
+    context_data: Annotated[Optional[str], last_value]  # 舊版：API 回傳的原始 JSON 字串
+    # 量測紀錄的 handle (hash, user_id, start, end, count)，內容存放於 blob store
+    records_ref: Annotated[Optional[Dict[str, Any]], last_value]
+    # 本輪請求指定的圖表輸出格式 (png / webp / svg / json)，None 時使用設定檔預設值
+    chart_format: Annotated[Optional[str], last_value]
     # 存放結構化 UI 數據
     ui_data: Annotated[Optional[Dict[str, Any]], last_value]
     # 存放上一次分析的摘要，供後續節點（如視覺化）參考
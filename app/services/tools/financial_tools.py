@@ -1,6 +1,7 @@
 import yfinance as yf
 from langchain.tools import tool
 from app.utils.logger import setup_logger
+from app.utils.singleflight import SingleFlight
 from duckduckgo_search import DDGS
 
 logger = setup_logger("FinancialTools")
@@ -38,13 +39,11 @@ def get_market_news(query: str) -> str:
         return f"目前無法獲取 {query} 的即時新聞（搜尋引擎繁忙），請根據歷史數據進行分析。"
 
 
-# 股價工具 (結構化數據)
-@tool
-def get_stock_price(symbol: str) -> str:
-    """
-    獲取指定股票代號（Symbol）的最新股價、漲跌幅與貨幣。
-    範例：'AAPL' (美股), '2330.TW' (台股)。
-    """
+# 相同代號的並行股價查詢只打一次 yfinance
+price_flight = SingleFlight("stock_price")
+
+
+def _fetch_stock_price(symbol: str) -> str:
     logger.info(f"[Tool: Finance] 正在抓取股價: {symbol}")
     try:
         stock = yf.Ticker(symbol)
@@ -61,3 +60,52 @@ def get_stock_price(symbol: str) -> str:
     except Exception as e:
         logger.error(f"股價獲取失敗: {e}")
         return f"無法獲取 {symbol} 的股價數據。"
+
+
+# 股價工具 (結構化數據)
+@tool
+def get_stock_price(symbol: str) -> str:
+    """
+    獲取指定股票代號（Symbol）的最新股價、漲跌幅與貨幣。
+    範例：'AAPL' (美股), '2330.TW' (台股)。
+    """
+    return price_flight.do_sync(symbol.strip().upper(), lambda: _fetch_stock_price(symbol))
+
+
+# 依交易所後綴推定幣別 (批次下載不含 info 欄位)
+_SUFFIX_CURRENCY = {".TW": "TWD", ".TWO": "TWD", ".HK": "HKD", ".T": "JPY", ".SS": "CNY", ".SZ": "CNY"}
+
+
+def get_batch_stock_prices(symbols: list[str]) -> dict[str, str]:
+    """
+    以單次 yfinance 批次下載取得多檔股票的最新股價與漲跌幅。
+    回傳格式與 get_stock_price 相同；下載失敗或缺資料的代號不會出現在結果中，
+    由呼叫端退回逐檔查詢。
+    """
+    if not symbols:
+        return {}
+    logger.info(f"[Tool: Finance] 批次抓取股價: {len(symbols)} 檔")
+    try:
+        df = yf.download(symbols, period="5d", group_by="ticker",
+                         progress=False, threads=True, multi_level_index=True)
+    except Exception as e:
+        logger.error(f"批次股價獲取失敗: {e}")
+        return {}
+    if df is None or df.empty:
+        return {}
+
+    results = {}
+    for symbol in symbols:
+        try:
+            closes = df[symbol]["Close"].dropna()
+        except KeyError:
+            continue
+        if closes.empty:
+            continue
+        current_price = closes.iloc[-1]
+        prev_close = closes.iloc[-2] if len(closes) > 1 else current_price
+        change = ((current_price - prev_close) / prev_close) * 100
+        suffix = "." + symbol.rsplit(".", 1)[-1].upper() if "." in symbol else ""
+        currency = _SUFFIX_CURRENCY.get(suffix, "USD")
+        results[symbol] = f"{symbol} 當前價: {current_price:.2f} {currency} (當日漲跌: {change:+.2f}%)"
+    return results
@@ -1,20 +1,21 @@
 # app/services/tools/medical_tools.py
 import os
+import time
+import asyncio
 import httpx
 import json
-import io
-import base64
-import matplotlib.pyplot as plt
-import pandas as pd
-from typing import Literal, Optional
+from typing import AsyncIterator, List, Literal, Optional
 from sqlalchemy import text
 from datetime import datetime, timedelta
 from langchain.tools import tool
-from matplotlib.font_manager import FontProperties, fontManager
-from typing import List, Literal
-from functools import lru_cache
 from app.core.config import settings
 from app.utils.logger import setup_logger
+from app.utils.http_client import PooledHttpClient
+from app.services.health_store import HealthRecordStore
+from app.utils.metrics import metrics
+from app.utils.singleflight import SingleFlight
+from app.utils.health_records import HealthRecords
+from app.services.charts import image_format, render_health_chart
 
 # 根據 provider 動態載入
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
@@ -26,6 +27,32 @@ from langchain_aws import BedrockEmbeddings
 # 初始化 Logger
 logger = setup_logger("MedicalTools")
 
+# 外部 BPM API 的共用連線池 (由 FastAPI lifespan 建立與關閉)
+bpm_client = PooledHttpClient(
+    name="bpm_api",
+    base_url=settings.external_api_url,
+    headers={
+        "Authorization": f"Bearer {settings.external_api_token}",
+        "Content-Type": "application/json",
+    },
+    timeout=settings.external_api_timeout,
+    connect_timeout=settings.external_api_connect_timeout,
+    max_connections=settings.external_api_max_connections,
+    max_keepalive=settings.external_api_max_keepalive,
+    keepalive_expiry=settings.external_api_keepalive_expiry,
+    http2=settings.external_api_http2,
+    retries=settings.external_api_retries,
+    backoff=settings.external_api_retry_backoff)
+
+# 相同 (user_id, start, end) 的並行查詢共用同一次遠端請求
+health_flight = SingleFlight("health_data")
+
+# 本地量測紀錄快取 (由 FastAPI lifespan 關閉)
+health_store = HealthRecordStore(settings.health_cache_db_path,
+                                 recent_ttl_seconds=settings.health_cache_recent_ttl_seconds,
+                                 settled_ttl_seconds=settings.health_cache_settled_ttl_seconds,
+                                 settle_days=settings.health_cache_settle_days)
+
 
 def get_active_embeddings():
     provider = os.getenv("EMBEDDING_PROVIDER", "google").lower()
@@ -149,6 +176,160 @@ async def get_device_knowledge(query: str) -> str:
     return "\n\n".join(results)
 
 
+class BpmApiError(Exception):
+    """遠端 BPM API 回應非 200"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"遠端伺服器回應異常 ({status_code})")
+        self.status_code = status_code
+
+
+def _clean_records(items: list) -> list:
+    """移除已刪除或無效的量測，只保留分析需要的欄位"""
+    clean_history = []
+    for item in items:
+        if item.get("data_type") == "delete" or item.get("sys") == 0:
+            continue
+        clean_history.append({
+            "date": item.get("date"),
+            "sys": item.get("sys"),
+            "dia": item.get("dia"),
+            "pul": item.get("pul"),
+            "note": item.get("note", ""),
+        })
+    return clean_history
+
+
+def _split_date_windows(start_date: str, end_date: str, window_days: int) -> List[tuple]:
+    """將長區間切成多個日期視窗，由新到舊排列 (達到筆數上限時優先保留近期數據)"""
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    windows = []
+    while end >= start:
+        window_start = max(start, end - timedelta(days=max(window_days, 1) - 1))
+        windows.append((window_start.isoformat(), end.isoformat()))
+        end = window_start - timedelta(days=1)
+    return windows
+
+
+async def _fetch_page(start_date: str, end_date: str, offset: int, limit: int) -> dict:
+    params = {
+        "start": start_date,
+        "end": end_date,
+        "limit": limit,
+        "offset": offset,
+        "time_type": 1,  # 依量測時間搜尋
+    }
+    started = time.perf_counter()
+    response = await bpm_client.get("/api/get_bpm_history_data", params=params)
+    metrics.incr("bpm_api.pages")
+    metrics.set_gauge("bpm_api.last_page_ms", round((time.perf_counter() - started) * 1000, 1))
+    if response.status_code != 200:
+        logger.error(f"[API Error] 狀態碼: {response.status_code} (offset={offset})")
+        metrics.incr("bpm_api.page_errors")
+        raise BpmApiError(response.status_code)
+    return response.json()
+
+
+class HealthRecordPager:
+    """
+    分頁讀取量測紀錄，pages() 逐頁回傳整理後的紀錄。
+    每個日期視窗先讀第一頁取得 total_num，其餘頁面以有限併發同時抓取；
+    累計達 max_records 時停止並取消尚未完成的頁面 (truncated 設為 True)。
+    """
+
+    def __init__(self,
+                 start_date: str,
+                 end_date: str,
+                 page_size: int = 100,
+                 concurrency: int = 4,
+                 max_records: int = 2000,
+                 window_days: int = 90):
+        self.windows = _split_date_windows(start_date, end_date, window_days)
+        self.page_size = page_size
+        self.concurrency = max(concurrency, 1)
+        self.max_records = max_records
+        self.total = 0
+        self.fetched = 0
+        self.truncated = False
+
+    def _accept(self, items: list) -> list:
+        self.fetched += len(items)
+        metrics.incr("bpm_api.records", len(items))
+        return _clean_records(items)
+
+    async def pages(self) -> AsyncIterator[list]:
+        for index, (window_start, window_end) in enumerate(self.windows):
+            first = await _fetch_page(window_start, window_end, 0, self.page_size)
+            items = first.get("data", [])
+            window_total = first.get("total_num", 0)
+            self.total += window_total
+            yield self._accept(items)
+
+            # 只排程到上限為止需要的頁面
+            remaining = min(window_total, len(items) + self.max_records - self.fetched)
+            offsets = list(range(len(items), remaining, self.page_size)) if items else []
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(offset: int, start=window_start, end=window_end):
+                async with semaphore:
+                    return await _fetch_page(start, end, offset, self.page_size)
+
+            tasks = [asyncio.create_task(fetch(offset)) for offset in offsets]
+            try:
+                for next_page in asyncio.as_completed(tasks):
+                    page = await next_page
+                    yield self._accept(page.get("data", []))
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            if self.fetched >= self.max_records:
+                self.truncated = remaining < window_total or index < len(self.windows) - 1
+                if self.truncated:
+                    metrics.incr("bpm_api.truncated")
+                return
+
+
+async def _fetch_remote(start_date: str, end_date: str) -> tuple:
+    """向遠端分頁讀取，回傳 (records, total, truncated)"""
+    pager = HealthRecordPager(start_date,
+                              end_date,
+                              page_size=settings.health_fetch_page_size,
+                              concurrency=settings.health_fetch_concurrency,
+                              max_records=settings.health_fetch_max_records,
+                              window_days=settings.health_fetch_window_days)
+    records = []
+    async for page in pager.pages():
+        records.extend(page)
+    records.sort(key=lambda r: r["date"] or "")
+    if pager.truncated:
+        logger.warning(f"[API Fetch] 已達單次查詢上限 {pager.max_records} 筆，其餘紀錄未載入")
+    return records, pager.total, pager.truncated
+
+
+async def _fetch_with_cache(user_id: str, start_date: str, end_date: str) -> tuple:
+    """只向遠端補抓本地快取缺少或過期的區間，再從本地合併查詢"""
+    truncated = False
+    missing = await health_store.missing_ranges(user_id, start_date, end_date)
+    if missing:
+        logger.info(f"[Health Cache] 用戶 {user_id} 需同步區間: {missing}")
+    for range_start, range_end in missing:
+        records, _, partial = await _fetch_remote(range_start, range_end)
+        await health_store.replace_range(user_id, range_start, range_end, records,
+                                         complete=not partial)
+        truncated = truncated or partial
+    history = await health_store.query(user_id, start_date, end_date)
+    return history, len(history), truncated
+
+
+async def _load_health_records(user_id: str, start_date: str, end_date: str) -> tuple:
+    if settings.health_cache_enabled:
+        return await _fetch_with_cache(user_id, start_date, end_date)
+    return await _fetch_remote(start_date, end_date)
+
+
 @tool
 async def get_user_health_data(user_id: str,
                                start_date: Optional[str] = None,
@@ -175,86 +356,31 @@ async def get_user_health_data(user_id: str,
         base_date = datetime.strptime(end_date, "%Y-%m-%d")
         start_date = (base_date - timedelta(days=7)).strftime("%Y-%m-%d")
 
-    # 準備 API 請求
-    api_url = f"{settings.external_api_url}/api/get_bpm_history_data"
-    params = {
-        "start": start_date,
-        "end": end_date,
-        "limit": 100,  # 動態查詢時，可以稍微放寬筆數限制
-        "offset": 0,
-        "time_type": 1,  # 依量測時間搜尋
-    }
-
-    headers = {
-        "Authorization": f"Bearer {settings.external_api_token}",
-        "Content-Type": "application/json",
-    }
-
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(api_url,
-                                        headers=headers,
-                                        params=params)
-
-            if response.status_code != 200:
-                logger.error(f"[API Error] 狀態碼: {response.status_code}")
-                return json.dumps({"status": "error", "message": "遠端伺服器回應異常"})
-
-            raw_res = response.json()
-
-            # 數據整理
-            clean_history = []
-            for item in raw_res.get("data", []):
-                if item.get("data_type") == "delete" or item.get("sys") == 0:
-                    continue
-                clean_history.append({
-                    "date": item.get("date"),
-                    "sys": item.get("sys"),
-                    "dia": item.get("dia"),
-                    "pul": item.get("pul"),
-                    "note": item.get("note", ""),
-                })
-
-            formatted_data = {
-                "status": "success",
-                "userId": user_id,
-                "range": {
-                    "start": start_date,
-                    "end": end_date,
-                },  # 回傳給 LLM 讓它知道最終查了什麼範圍
-                "history": clean_history,
-                "total": raw_res.get("total_num", 0),
-            }
-
-            logger.info(f"[API Success] 成功解析 {len(clean_history)} 筆量測紀錄")
-            logger.debug(f"[Debug] API 原始內容: {formatted_data}")
-            return json.dumps(formatted_data, ensure_ascii=False)
-
+        history, total, truncated = await health_flight.do(
+            (user_id, start_date, end_date),
+            lambda: _load_health_records(user_id, start_date, end_date))
+    except BpmApiError:
+        return json.dumps({"status": "error", "message": "遠端伺服器回應異常"})
     except httpx.RequestError as exc:
         logger.error(f"[API Network Error] 連線失敗: {exc}")
         return json.dumps({"status": "error", "message": "網路連線失敗，無法取得數據"})
 
+    formatted_data = {
+        "status": "success",
+        "userId": user_id,
+        "range": {
+            "start": start_date,
+            "end": end_date,
+        },  # 回傳給 LLM 讓它知道最終查了什麼範圍
+        "history": history,
+        "total": total,
+        "truncated": truncated,
+    }
 
-@lru_cache(maxsize=1)
-def get_zh_font():
-    """只有在需要繪圖時才執行的字體加載邏輯"""
-    DOCKER_FONT_PATH = "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc"
-    try:
-        if os.path.exists(DOCKER_FONT_PATH):
-            return FontProperties(fname=DOCKER_FONT_PATH)
-
-        # 搜尋系統中的 Noto Sans
-        noto_font = next(
-            (f.fname
-             for f in fontManager.ttflist if "Noto Sans CJK" in f.name), None)
-        if noto_font:
-            return FontProperties(fname=noto_font)
-
-        # 安全退場機制：使用系統預設
-        return FontProperties(family=['sans-serif'])
-    except Exception as e:
-        logger.warning(f"字體加載失敗，使用預設值: {e}")
-        return FontProperties(family=['sans-serif'])
+    logger.info(f"[API Success] 成功解析 {len(history)} 筆量測紀錄")
+    logger.debug(f"[Debug] API 原始內容: {formatted_data}")
+    return json.dumps(formatted_data, ensure_ascii=False)
 
 
 @tool
@@ -273,90 +399,9 @@ def plot_health_chart(
     labels: 對應欄位的中文名稱 (例如 ['體重'] 或 ['收縮壓', '舒張壓'])
     unit: Y 軸的單位標籤 (例如 'kg', 'mmHg', 'mg/dL')
     """
-    try:
-        #  數據解析
-        raw_json = json.loads(data)
-        history = raw_json.get("history", [])
-        if not history:
-            return "數據量不足，無法生成圖表。"
-
-        df = pd.DataFrame(history)
-        df["date"] = pd.to_datetime(df["date"])
-        df = df.sort_values("date")
-
-        #  畫布初始化
-        plt.figure(figsize=(12, 7), dpi=150)
-        plt.style.use("seaborn-v0_8-muted")
-
-        #  核心繪圖邏輯：循環處理用戶要求的每一個指標
-        for i, col in enumerate(columns):
-            if col not in df.columns:
-                continue
-
-            label = labels[i] if i < len(labels) else col
-            color = colors[i] if i < len(colors) else None
-
-            if chart_type == "bar":
-                # 多指標柱狀圖偏移計算
-                width = 0.8 / len(columns)
-                offset = (i - len(columns) / 2 + 0.5) * width
-                plt.bar(
-                    range(len(df)),
-                    df[col],
-                    width,
-                    label=label,
-                    color=color,
-                    alpha=0.7,
-                    align="center",
-                )
-                plt.xticks(range(len(df)),
-                           df["date"].dt.strftime("%m-%d"),
-                           rotation=45)
-
-            elif chart_type == "scatter":
-                plt.scatter(
-                    df["date"],
-                    df[col],
-                    s=80,
-                    label=label,
-                    color=color,
-                    edgecolors="white",
-                    alpha=0.8,
-                )
-
-            else:  # line
-                plt.plot(
-                    df["date"],
-                    df[col],
-                    marker="o",
-                    label=label,
-                    color=color,
-                    linewidth=2,
-                )
-        zh_font = get_zh_font()
-        #  圖表通用設定 (使用你之前修正的 zh_font)
-        plt.title(title, fontproperties=zh_font, fontsize=20, pad=20)
-        plt.xlabel("測量日期", fontproperties=zh_font, fontsize=12)
-        plt.ylabel(f"{unit}", fontproperties=zh_font, fontsize=12)
-        plt.legend(prop=zh_font, loc="upper right")
-        plt.grid(True, linestyle="--", alpha=0.5)
-        #  特殊參考線 (如果是血壓則保留標準線)
-        if "sys" in columns:
-            plt.axhline(y=120, color="#c0392b", linestyle=":", alpha=0.5)
-        if "dia" in columns:
-            plt.axhline(y=80, color="#2980b9", linestyle=":", alpha=0.5)
-
-        plt.tight_layout()
-
-        # 輸出 Base64
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png", bbox_inches="tight")
-        plt.close()
-        buf.seek(0)
-        return f"data:image/png;base64,{base64.b64encode(buf.read()).decode('utf-8')}"
-
-    except Exception as e:
-        return f"圖表生成失敗: {str(e)}"
+    return render_health_chart(HealthRecords.from_json(data), title, chart_type, columns, labels,
+                               colors, unit, fmt=image_format(settings.chart_format), dpi=settings.chart_dpi,
+                               max_points=settings.chart_max_points)
 
 
 # @tool
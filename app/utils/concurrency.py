@@ -0,0 +1,126 @@
+import asyncio
+from typing import Dict
+
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("RunLimiter")
+
+
+class RunQueueFull(Exception):
+    """排隊已滿，呼叫端應回覆 429 並附上 Retry-After"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _ThreadEntry:
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.reserved = 0  # 執行中 + 排隊中的請求數
+
+
+class RunSlot:
+    """
+    一次 Graph 執行的名額。reserve() 時立即檢查容量，
+    async with 進入時才真正等待 thread 鎖與全域名額。release() 可重複呼叫。
+    """
+
+    def __init__(self, limiter: "RunLimiter", key: str, entry: _ThreadEntry):
+        self._limiter = limiter
+        self.key = key
+        self.entry = entry
+        self.acquired = False
+        self.released = False
+
+    @property
+    def would_wait(self) -> bool:
+        return self.entry.lock.locked() or self._limiter._semaphore.locked()
+
+    async def __aenter__(self):
+        await self._limiter._acquire(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self._limiter._release(self)
+
+
+class RunLimiter:
+    """
+    同一個 thread (user_id) 同時只允許一個 Graph 執行，其餘請求排入小型佇列；
+    另以 Semaphore 限制每個 worker 同時執行中的 Graph 數量。
+    """
+
+    def __init__(self,
+                 max_inflight: int = 16,
+                 thread_queue_size: int = 2,
+                 max_queued: int = 64,
+                 retry_after: int = 3,
+                 name: str = "chat"):
+        self.max_inflight = max_inflight
+        self.thread_queue_size = thread_queue_size
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.name = name
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._threads: Dict[str, _ThreadEntry] = {}
+        self._reserved = 0
+        self._inflight = 0
+
+    def reserve(self, key: str) -> RunSlot:
+        entry = self._threads.get(key)
+        if entry is not None and entry.reserved > self.thread_queue_size:
+            metrics.incr(f"{self.name}.rejected_runs")
+            raise RunQueueFull(f"Thread {key} 已有過多排隊中的請求", self.retry_after)
+        if self._reserved >= self.max_inflight + self.max_queued:
+            metrics.incr(f"{self.name}.rejected_runs")
+            raise RunQueueFull("伺服器忙碌中，請稍後再試", self.retry_after)
+
+        if entry is None:
+            entry = self._threads[key] = _ThreadEntry()
+        entry.reserved += 1
+        self._reserved += 1
+        self._update_gauges()
+        return RunSlot(self, key, entry)
+
+    async def _acquire(self, slot: RunSlot):
+        await slot.entry.lock.acquire()
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            slot.entry.lock.release()
+            raise
+        slot.acquired = True
+        self._inflight += 1
+        self._update_gauges()
+
+    def _release(self, slot: RunSlot):
+        if slot.acquired:
+            self._inflight -= 1
+            self._semaphore.release()
+            slot.entry.lock.release()
+        slot.entry.reserved -= 1
+        self._reserved -= 1
+        if slot.entry.reserved == 0 and self._threads.get(slot.key) is slot.entry:
+            del self._threads[slot.key]
+        self._update_gauges()
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self._inflight,
+            "queued": self._reserved - self._inflight,
+            "threads": len(self._threads),
+            "max_inflight": self.max_inflight,
+        }
+
+    def _update_gauges(self):
+        metrics.set_gauge(f"{self.name}.inflight_runs", self._inflight)
+        metrics.set_gauge(f"{self.name}.queued_runs", self._reserved - self._inflight)
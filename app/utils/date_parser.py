@@ -0,0 +1,169 @@
+import calendar
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple, Union
+
+DateRange = Tuple[str, str]
+
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "兩": 2, "两": 2, "三": 3, "四": 4,
+              "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_WEEKDAYS = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+_EN_WEEKDAYS = {"monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
+                "friday": 4, "saturday": 5, "sunday": 6}
+_EN_NUMBERS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+               "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+
+_NUM = r"(\d+|[零一二兩两三四五六七八九十]+|one|two|three|four|five|six|seven|eight|nine|ten)"
+_WEEK = r"(?:週|周|星期|禮拜|礼拜)"
+
+_ISO_DATE = re.compile(r"(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?")
+_MONTH_DAY = re.compile(r"(?<![\d/.])(\d{1,2})[/月](\d{1,2})(?:日|號|号)?(?![\d/])")
+_LAST_N = re.compile(r"(?:這|这|最近|近|過去|过去|前|past|last)\s*" + _NUM +
+                     r"\s*(?:個|个)?\s*(天|日|週|周|星期|禮拜|礼拜|月|days?|weeks?|months?)")
+_WEEKDAY = re.compile(r"(上上|上|這|这|本)?\s*" + _WEEK + r"([一二三四五六日天])")
+_EN_WEEKDAY = re.compile(r"(last|this)?\s*(monday|tuesday|wednesday|thursday|friday|saturday|sunday)")
+
+_FIXED_DAYS = [
+    (re.compile(r"大前天"), -3),
+    (re.compile(r"前天|day before yesterday"), -2),
+    (re.compile(r"昨天|昨日|yesterday"), -1),
+    (re.compile(r"今天|今日|剛才|剛剛|刚才|刚刚|today"), 0),
+]
+
+
+def _to_int(token: str) -> Optional[int]:
+    """阿拉伯數字、中文數字 (至九十九) 或英文數字轉成整數"""
+    if token.isdigit():
+        return int(token)
+    if token in _EN_NUMBERS:
+        return _EN_NUMBERS[token]
+    if "十" in token:
+        tens, _, ones = token.partition("十")
+        value = (_CN_DIGITS.get(tens, 0) if tens else 1) * 10
+        return value + (_CN_DIGITS.get(ones, 0) if ones else 0)
+    if len(token) == 1 and token in _CN_DIGITS:
+        return _CN_DIGITS[token]
+    return None
+
+
+def _shift_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _month_day(today: date, month: str, day: str) -> Optional[date]:
+    """省略年份時取今天以前最近的一次"""
+    parsed = _safe_date(today.year, int(month), int(day))
+    if parsed and parsed > today:
+        parsed = _safe_date(today.year - 1, int(month), int(day))
+    return parsed
+
+
+def _explicit_dates(text: str, today: date) -> list:
+    found = []
+    for m in _ISO_DATE.finditer(text):
+        parsed = _safe_date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        if parsed:
+            found.append((m.start(), parsed))
+    masked = _ISO_DATE.sub(lambda m: " " * len(m.group(0)), text)
+    for m in _MONTH_DAY.finditer(masked):
+        parsed = _month_day(today, m.group(1), m.group(2))
+        if parsed:
+            found.append((m.start(), parsed))
+    return [d for _, d in sorted(found)]
+
+
+def _range(start: date, end: date) -> DateRange:
+    if start > end:
+        start, end = end, start
+    return start.isoformat(), end.isoformat()
+
+
+def parse_date_range(text: str,
+                     now: Optional[Union[date, datetime]] = None) -> Optional[DateRange]:
+    """
+    將中英文的日期描述轉成 (query_start, query_end)，格式為 YYYY-MM-DD。
+    支援明確日期 (2024-03-01、3/1~3/7)、昨天/前天、上週五、這三天、最近兩週、
+    上個月、今年等；「最近」這類沒有範圍的模糊說法回傳 None，交由上層追問。
+    """
+    if not text:
+        return None
+    if now is None:
+        now = datetime.now()
+    today = now.date() if isinstance(now, datetime) else now
+    text = text.lower()
+
+    # 1. 明確日期：兩個以上視為區間，一個視為單日
+    explicit = _explicit_dates(text, today)
+    if len(explicit) >= 2:
+        return _range(explicit[0], explicit[1])
+    if len(explicit) == 1:
+        return _range(explicit[0], explicit[0])
+
+    # 2. 最近 N 天 / 週 / 個月
+    m = _LAST_N.search(text)
+    if m:
+        count = _to_int(m.group(1))
+        unit = m.group(2)
+        if count:
+            if unit in ("天", "日") or unit.startswith("day"):
+                return _range(today - timedelta(days=count - 1), today)
+            if unit.startswith("month") or unit == "月":
+                return _range(_shift_months(today, -count) + timedelta(days=1), today)
+            return _range(today - timedelta(days=7 * count - 1), today)
+
+    # 3. 指定星期幾：上週五、這週一、週三 (未加前綴時取今天以前最近的一次)
+    m = _WEEKDAY.search(text)
+    en = _EN_WEEKDAY.search(text)
+    if m or en:
+        if m:
+            prefix, weekday = m.group(1) or "", _WEEKDAYS[m.group(2)]
+            weeks_back = {"上上": 2, "上": 1}.get(prefix, 0)
+            relative = bool(prefix)
+        else:
+            prefix, weekday = en.group(1) or "", _EN_WEEKDAYS[en.group(2)]
+            weeks_back = 1 if prefix == "last" else 0
+            relative = bool(prefix)
+        monday = today - timedelta(days=today.weekday())
+        if relative:
+            target = monday - timedelta(weeks=weeks_back) + timedelta(days=weekday)
+        else:
+            target = today - timedelta(days=(today.weekday() - weekday) % 7)
+        return _range(target, target)
+
+    # 4. 整週 / 整月 / 整年
+    monday = today - timedelta(days=today.weekday())
+    if re.search(r"上上" + _WEEK, text):
+        start = monday - timedelta(weeks=2)
+        return _range(start, start + timedelta(days=6))
+    if re.search(r"上" + _WEEK + r"|last week", text):
+        start = monday - timedelta(weeks=1)
+        return _range(start, start + timedelta(days=6))
+    if re.search(r"(?:這|这|本)" + _WEEK + r"|this week", text):
+        return _range(monday, today)
+    if re.search(r"上(?:個|个)?月|last month", text):
+        first = _shift_months(today.replace(day=1), -1)
+        return _range(first, today.replace(day=1) - timedelta(days=1))
+    if re.search(r"(?:這|这|本)(?:個|个)?月|this month", text):
+        return _range(today.replace(day=1), today)
+    if re.search(r"去年|last year", text):
+        return _range(date(today.year - 1, 1, 1), date(today.year - 1, 12, 31))
+    if re.search(r"今年|this year", text):
+        return _range(date(today.year, 1, 1), today)
+
+    # 5. 固定偏移的單日
+    for pattern, offset in _FIXED_DAYS:
+        if pattern.search(text):
+            target = today + timedelta(days=offset)
+            return _range(target, target)
+
+    return None
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets 降採樣，回傳保留點的索引 (遞增、包含首尾)。
+    x 需已排序；y 含 NaN 的點不參與挑選。點數未超過 threshold 時回傳全部索引。
+    """
+    valid = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+    n = valid.size
+    if threshold >= n or threshold < 3:
+        return valid
+    xs, ys = x[valid], y[valid]
+
+    # 首尾固定，中間 n - 2 個點平均分成 threshold - 2 個 bucket
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # 下一個 bucket 的平均點 (最後一個 bucket 以終點代替)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+            avg_x, avg_y = xs[next_start:next_end].mean(), ys[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = xs[-1], ys[-1]
+        # 與前一個選點、下一個 bucket 平均點組成面積最大的三角形
+        area = np.abs((xs[prev] - avg_x) * (ys[start:end] - ys[prev]) -
+                      (xs[prev] - xs[start:end]) * (avg_y - ys[prev]))
+        prev = start + int(area.argmax())
+        selected[i + 1] = prev
+    return valid[selected]
+
+
+def downsample_indices(x: np.ndarray, series: list, threshold: int) -> np.ndarray:
+    """多條序列共用 x 軸時，取各序列 LTTB 結果的聯集，保留每條線的峰值與谷值"""
+    if threshold <= 0 or len(x) <= threshold:
+        return np.arange(len(x))
+    per_series = max(threshold // max(len(series), 1), 3)
+    picked = [lttb_indices(x, y, per_series) for y in series]
+    return np.unique(np.concatenate(picked)) if picked else np.arange(len(x))
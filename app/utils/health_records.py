@@ -0,0 +1,159 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# API 回傳的日期字串長度 -> 轉回 JSON 時使用的格式
+_DATE_FORMATS = {10: "%Y-%m-%d", 16: "%Y-%m-%d %H:%M", 19: "%Y-%m-%d %H:%M:%S"}
+VALUE_COLUMNS = ("sys", "dia", "pul")
+
+
+class HealthRecords:
+    """
+    量測紀錄的欄位式容器：JSON 只在抓取時解析一次，之後以 NumPy 陣列提供給統計與繪圖。
+    - dates 為 datetime64 (缺值為 NaT)，sys / dia / pul 為 float32 (缺值為 NaN)
+    - 備註以字串表 + int32 代碼儲存，重複的備註只保存一份
+    - column() 回傳唯讀 view；to_json() 只在 API 邊界才產生，並優先沿用原始字串
+    """
+
+    __slots__ = ("dates", "sys", "dia", "pul", "note_codes", "note_table", "meta", "_date_format",
+                 "_raw")
+
+    def __init__(self,
+                 dates: np.ndarray,
+                 sys: np.ndarray,
+                 dia: np.ndarray,
+                 pul: np.ndarray,
+                 note_codes: np.ndarray,
+                 note_table: List[str],
+                 meta: Optional[Dict[str, Any]] = None,
+                 date_format: str = _DATE_FORMATS[16],
+                 raw: Optional[str] = None):
+        self.dates = dates
+        self.sys = sys
+        self.dia = dia
+        self.pul = pul
+        self.note_codes = note_codes
+        self.note_table = note_table
+        self.meta = meta or {}
+        self._date_format = date_format
+        self._raw = raw
+        for array in (dates, sys, dia, pul, note_codes):
+            array.flags.writeable = False
+
+    @classmethod
+    def from_history(cls,
+                     history: List[dict],
+                     meta: Optional[Dict[str, Any]] = None,
+                     raw: Optional[str] = None) -> "HealthRecords":
+        date_strings = [r.get("date") for r in history]
+        first = next((d for d in date_strings if d), "")
+        dates = pd.to_datetime(pd.Series(date_strings, dtype=object), format="mixed",
+                               errors="coerce").to_numpy(dtype="datetime64[s]")
+
+        def values(key: str) -> np.ndarray:
+            return np.array([np.nan if r.get(key) is None else r.get(key) for r in history],
+                            dtype=np.float32)
+
+        note_index: Dict[str, int] = {}
+        note_codes = np.fromiter(
+            (note_index.setdefault(r.get("note") or "", len(note_index)) for r in history),
+            dtype=np.int32, count=len(history))
+        return cls(dates, values("sys"), values("dia"), values("pul"), note_codes,
+                   list(note_index), meta=meta,
+                   date_format=_DATE_FORMATS.get(len(first), _DATE_FORMATS[16]), raw=raw)
+
+    @classmethod
+    def from_json(cls, raw: Union[str, dict, list, None]) -> "HealthRecords":
+        """解析 get_user_health_data 的回傳；格式錯誤或 status=error 時回傳空容器"""
+        try:
+            payload = json.loads(raw) if isinstance(raw, str) else raw
+        except ValueError:
+            return cls.empty({"status": "error"})
+        if isinstance(payload, list):
+            return cls.from_history(payload, meta={"total": len(payload)})
+        if not isinstance(payload, dict):
+            return cls.empty({"status": "error"})
+
+        meta = {k: v for k, v in payload.items() if k != "history"}
+        history = payload.get("history") or []
+        meta.setdefault("total", len(history))
+        return cls.from_history(history, meta=meta, raw=raw if isinstance(raw, str) else None)
+
+    @classmethod
+    def empty(cls, meta: Optional[Dict[str, Any]] = None) -> "HealthRecords":
+        return cls.from_history([], meta={"total": 0, **(meta or {})})
+
+    def __len__(self) -> int:
+        return len(self.sys)
+
+    @property
+    def status(self) -> str:
+        return self.meta.get("status", "success")
+
+    @property
+    def total(self) -> int:
+        return self.meta.get("total", len(self))
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.meta.get("truncated", False))
+
+    def column(self, name: str) -> np.ndarray:
+        """回傳欄位的唯讀 view (date / sys / dia / pul)"""
+        if name == "date":
+            return self.dates
+        if name not in VALUE_COLUMNS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def fingerprint(self) -> str:
+        """依日期與數值欄位計算的內容雜湊，不需轉回 JSON"""
+        digest = hashlib.sha256()
+        for array in (self.dates, self.sys, self.dia, self.pul):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def notes(self) -> np.ndarray:
+        return np.array(self.note_table, dtype=object)[self.note_codes]
+
+    def frame(self) -> pd.DataFrame:
+        """供 pandas / matplotlib 使用的 DataFrame，數值欄位直接引用底層陣列"""
+        return pd.DataFrame(
+            {
+                "date": self.dates,
+                "sys": self.sys,
+                "dia": self.dia,
+                "pul": self.pul
+            }, copy=False)
+
+    def to_history(self, limit: Optional[int] = None) -> List[dict]:
+        count = len(self) if limit is None else min(limit, len(self))
+        return self.rows(np.arange(count))
+
+    def rows(self, indices: Sequence[int]) -> List[dict]:
+        """將指定位置的紀錄轉回 dict (只轉換需要的列)"""
+        indices = np.asarray(indices, dtype=np.intp)
+        dates = pd.DatetimeIndex(self.dates[indices]).strftime(self._date_format)
+
+        def value(array: np.ndarray, i: int):
+            return None if np.isnan(array[i]) else int(array[i])
+
+        return [{
+            "date": None if pd.isna(date) else date,
+            "sys": value(self.sys, i),
+            "dia": value(self.dia, i),
+            "pul": value(self.pul, i),
+            "note": self.note_table[self.note_codes[i]],
+        } for date, i in zip(dates, indices)]
+
+    def to_json(self) -> str:
+        if self._raw is None:
+            self._raw = json.dumps({**self.meta, "history": self.to_history()}, ensure_ascii=False)
+        return self._raw
+
+    def preview(self, limit: int = 10) -> str:
+        """前 limit 筆紀錄的 JSON，供 LLM 參考欄位與格式"""
+        return json.dumps(self.to_history(limit), ensure_ascii=False)
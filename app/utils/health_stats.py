@@ -0,0 +1,183 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.utils.health_records import HealthRecords
+
+# AHA/ACC 2017 分級 (由高到低判斷，收縮壓或舒張壓任一符合即歸入該級)
+AHA_CATEGORIES = [
+    ("crisis", 180, 120),
+    ("stage2", 140, 90),
+    ("stage1", 130, 80),
+]
+# ESC/ESH 2018 分級
+ESC_CATEGORIES = [
+    ("grade3", 180, 110),
+    ("grade2", 160, 100),
+    ("grade1", 140, 90),
+    ("high_normal", 130, 85),
+    ("normal", 120, 80),
+]
+# 需要特別提醒的讀數 (與 health_analyst prompt 的緊急門檻一致)
+HIGH_SYS, HIGH_DIA = 160, 100
+LOW_SYS, LOW_DIA = 90, 60
+# 不需等待 LLM 的本地緊急規則：(規則 ID, 群組, 說明, 條件)，同群組內依嚴重程度排列，
+# 每筆讀數在同一群組中只計入最嚴重的一條規則
+EMERGENCY_RULES = [
+    ("hypertensive_crisis", "bp", "血壓達高血壓危象範圍 (≥180/120 mmHg)",
+     lambda sys, dia, pul: (sys >= 180) | (dia >= 120)),
+    ("severe_hypertension", "bp", f"血壓過高 (≥{HIGH_SYS}/{HIGH_DIA} mmHg)",
+     lambda sys, dia, pul: (sys >= HIGH_SYS) | (dia >= HIGH_DIA)),
+    ("tachycardia", "pulse", "心率過快 (≥120 bpm)", lambda sys, dia, pul: pul >= 120),
+    ("bradycardia", "pulse", "心率過慢 (≤40 bpm)", lambda sys, dia, pul: pul <= 40),
+]
+MORNING_HOURS = (4, 12)
+EVENING_HOURS = (18, 24)
+
+
+def _round(value) -> Any:
+    return None if value is None or np.isnan(value) else round(float(value), 1)
+
+
+def _mean(values: np.ndarray) -> Any:
+    valid = values[~np.isnan(values)]
+    return _round(valid.mean()) if valid.size else None
+
+
+def _describe(values: np.ndarray) -> Dict[str, Any]:
+    valid = values[~np.isnan(values)]
+    if not valid.size:
+        return {"count": 0}
+    return {
+        "count": int(valid.size),
+        "mean": _round(valid.mean()),
+        "min": _round(valid.min()),
+        "max": _round(valid.max()),
+        "std": _round(valid.std()),
+        # 平均真實變異 (相鄰讀數差的絕對值平均)
+        "arv": _round(np.abs(np.diff(valid)).mean()) if valid.size > 1 else None,
+    }
+
+
+def _classify(sys: np.ndarray, dia: np.ndarray, levels: list, default: str) -> Dict[str, int]:
+    valid = ~(np.isnan(sys) | np.isnan(dia))
+    conditions = [(sys >= s) | (dia >= d) for _, s, d in levels]
+    labels = np.select(conditions, [name for name, _, _ in levels], default=default)[valid]
+    if default == "normal":
+        # AHA 的 elevated：收縮壓 120-129 且舒張壓 < 80
+        elevated = (labels == "normal") & (sys[valid] >= 120)
+        labels = np.where(elevated, "elevated", labels)
+    names, counts = np.unique(labels, return_counts=True)
+    return {str(n): int(c) for n, c in zip(names, counts)}
+
+
+def _slope_per_week(days: np.ndarray, values: np.ndarray) -> Any:
+    mask = ~(np.isnan(days) | np.isnan(values))
+    if mask.sum() < 2 or np.ptp(days[mask]) == 0:
+        return None
+    return _round(np.polyfit(days[mask], values[mask], 1)[0] * 7)
+
+
+def summarize(records: HealthRecords, max_flagged: int = 10) -> Dict[str, Any]:
+    """以向量化運算一次計算分析所需的統計摘要"""
+    sys = records.column("sys").astype(np.float64)
+    dia = records.column("dia").astype(np.float64)
+    pul = records.column("pul").astype(np.float64)
+    dates = records.column("date")
+    has_date = ~np.isnat(dates)
+    days = np.full(len(records), np.nan)
+    if has_date.any():
+        # NaT 相減後除以一天會得到 NaN
+        days = (dates - dates[has_date].min()) / np.timedelta64(1, "D")
+    hours = np.where(has_date, dates.astype("datetime64[h]").astype(np.int64) % 24, -1)
+
+    periods = {}
+    for name, (start, end) in (("morning", MORNING_HOURS), ("evening", EVENING_HOURS)):
+        mask = (hours >= start) & (hours < end)
+        periods[name] = {
+            "count": int(mask.sum()),
+            "sys_mean": _mean(sys[mask]),
+            "dia_mean": _mean(dia[mask]),
+        }
+
+    flagged = np.flatnonzero((sys >= HIGH_SYS) | (dia >= HIGH_DIA) | (sys < LOW_SYS) |
+                             (dia < LOW_DIA))
+    return {
+        "count": len(records),
+        "period": {
+            "start": str(dates[has_date].min())[:10] if has_date.any() else None,
+            "end": str(dates[has_date].max())[:10] if has_date.any() else None,
+        },
+        "sys": _describe(sys),
+        "dia": _describe(dia),
+        "pul": _describe(pul),
+        "morning_evening": periods,
+        "trend_per_week": {
+            "sys": _slope_per_week(days, sys),
+            "dia": _slope_per_week(days, dia)
+        },
+        "aha_categories": _classify(sys, dia, AHA_CATEGORIES, "normal"),
+        "esc_categories": _classify(sys, dia, ESC_CATEGORIES, "optimal"),
+        "out_of_range": {
+            "count": int(flagged.size),
+            "high": int(((sys >= HIGH_SYS) | (dia >= HIGH_DIA)).sum()),
+            "low": int(((sys < LOW_SYS) | (dia < LOW_DIA)).sum()),
+            "readings": records.rows(flagged[:max_flagged]),
+        },
+    }
+
+
+def detect_emergencies(records: HealthRecords,
+                       window_hours: float = 24,
+                       now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    以 EMERGENCY_RULES 檢查近期讀數，回傳命中的規則與最近一筆命中的讀數。
+    只檢查 now 之前 window_hours 小時內的讀數：查詢過去區間時，舊的異常讀數不觸發即時警示，
+    時間在 now 之後 (時鐘偏差) 的讀數也不列入。
+    """
+    sys = records.column("sys")
+    dia = records.column("dia")
+    pul = records.column("pul")
+    dates = records.column("date")
+    end = np.datetime64(now or datetime.now(), "s")
+    cutoff = end - np.timedelta64(int(window_hours * 3600), "s")
+    # NaT 的比較結果為 False，沒有日期的讀數不列入
+    recent = (dates >= cutoff) & (dates <= end)
+    claimed = {}
+    alerts = []
+    for rule_id, group, description, condition in EMERGENCY_RULES:
+        matched = condition(sys, dia, pul) & recent
+        taken = claimed.get(group, np.zeros(len(matched), dtype=bool))
+        hits = np.flatnonzero(matched & ~taken)
+        claimed[group] = taken | matched
+        if hits.size:
+            alerts.append({
+                "rule": rule_id,
+                "description": description,
+                "count": int(hits.size),
+                "latest": records.rows(hits[-1:])[0],
+            })
+    return alerts
+
+
+def sample_history(records: HealthRecords, size: int) -> List[dict]:
+    """平均抽樣 size 筆紀錄 (保留首尾)，讓 LLM 仍能看到原始數據的樣貌"""
+    if len(records) <= size:
+        return records.to_history()
+    indices = np.unique(np.linspace(0, len(records) - 1, num=max(size, 2)).round().astype(int))
+    return records.rows(indices)
+
+
+def build_analysis_input(records: HealthRecords, mode: str = "summary", sample_size: int = 20) -> str:
+    """
+    產生 health_analyst prompt 的數據區塊。
+    mode="raw" 保留舊行為 (整份 JSON)，方便比較兩種模式的分析品質。
+    """
+    if mode == "raw":
+        return records.to_json()
+    sample = sample_history(records, sample_size)
+    return (f"【統計摘要】\n{json.dumps(summarize(records), ensure_ascii=False)}\n\n"
+            f"【原始紀錄抽樣】({len(sample)} / {len(records)} 筆)\n"
+            f"{json.dumps(sample, ensure_ascii=False)}")
@@ -0,0 +1,100 @@
+import asyncio
+import random
+from typing import Optional
+
+import httpx
+
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("HttpClient")
+
+# 連線層級的錯誤可安全重試 (請求尚未送達對方)
+_RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class PooledHttpClient:
+    """
+    應用程式共用的 httpx.AsyncClient：
+    - 由 FastAPI lifespan 呼叫 start() / close()，未啟動時於第一次請求自動建立
+    - 連線池上限與 keep-alive 可設定，可選用 HTTP/2 (需安裝 h2)
+    - 5xx 與連線錯誤以指數退避 + 隨機抖動重試
+    """
+
+    def __init__(self,
+                 name: str,
+                 base_url: str,
+                 headers: Optional[dict] = None,
+                 timeout: float = 10.0,
+                 connect_timeout: float = 5.0,
+                 max_connections: int = 20,
+                 max_keepalive: int = 10,
+                 keepalive_expiry: float = 30.0,
+                 http2: bool = False,
+                 retries: int = 2,
+                 backoff: float = 0.2,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.name = name
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.http2 = http2
+        self.retries = retries
+        self.backoff = backoff
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self._client is not None:
+            return
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning(f"[HTTP] {self.name} 未安裝 h2 套件，改用 HTTP/1.1")
+                http2 = False
+        self._client = httpx.AsyncClient(base_url=self.base_url,
+                                         headers=self.headers,
+                                         timeout=self.timeout,
+                                         limits=self.limits,
+                                         http2=http2,
+                                         transport=self.transport)
+        logger.info(f"[HTTP] {self.name} 連線池已建立 (HTTP/2: {http2})")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """送出請求；最後一次嘗試仍失敗時回傳 5xx 回應或拋出 httpx.RequestError"""
+        if self._client is None:
+            await self.start()
+
+        for attempt in range(self.retries + 1):
+            metrics.incr(f"http.{self.name}.requests")
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except _RETRYABLE_ERRORS as exc:
+                if attempt >= self.retries:
+                    metrics.incr(f"http.{self.name}.errors")
+                    raise
+                logger.warning(f"[HTTP] {self.name} 連線錯誤，準備重試 ({attempt + 1}/{self.retries}): {exc}")
+            else:
+                if response.status_code < 500 or attempt >= self.retries:
+                    if response.status_code >= 500:
+                        metrics.incr(f"http.{self.name}.errors")
+                    return response
+                logger.warning(
+                    f"[HTTP] {self.name} 回應 {response.status_code}，準備重試 ({attempt + 1}/{self.retries})")
+                await response.aclose()
+
+            metrics.incr(f"http.{self.name}.retries")
+            await asyncio.sleep(self.backoff * (2**attempt) * random.uniform(0.5, 1.5))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
@@ -0,0 +1,139 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+
+from app.utils.logger import setup_logger
+from app.utils.metrics import metrics
+
+logger = setup_logger("LLMCache")
+
+
+def _current_node() -> str:
+    """取得目前執行中的 LangGraph 節點名稱，不在 Graph 內時回傳 default"""
+    try:
+        from langgraph.config import get_config
+        return get_config().get("metadata", {}).get("langgraph_node") or "default"
+    except Exception:
+        return "default"
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    以 SQLite 保存的 LLM 回應快取，透過 LangChain 的 cache 參數掛在 Chat Model 上。
+    - 鍵為 sha256(正規化訊息列表 + llm_string)，llm_string 已包含模型名稱、參數與結構化輸出 schema
+    - 依節點設定 TTL (ttl_seconds["default"] 為預設值，<= 0 表示該節點不使用快取)
+    - 超過 max_entries 時依最後存取時間淘汰 (LRU)
+    """
+
+    def __init__(self,
+                 db_path: str,
+                 ttl_seconds: Optional[Dict[str, int]] = None,
+                 max_entries: int = 5000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds or {"default": 3600}
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                node TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _ttl(self, node: str) -> int:
+        return self.ttl_seconds.get(node, self.ttl_seconds.get("default", 0))
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        node = _current_node()
+        if self._ttl(node) <= 0:
+            return None
+
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key, )).fetchone()
+            if row is not None and row[1] <= now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key, ))
+                self._conn.commit()
+                row = None
+            if row is not None:
+                self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?",
+                                   (now, key))
+                self._conn.commit()
+
+        if row is None:
+            metrics.incr("llm_cache.misses")
+            metrics.incr(f"llm_cache.misses.{node}")
+            return None
+        try:
+            generations = loads(row[0])
+        except Exception as e:
+            logger.warning(f"[LLMCache] 快取內容無法還原，視為未命中: {e}")
+            metrics.incr("llm_cache.misses")
+            return None
+        metrics.incr("llm_cache.hits")
+        metrics.incr(f"llm_cache.hits.{node}")
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        node = _current_node()
+        ttl = self._ttl(node)
+        if ttl <= 0:
+            return
+
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        value = dumps(list(return_val))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, node, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)", (key, node, value, now + ttl, now))
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """刪除已過期的項目，並在超過上限時淘汰最久未使用的項目"""
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now, ))
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)", (overflow, ))
+            metrics.incr("llm_cache.evictions", overflow)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": metrics.get("llm_cache.hits"),
+            "misses": metrics.get("llm_cache.misses"),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
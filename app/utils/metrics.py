@@ -0,0 +1,41 @@
+import threading
+from collections import defaultdict
+
+
+class MetricsRegistry:
+    """
+    行程內的簡易指標登錄表 (計數器與量表)。
+    以 "模組.指標" 命名，例如 chat.abandoned_runs。
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name: str, default=0):
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name]
+            return self._gauges.get(name, default)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges)}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+
+
+# 全域單例物件
+metrics = MetricsRegistry()
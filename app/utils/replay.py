@@ -0,0 +1,178 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from app.utils.logger import setup_logger
+
+logger = setup_logger("ReplayBuffer")
+
+
+class RunStream:
+    """
+    單次 Graph 執行的輸出緩衝區。
+    每個事件都有遞增的序號，斷線重連時可從 Last-Event-ID 之後繼續讀取。
+    """
+
+    def __init__(self, run_id: str, owner: str, max_events: int):
+        self.run_id = run_id
+        self.owner = owner
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._events: deque = deque(maxlen=max_events)
+        self._next_seq = 1
+        self._cond = asyncio.Condition()
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._on_idle: Optional[Callable[["RunStream"], None]] = None
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.run_id}:{seq}"
+
+    def can_resume(self, after_seq: int) -> bool:
+        """緩衝區仍保有 after_seq 之後的所有事件時才可續傳"""
+        if after_seq < 0 or after_seq >= self._next_seq:
+            return False
+        if not self._events:
+            return True
+        return after_seq >= self._events[0][0] - 1
+
+    async def publish(self, event: dict):
+        async with self._cond:
+            self._events.append((self._next_seq, event))
+            self._next_seq += 1
+            self._cond.notify_all()
+
+    async def finish(self):
+        async with self._cond:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    async def subscribe(self, after_seq: int = 0) -> AsyncIterator[Tuple[int, dict]]:
+        """依序回傳 after_seq 之後的事件，直到執行結束"""
+        self._attach()
+        cursor = after_seq
+        try:
+            while True:
+                async with self._cond:
+                    pending = [(s, e) for s, e in self._events if s > cursor]
+                    if not pending:
+                        if self.done:
+                            return
+                        await self._cond.wait()
+                        continue
+                for seq, event in pending:
+                    cursor = seq
+                    yield seq, event
+        finally:
+            self._detach()
+
+    def _attach(self):
+        self.subscribers += 1
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    def _detach(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self._on_idle:
+            self._on_idle(self)
+
+
+class ReplayRegistry:
+    """
+    管理執行中的 RunStream：背景任務負責執行並寫入緩衝區，HTTP 連線只是訂閱者。
+    - 所有訂閱者離開後保留 grace_seconds 等待重連，逾時才取消執行
+    - 已完成的執行保留 ttl_seconds 供重連補傳，並以 max_runs 限制總數
+    """
+
+    def __init__(self,
+                 max_events: int = 2000,
+                 ttl_seconds: int = 300,
+                 grace_seconds: float = 15,
+                 max_runs: int = 1000,
+                 on_abandon: Optional[Callable[[RunStream], None]] = None):
+        self.max_events = max_events
+        self.ttl_seconds = ttl_seconds
+        self.grace_seconds = grace_seconds
+        self.max_runs = max_runs
+        self.on_abandon = on_abandon
+        self._runs: Dict[str, RunStream] = {}
+
+    def start(self,
+              owner: str,
+              events: AsyncIterator[dict],
+              on_finish: Optional[Callable[[], None]] = None) -> RunStream:
+        self._evict()
+        stream = RunStream(uuid.uuid4().hex[:16], owner, self.max_events)
+        stream._on_idle = self._schedule_abandon
+        stream.task = asyncio.create_task(self._pump(stream, events, on_finish))
+        self._runs[stream.run_id] = stream
+        return stream
+
+    def get(self, run_id: str) -> Optional[RunStream]:
+        self._evict()
+        return self._runs.get(run_id)
+
+    async def _pump(self, stream: RunStream, events: AsyncIterator[dict], on_finish):
+        try:
+            async for event in events:
+                await stream.publish(event)
+        except asyncio.CancelledError:
+            logger.info(f"[Replay] 執行 {stream.run_id} 已取消")
+            raise
+        except Exception as e:
+            logger.error(f"[Streaming Error] {e}", exc_info=True)
+            await stream.publish({"type": "error", "content": str(e)})
+        finally:
+            if on_finish:
+                on_finish()
+            aclose = getattr(events, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            await stream.finish()
+
+    def _schedule_abandon(self, stream: RunStream):
+        loop = asyncio.get_running_loop()
+        stream._idle_handle = loop.call_later(self.grace_seconds, self._abandon, stream)
+
+    def _abandon(self, stream: RunStream):
+        stream._idle_handle = None
+        if stream.subscribers > 0 or stream.done:
+            return
+        logger.info(f"[Replay] 執行 {stream.run_id} 在寬限期內無人重連，取消執行")
+        if stream.task is not None:
+            stream.task.cancel()
+        if self.on_abandon:
+            self.on_abandon(stream)
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [
+            run_id for run_id, s in self._runs.items()
+            if s.done and now - s.finished_at > self.ttl_seconds
+        ]
+        for run_id in expired:
+            del self._runs[run_id]
+
+        if len(self._runs) >= self.max_runs:
+            finished = sorted((s for s in self._runs.values() if s.done),
+                              key=lambda s: s.finished_at)
+            for s in finished[:len(self._runs) - self.max_runs + 1]:
+                del self._runs[s.run_id]
+
+    async def close(self):
+        """關閉服務時取消所有執行中的背景任務"""
+        tasks = [s.task for s in self._runs.values() if s.task and not s.task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+        self._runs.clear()
+
+    def stats(self) -> dict:
+        active = sum(1 for s in self._runs.values() if not s.done)
+        return {"active": active, "buffered": len(self._runs) - active}
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from app.utils.metrics import metrics
+
+
+class SingleFlight:
+    """
+    合併相同 key 的並行呼叫：同時間只有第一個呼叫者真正執行，其餘呼叫者等待同一個結果。
+    - do() 供 async 函式使用；執行放在獨立 Task 中，個別呼叫者取消不會中斷共用的請求
+    - do_sync() 供在執行緒中呼叫的同步函式使用 (例如 yfinance)
+    結果不會快取，呼叫完成後下一次請求會重新執行。
+    """
+
+    def __init__(self, name: str, max_tracked_keys: int = 1000):
+        self.name = name
+        self.max_tracked_keys = max_tracked_keys
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._sync_calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._shared_by_key: OrderedDict = OrderedDict()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            metrics.incr(f"singleflight.{self.name}.calls")
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+        else:
+            self._record_shared(key)
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有呼叫者都已取消時，避免出現 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def do_sync(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._sync_calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._sync_calls[key] = Future()
+        if not leader:
+            self._record_shared(key)
+            return future.result()
+
+        metrics.incr(f"singleflight.{self.name}.calls")
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._sync_calls.pop(key, None)
+
+    def _record_shared(self, key: Hashable):
+        metrics.incr(f"singleflight.{self.name}.deduplicated")
+        with self._lock:
+            self._shared_by_key[key] = self._shared_by_key.pop(key, 0) + 1
+            while len(self._shared_by_key) > self.max_tracked_keys:
+                self._shared_by_key.popitem(last=False)
+
+    def stats(self, top: int = 10) -> dict:
+        with self._lock:
+            top_keys = sorted(self._shared_by_key.items(), key=lambda kv: kv[1], reverse=True)[:top]
+            inflight = len(self._calls) + len(self._sync_calls)
+        return {
+            "inflight": inflight,
+            "calls": metrics.get(f"singleflight.{self.name}.calls"),
+            "deduplicated": metrics.get(f"singleflight.{self.name}.deduplicated"),
+            "top_keys": [{"key": str(k), "deduplicated": n} for k, n in top_keys],
+        }
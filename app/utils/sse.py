@@ -0,0 +1,145 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import orjson
+
+from app.utils.logger import setup_logger
+
+logger = setup_logger("SSE")
+
+
+async def _cancel_task(task: asyncio.Future):
+    """取消背景任務並等待其真正結束，讓上游 generator 有機會清理資源"""
+    if task.done():
+        return
+    task.cancel()
+    await asyncio.wait({task})
+
+
+def encode_event(event: dict, event_id: Optional[str] = None) -> bytes:
+    """
+    將事件序列化為 SSE 區塊，data 格式與原本的 json.dumps 版本相容。
+    提供 event_id 時加上 id 欄位，供客戶端以 Last-Event-ID 續傳。
+    """
+    payload = orjson.dumps(event, default=str)
+    if event_id is not None:
+        return b"id: " + event_id.encode("utf-8") + b"\ndata: " + payload + b"\n\n"
+    return b"data: " + payload + b"\n\n"
+
+
+async def coalesce_stream(events: AsyncIterator[dict],
+                          flush_interval_ms: int = 30,
+                          max_chars: int = 1024) -> AsyncIterator[dict]:
+    """
+    合併連續的 stream 事件，減少 SSE frame 數量。
+
+    - 緩衝區內容超過 max_chars 時立即送出
+    - 第一個 chunk 進入緩衝區後超過 flush_interval_ms 仍未送出，則由計時器送出
+    - 遇到非 stream 事件時，先送出緩衝區再送出該事件，確保事件順序不變
+    flush_interval_ms <= 0 時停用時間合併；max_chars <= 0 時每個 chunk 都立即送出。
+    """
+    interval = max(flush_interval_ms, 0) / 1000
+    iterator = events.__aiter__()
+    buffer: list[str] = []
+    buffered_chars = 0
+    buffer_started = 0.0
+    pending = None
+
+    def flush():
+        nonlocal buffer, buffered_chars
+        merged = {"type": "stream", "content": "".join(buffer)}
+        buffer, buffered_chars = [], 0
+        return merged
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None
+            if buffer and interval > 0:
+                timeout = max(buffer_started + interval - time.monotonic(), 0)
+
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # 時間到但上游還沒產出新事件，先把累積的文字送出
+                yield flush()
+                continue
+
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+
+            if event.get("type") == "stream" and isinstance(event.get("content"), str):
+                if not buffer:
+                    buffer_started = time.monotonic()
+                buffer.append(event["content"])
+                buffered_chars += len(event["content"])
+                if buffered_chars >= max_chars:
+                    yield flush()
+                continue
+
+            if buffer:
+                yield flush()
+            yield event
+
+        if buffer:
+            yield flush()
+    finally:
+        if pending is not None:
+            await _cancel_task(pending)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+async def cancel_on_disconnect(events: AsyncIterator[Any],
+                               is_disconnected: Callable[[], Awaitable[bool]],
+                               poll_interval_ms: int = 500,
+                               on_disconnect: Optional[Callable[[], None]] = None
+                               ) -> AsyncIterator[Any]:
+    """
+    轉送上游事件，並定期檢查客戶端是否已斷線。
+    斷線時取消上游正在等待的事件 (連帶取消 LangGraph 執行)，然後結束串流。
+    """
+    interval = max(poll_interval_ms, 1) / 1000
+    iterator = events.__aiter__()
+    pending = None
+
+    async def client_gone() -> bool:
+        if not await is_disconnected():
+            return False
+        logger.info("[SSE] 客戶端已中斷連線，取消執行中的串流")
+        if on_disconnect:
+            on_disconnect()
+        return True
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                if await client_gone():
+                    return
+                continue
+
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                return
+            yield event
+            # 長時間持續輸出的串流也需要檢查斷線
+            if await client_gone():
+                return
+    finally:
+        if pending is not None:
+            await _cancel_task(pending)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -7,6 +7,7 @@ from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.api_router import router as api_router, lifespan
 from app.api.test_router import router as test_router
+from app.api.charts_router import router as charts_router
 from app.utils.logger import setup_logger
 from app.core.config import settings
 
@@ -62,6 +63,7 @@ async def get_env_config(request: Request):
 
 # 註冊 API 路由
 app.include_router(api_router, prefix="/api/v1", tags=["API"])
+app.include_router(charts_router, prefix="/api/v1", tags=["Charts"])
 app.include_router(test_router, prefix="/api/test", tags=["QA Testing"])
 # 路由
 
@@ -8,25 +8,74 @@ const getApiToken = () => (window.ENV ? window.ENV.APP_AUTH_TOKEN : 'your_token_
 function downloadChart(base64Data) {
     const link = document.createElement('a');
     link.href = base64Data;
-    link.download = `Report_${new Date().getTime()}.png`;
+    // 依 data URI 的 MIME type 或圖表 URL 的副檔名決定下載檔名 (png / webp / svg)
+    const ext = ((base64Data.match(/^data:image\/([a-z]+)/) || base64Data.match(/\.([a-z]+)$/) || [])[1] || 'png');
+    link.download = `Report_${new Date().getTime()}.${ext}`;
     document.body.appendChild(link);
     link.click();
     document.body.removeChild(link);
 }
 window.downloadChart = downloadChart;
-// 渲染邏輯 (封裝 Mermaid 處理)
-async function renderGraph(payload) {
+// 流程圖快取：同一版本只向後端取得並渲染一次
+const graphCache = { version: null, pending: null };
+
+async function loadGraph(version) {
+    const graphContainer = document.getElementById('mermaid-graph');
+    if (!graphContainer) return false;
+    if (graphCache.version && (!version || graphCache.version === version)) return true;
+    if (graphCache.pending) return graphCache.pending;
+
+    const url = version ? `/api/v1/graph/${version}` : '/api/v1/graph';
+    graphCache.pending = (async () => {
+        try {
+            const response = await fetch(url, { headers: { 'X-API-Key': getApiToken() } });
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const diagram = await response.json();
+
+            graphContainer.removeAttribute('data-processed');
+            graphContainer.innerHTML = diagram.mermaid;
+            if (window.mermaid) {
+                await window.mermaid.run({ nodes: [graphContainer] });
+            }
+            graphCache.version = diagram.version;
+            return true;
+        } catch (err) {
+            console.error("Mermaid Render Error:", err);
+            return false;
+        } finally {
+            graphCache.pending = null;
+        }
+    })();
+    return graphCache.pending;
+}
+
+// 依節點 ID 找出 Mermaid 渲染後的 SVG 節點 (id 格式: flowchart-<node>-<n>)
+function findGraphNode(nodeName) {
     const graphContainer = document.getElementById('mermaid-graph');
+    if (!graphContainer) return null;
+    const pattern = new RegExp(`^flowchart-${nodeName}-\\d+$`);
+    return Array.from(graphContainer.querySelectorAll('g.node'))
+        .find(el => el.dataset.id === nodeName || pattern.test(el.id)) || null;
+}
+
+function setGraphHighlight(nodeName, className) {
+    const graphContainer = document.getElementById('mermaid-graph');
+    if (!graphContainer) return;
+    graphContainer.querySelectorAll(`.${className}`).forEach(el => el.classList.remove(className));
+    const target = nodeName ? findGraphNode(nodeName) : null;
+    if (target) target.classList.add(className);
+}
+
+// 渲染邏輯：流程圖只載入一次，之後僅切換高亮 class
+async function renderGraph(payload) {
     const statusDisplay = document.getElementById('intent-display');
-    
-    // 如果後端沒傳 graph 字串過來，就不執行
-    if (!graphContainer || !payload.graph && !payload.content) return;
+    if (!payload) return;
 
-    graphContainer.removeAttribute('data-processed');
+    const loaded = await loadGraph(payload.graph_version);
+    if (!loaded) return;
 
-    let mermaidCode = payload.graph || payload.content;
     const intent = payload.intent;
-    const currentNode = payload.node; // 這是從單個 graph 事件傳來的 (on_chain_start)
+    const currentNode = payload.node; // 這是從單個 node 事件傳來的 (on_chain_start)
 
     // 更新系統狀態文字
     if (currentNode && statusDisplay) {
@@ -34,7 +83,7 @@ async function renderGraph(payload) {
     }
 
     let highlightNode = currentNode;
-    
+
     // 邏輯調整：如果是最終結果 (payload.type === 'final') 且是查詢意圖，高亮 fetch_records
     if (!currentNode && intent === 'health_query') {
         highlightNode = 'fetch_records';
@@ -46,27 +95,18 @@ async function renderGraph(payload) {
         highlightNode = 'visualizer';
     }
 
-    // 關鍵：將 class 注入 Mermaid 原始碼
-    if (highlightNode && mermaidCode.includes(highlightNode)) {
-        mermaidCode += `\nclass ${highlightNode} activeNode`;
+    if (highlightNode) {
+        setGraphHighlight(highlightNode, 'activeNode');
     }
 
     // 緊急狀態特殊高亮
-    if (payload.is_emergency || (payload.data && payload.data.is_emergency)) {
-        mermaidCode += '\nclass health_analyst activeEmergencyNode';
-    }
-
-    graphContainer.innerHTML = mermaidCode;
-
-    try {
-        if (window.mermaid) {
-            await window.mermaid.run({ nodes: [graphContainer] });
-        }
-    } catch (err) {
-        console.error("Mermaid Render Error:", err);
-    }
+    const isEmergency = payload.is_emergency || (payload.data && payload.data.is_emergency);
+    setGraphHighlight(isEmergency ? 'health_analyst' : null, 'activeEmergencyNode');
 }
 
+// 串流斷線時，以 Last-Event-ID 自動續傳的最大次數
+const MAX_RESUME_ATTEMPTS = 3;
+
 // --- 安全機制設定 ---
 // 這裡可以改為從 localStorage 獲取，或是部署時由後端注入
 
@@ -97,16 +137,82 @@ async function sendMessage(manualMessage = null) {
     const textEl = document.getElementById(`text-${loadingId}`);
     const extraEl = document.getElementById(`extra-${loadingId}`);
 
-    try {
-        const response = await fetch('/api/v1/chat', {
-            method: 'POST',
-            headers: { 
-                'Content-Type': 'application/json',
-                'X-API-Key': getApiToken()
-            },
-            body: JSON.stringify({ message: message, userId: "default-user" })
-        });
+    // 圖表格式：json 代表由瀏覽器繪圖，其餘由伺服器產生圖檔
+    const chartFormat = document.getElementById('chartFormat')?.value;
+    const body = JSON.stringify({ message: message, userId: "default-user", chartFormat: chartFormat || null });
+    let lastEventId = null;
+
+    // 處理單一 SSE 事件
+    async function handleEvent(event) {
+        const contentText = getText(event.content);
+
+        if (event.type === "status") {
+            statusEl.innerText = contentText;
+        } else if (event.type === "stream") {
+            // 處理換行符號並即時顯示文字 (打字機效果)
+            textEl.innerHTML += contentText.replace(/\n/g, '<br>');
+        } else if (event.type === "node") {
+            // 即時更新流程圖高亮
+            await renderGraph(event);
+        } else if (event.type === "interrupt") {
+            statusEl.style.display = "none"; // 隱藏狀態列
+            // 中斷時顯示問題，如果 stream 已經有部分內容，則追加
+            textEl.innerHTML = contentText.replace(/\n/g, '<br>');
+            extraEl.innerHTML = `<div class="interrupt-hint">💡 需要補充資訊以繼續</div>`;
+        } else if (event.type === "emergency") {
+            // 本地規則預檢的緊急警示，在分析完成前先行顯示
+            const alerts = (event.alerts || [])
+                .map(a => `<li>${a.description}：${a.count} 筆 (最近 ${a.latest.date || '-'}，${a.latest.sys}/${a.latest.dia} mmHg，心率 ${a.latest.pul})</li>`)
+                .join('');
+            extraEl.innerHTML += `<div class="emergency-alert">${contentText}<ul>${alerts}</ul></div>`;
+            setGraphHighlight('fetch_records', 'activeEmergencyNode');
+        } else if (event.type === "final") {
+            const payload = event.data;
+            statusEl.style.display = "none"; // 隱藏狀態列
+
+            // 執行圖表更新與 UI 美化
+            if (payload.graph_version) {
+                await renderGraph(payload);
+            }
+
+            // 如果有額外的 UI 數據 (表格等)，顯示在 extra 區域
+            const beautified = beautifyContent(payload);
+            // 因為文字已經在 stream 階段顯示過了，我們只需要抓取 extraHTML 部分
+            const tempDiv = document.createElement('div');
+            tempDiv.innerHTML = beautified;
+            const extraContent = tempDiv.querySelector('.data-component-container');
+            if (extraContent) {
+                extraEl.appendChild(extraContent);
+            }
+            // 沒有串流文字的節點 (例如繪圖) 以整理後的最終回覆顯示
+            if (!textEl.innerHTML.trim()) {
+                textEl.innerHTML = tempDiv.innerHTML;
+            }
+        } else if (event.type === "error") {
+            textEl.innerHTML = `<div class="msg-error">❌ ${event.content}</div>`;
+        }
+    }
+
+    // 讀取一次連線的串流；回傳 true 代表伺服器正常結束串流
+    async function readStream() {
+        const headers = {
+            'Content-Type': 'application/json',
+            'X-API-Key': getApiToken()
+        };
+        // 斷線重連：帶上最後收到的事件 ID，由伺服器從緩衝區續傳
+        if (lastEventId) headers['Last-Event-ID'] = lastEventId;
+
+        const response = await fetch('/api/v1/chat', { method: 'POST', headers, body });
 
+        if (response.status === 429) {
+            const retryAfter = response.headers.get('Retry-After') || '數';
+            statusEl.innerText = `目前請求過多，請於 ${retryAfter} 秒後再試。`;
+            return true;
+        }
+        if (response.status === 410) {
+            statusEl.innerText = "連線已中斷過久，請重新發送訊息。";
+            return true;
+        }
         if (!response.ok) throw new Error("網路請求失敗");
 
         const reader = response.body.getReader();
@@ -115,61 +221,46 @@ async function sendMessage(manualMessage = null) {
 
         while (true) {
             const { value, done } = await reader.read();
-            if (done) break;
+            if (done) return true;
 
             buffer += decoder.decode(value, { stream: true });
 
-            // SSE 格式處理: 尋找以 "data: " 開頭並以 "\n\n" 結尾的區塊
-            const lines = buffer.split("\n\n");
-            buffer = lines.pop(); // 剩下的不完整內容留給下一輪
-
-            for (const line of lines) {
-                if (!line.startsWith("data: ")) continue;
-                const jsonStr = line.replace("data: ", "");
-                try {
-                    const event = JSON.parse(jsonStr);
-                    const contentText = getText(event.content);
-
-                    if (event.type === "status") {
-                        statusEl.innerText = contentText;
-                    } else if (event.type === "stream") {
-                        // 處理換行符號並即時顯示文字 (打字機效果)
-                        textEl.innerHTML += contentText.replace(/\n/g, '<br>');
-                    } else if (event.type === "graph") {
-                        // 即時更新流程圖
-                        await renderGraph(event);
-                    } else if (event.type === "interrupt") {
-                        statusEl.style.display = "none"; // 隱藏狀態列
-                        // 中斷時顯示問題，如果 stream 已經有部分內容，則追加
-                        textEl.innerHTML = contentText.replace(/\n/g, '<br>');
-                        extraEl.innerHTML = `<div class="interrupt-hint">💡 需要補充資訊以繼續</div>`;
-                    } else if (event.type === "final") {
-                        const payload = event.data;
-                        statusEl.style.display = "none"; // 隱藏狀態列
-                        
-                        // 執行圖表更新與 UI 美化
-                        if (payload.graph) {
-                            await renderGraph(payload);
-                        }
-                        
-                        // 如果有額外的 UI 數據 (表格等)，顯示在 extra 區域
-                        const beautified = beautifyContent(payload);
-                        // 因為文字已經在 stream 階段顯示過了，我們只需要抓取 extraHTML 部分
-                        const tempDiv = document.createElement('div');
-                        tempDiv.innerHTML = beautified;
-                        const extraContent = tempDiv.querySelector('.data-component-container');
-                        if (extraContent) {
-                            extraEl.appendChild(extraContent);
-                        }
-                    } else if (event.type === "error") {
-                        textEl.innerHTML = `<div class="msg-error">❌ ${event.content}</div>`;
+            // SSE 格式處理: 每個區塊以 "\n\n" 結尾，包含 "id: " 與 "data: " 欄位
+            const blocks = buffer.split("\n\n");
+            buffer = blocks.pop(); // 剩下的不完整內容留給下一輪
+
+            for (const block of blocks) {
+                let jsonStr = null;
+                for (const line of block.split("\n")) {
+                    if (line.startsWith("id: ")) {
+                        lastEventId = line.slice(4);
+                    } else if (line.startsWith("data: ")) {
+                        jsonStr = line.slice(6);
                     }
+                }
+                if (jsonStr === null) continue;
+                try {
+                    await handleEvent(JSON.parse(jsonStr));
                 } catch (e) {
                     console.error("JSON Parse Error:", e, jsonStr);
                 }
             }
             chatBox.scrollTop = chatBox.scrollHeight;
         }
+    }
+
+    try {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                if (await readStream()) break;
+            } catch (error) {
+                // 尚未收到任何事件或重試次數用盡時，不再續傳
+                if (!lastEventId || attempt >= MAX_RESUME_ATTEMPTS) throw error;
+                console.warn("Stream dropped, resuming from", lastEventId, error);
+                statusEl.innerText = "連線中斷，正在續傳...";
+                await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+            }
+        }
     } catch (error) {
         console.error("Chat Error:", error);
         statusEl.innerText = "連線失敗，請檢查網路或系統狀態。";
@@ -182,7 +273,9 @@ async function sendMessage(manualMessage = null) {
 document.addEventListener('DOMContentLoaded', async () => {
     const sendBtn = document.getElementById('sendBtn');
     const userInput = document.getElementById('userInput');
-    const graphContainer = document.getElementById('mermaid-graph');
+
+    // 預先載入流程圖 (之後的串流事件只會切換高亮)
+    loadGraph();
 
     // 獲取並顯示 Provider 資訊
     async function fetchConfig() {
@@ -300,9 +393,9 @@ function beautifyContent(payload) {
     let extraHTML = '';
     const ui = payload.ui_data;
 
-    // 處理圖片與下載按鈕
+    // 處理圖片與下載按鈕 (內嵌 base64 或快取圖表 URL)
     text = text.replace(
-        /!\[.*?\]\((data:image\/.*?;base64,.*?)\)/g,
+        /!\[.*?\]\((data:image\/.*?;base64,.*?|\/api\/v1\/charts\/[0-9a-f]+\.[a-z]+)\)/g,
         (match, base64Data) => `
             <div class="chart-wrapper">
                 <img src="${base64Data}" class="chart-img" />
@@ -332,6 +425,14 @@ function beautifyContent(payload) {
             </div>`;
     }
 
+    // 瀏覽器端繪圖 (chartFormat=json)：後端只回傳降採樣後的序列資料
+    if (ui && ui.chart) {
+        extraHTML += `
+            <div class="data-component-container mode-chart">
+                ${renderChartSpec(ui.chart)}
+            </div>`;
+    }
+
     return `<div class="content-body">${text}</div>${extraHTML}`;
 }
 
@@ -376,4 +477,116 @@ function generateSimpleTable(list) {
                 <tbody>${rows}</tbody>
             </table>
         `;
-}
\ No newline at end of file
+}
+
+/**
+ * 將後端回傳的圖表描述 (ui_data.chart) 繪製成 SVG，伺服器不需要點陣化圖檔
+ * spec: { type, title, unit, x: [ISO 日期|null], series: [{label, color, values}], thresholds: [{value, color}] }
+ */
+function renderChartSpec(spec) {
+    const W = 640, H = 360;
+    const pad = { top: 44, right: 20, bottom: 56, left: 52 };
+    const plotW = W - pad.left - pad.right;
+    const plotH = H - pad.top - pad.bottom;
+    const n = spec.x.length;
+    const isBar = spec.type === 'bar';
+    const esc = s => String(s).replace(/[&<>"]/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;' })[c]);
+
+    const values = spec.series.flatMap(s => s.values).filter(v => v !== null);
+    if (!n || !values.length) return '<div class="msg-error">數據量不足，無法生成圖表。</div>';
+
+    // X 軸：長條圖等距排列，折線 / 散佈圖依時間比例排列
+    const times = spec.x.map(d => (d ? Date.parse(d) : NaN));
+    const valid = times.filter(t => !isNaN(t));
+    const tMin = Math.min(...valid), tMax = Math.max(...valid);
+    const byTime = !isBar && valid.length > 1 && tMax > tMin;
+    const xPos = i => byTime
+        ? pad.left + (times[i] - tMin) / (tMax - tMin) * plotW
+        : pad.left + (i + 0.5) * plotW / n;
+
+    // Y 軸範圍涵蓋所有數值與參考線
+    const bounds = values.concat(spec.thresholds.map(t => t.value));
+    let yMin = Math.min(...bounds), yMax = Math.max(...bounds);
+    const margin = (yMax - yMin) * 0.1 || 5;
+    yMin = isBar ? Math.min(0, yMin) : yMin - margin;
+    yMax += margin;
+    const yPos = v => pad.top + (yMax - v) / (yMax - yMin) * plotH;
+
+    const parts = [];
+    // 格線與 Y 軸刻度
+    for (let k = 0; k <= 5; k++) {
+        const v = yMin + (yMax - yMin) * k / 5;
+        const y = yPos(v).toFixed(1);
+        parts.push(`<line x1="${pad.left}" x2="${W - pad.right}" y1="${y}" y2="${y}" stroke="#eee" stroke-dasharray="4 4"/>`);
+        parts.push(`<text x="${pad.left - 6}" y="${y}" text-anchor="end" dominant-baseline="middle" font-size="11" fill="#666">${Math.round(v)}</text>`);
+    }
+    // X 軸日期標籤 (最多 8 個)
+    const step = Math.max(Math.ceil(n / 8), 1);
+    for (let i = 0; i < n; i += step) {
+        if (!spec.x[i] || (byTime && isNaN(times[i]))) continue;
+        const x = xPos(i).toFixed(1);
+        parts.push(`<text x="${x}" y="${H - pad.bottom + 18}" text-anchor="middle" font-size="11" fill="#666">${spec.x[i].slice(5, 10)}</text>`);
+    }
+    // 參考線 (收縮壓 120 / 舒張壓 80)
+    spec.thresholds.forEach(t => {
+        const y = yPos(t.value).toFixed(1);
+        parts.push(`<line x1="${pad.left}" x2="${W - pad.right}" y1="${y}" y2="${y}" stroke="${t.color}" stroke-dasharray="2 3" opacity="0.6"/>`);
+    });
+
+    // 數據序列
+    const barWidth = plotW / n * 0.8 / spec.series.length;
+    spec.series.forEach((s, si) => {
+        const points = s.values.map((v, i) => (v === null || (byTime && isNaN(times[i])) ? null : [xPos(i), yPos(v)]));
+        if (isBar) {
+            points.forEach((p, i) => {
+                if (!p) return;
+                const x = xPos(i) + (si - spec.series.length / 2) * barWidth;
+                parts.push(`<rect x="${x.toFixed(1)}" y="${p[1].toFixed(1)}" width="${barWidth.toFixed(1)}" height="${(yPos(Math.max(yMin, 0)) - p[1]).toFixed(1)}" fill="${s.color}" opacity="0.7"/>`);
+            });
+            return;
+        }
+        if (spec.type !== 'scatter') {
+            // 缺值處斷開線段
+            let d = '', pen = 'M';
+            points.forEach(p => {
+                if (!p) { pen = 'M'; return; }
+                d += `${pen}${p[0].toFixed(1)},${p[1].toFixed(1)} `;
+                pen = 'L';
+            });
+            parts.push(`<path d="${d}" fill="none" stroke="${s.color}" stroke-width="2"/>`);
+        }
+        if (spec.type === 'scatter' || n <= 60) {
+            const r = spec.type === 'scatter' ? 4 : 3;
+            points.forEach(p => {
+                if (p) parts.push(`<circle cx="${p[0].toFixed(1)}" cy="${p[1].toFixed(1)}" r="${r}" fill="${s.color}" stroke="white"/>`);
+            });
+        }
+    });
+
+    // 標題、單位與圖例
+    parts.push(`<text x="${W / 2}" y="22" text-anchor="middle" font-size="16" font-weight="bold" fill="#333">${esc(spec.title)}</text>`);
+    parts.push(`<text x="14" y="${pad.top + plotH / 2}" transform="rotate(-90 14 ${pad.top + plotH / 2})" text-anchor="middle" font-size="12" fill="#666">${esc(spec.unit)}</text>`);
+    spec.series.forEach((s, si) => {
+        const x = W - pad.right - (spec.series.length - si) * 80;
+        parts.push(`<rect x="${x}" y="${H - 20}" width="12" height="12" fill="${s.color}"/>`);
+        parts.push(`<text x="${x + 16}" y="${H - 10}" font-size="12" fill="#333">${esc(s.label)}</text>`);
+    });
+
+    return `
+        <div class="chart-wrapper">
+            <svg class="chart-svg" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 ${W} ${H}" width="100%">${parts.join('')}</svg>
+            <button class="download-btn" onclick="downloadChartSvg(this)">
+                <i class="fas fa-download"></i> 下載圖表
+            </button>
+        </div>`;
+}
+
+/**
+ * 下載瀏覽器繪製的 SVG 圖表
+ */
+function downloadChartSvg(button) {
+    const svg = button.parentElement.querySelector('.chart-svg');
+    const source = new XMLSerializer().serializeToString(svg);
+    downloadChart(`data:image/svg+xml;charset=utf-8,${encodeURIComponent(source)}`);
+}
+window.downloadChartSvg = downloadChartSvg;
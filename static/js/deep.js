@@ -21,18 +21,89 @@ function resetUI() {
 // 執行實驗 (主進入點)
 async function runExperiment() {
     const symbolInput = document.getElementById('symbolInput');
-    const symbol = symbolInput.value.trim();
+    // 支援以逗號或空白分隔的多個代號 (Watchlist)
+    const symbols = symbolInput.value.split(/[,\s]+/).map(s => s.trim()).filter(Boolean);
 
-    if (!symbol) {
+    if (symbols.length === 0) {
         alert("請輸入標的代號");
         return;
     }
 
     resetUI();
 
+    if (symbols.length > 1) {
+        // 多檔標的：手動模式改用批次端點，官方模式僅適用單一標的
+        fetchManualBatch(symbols);
+        document.getElementById('officialStatus').innerText = "略過";
+        document.getElementById('officialResult').innerHTML =
+            '<p class="text-gray-400">官方自主代理模式一次僅分析一個標的。</p>';
+        return;
+    }
+
     // 並行執行兩個模式
-    fetchManual(symbol);
-    fetchOfficial(symbol);
+    fetchManual(symbols[0]);
+    fetchOfficial(symbols[0]);
+}
+
+// --- 手動 LangGraph 批次模式 (Watchlist) ---
+async function fetchManualBatch(symbols) {
+    const status = document.getElementById('manualStatus');
+    const thought = document.getElementById('manualThought');
+    const resultArea = document.getElementById('manualResult');
+
+    thought.innerHTML += `> [BATCH] 共 ${symbols.length} 檔，批次抓取行情與新聞...\n`;
+    let completed = 0;
+
+    try {
+        const response = await fetch('/api/v1/deep-research/invest/manual/batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-API-Key': getApiToken()
+            },
+            body: JSON.stringify({ symbols: symbols })
+        });
+        if (!response.ok) throw new Error(`HTTP 錯誤! 狀態碼: ${response.status}`);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        resultArea.innerHTML = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const blocks = buffer.split("\n\n");
+            buffer = blocks.pop();
+
+            for (const block of blocks) {
+                const dataLine = block.split("\n").find(line => line.startsWith("data: "));
+                if (!dataLine) continue;
+                const event = JSON.parse(dataLine.slice(6));
+
+                if (event.type === "result") {
+                    completed += 1;
+                    status.innerText = `完成 ${completed}/${symbols.length}`;
+                    thought.innerHTML += `> [DONE] ${event.symbol} (風險: ${event.data.risk_level || '-'})\n`;
+                    resultArea.innerHTML += `
+                        <div class='mb-6'>
+                            <h3 class='text-lg font-bold mb-2'>${event.symbol}</h3>
+                            <div class='prose prose-invert max-w-none'>${event.data.final_response.replace(/\n/g, '<br>')}</div>
+                        </div>`;
+                } else if (event.type === "error") {
+                    completed += 1;
+                    thought.innerHTML += `> [ERROR] ${event.symbol || ''} ${event.content}\n`;
+                } else if (event.type === "done") {
+                    status.innerText = "完成";
+                    thought.innerHTML += "> [END] 批次分析結束\n";
+                }
+            }
+        }
+    } catch (e) {
+        status.innerText = "出錯";
+        resultArea.innerHTML += `<span class="text-red-400">系統錯誤: ${e.message}</span>`;
+    }
 }
 
 // --- 手動 LangGraph 模式 ---
@@ -75,16 +146,60 @@ async function fetchManual(symbol) {
     }
 }
 
-// --- 官方自主代理模式 ---
+// --- 官方自主代理模式 (背景任務) ---
+
+// 串流任務進度；若串流中斷則改為輪詢結果端點
+async function followJob(jobId, thought) {
+    const headers = { 'X-API-Key': getApiToken() };
+    try {
+        const response = await fetch(`/api/v1/deep-research/jobs/${jobId}/events`, { headers });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const blocks = buffer.split("\n\n");
+            buffer = blocks.pop();
+
+            for (const block of blocks) {
+                const dataLine = block.split("\n").find(line => line.startsWith("data: "));
+                if (!dataLine) continue;
+                const event = JSON.parse(dataLine.slice(6));
+                if (event.type === "step") {
+                    thought.innerHTML += `> [STEP] ${event.data.detail}\n`;
+                } else if (event.type === "final") {
+                    return { result: event.data };
+                } else if (event.type === "error") {
+                    return { error: event.content };
+                }
+            }
+        }
+    } catch (e) {
+        console.warn("Job stream dropped, falling back to polling:", e);
+    }
+
+    // 輪詢結果：任務仍在執行時回傳 202
+    while (true) {
+        const response = await fetch(`/api/v1/deep-research/jobs/${jobId}/result`, { headers });
+        if (response.status !== 202) return await response.json();
+        await new Promise(resolve => setTimeout(resolve, 2000));
+    }
+}
+
 async function fetchOfficial(symbol) {
     const status = document.getElementById('officialStatus');
     const thought = document.getElementById('officialThought');
     const resultArea = document.getElementById('officialResult');
 
-    thought.innerHTML += "> [PLANNING] 正在啟動官方自主代理 (DeepAgents)...\n";
+    thought.innerHTML += "> [PLANNING] 正在提交官方自主代理任務 (DeepAgents)...\n";
 
     try {
-        const response = await fetch('/api/v1/deep-research/invest/official', {
+        const response = await fetch('/api/v1/deep-research/invest/official/jobs', {
             method: 'POST',
             headers: { 
                 'Content-Type': 'application/json',
@@ -95,13 +210,18 @@ async function fetchOfficial(symbol) {
 
         if (!response.ok) throw new Error(`HTTP 錯誤! 狀態碼: ${response.status}`);
 
-        const jsonResponse = await response.json();
+        const job = await response.json();
+        thought.innerHTML += `> [JOB] 任務已排入佇列 (${job.job_id})\n`;
+
+        const jsonResponse = await followJob(job.job_id, thought);
         let content = "";
         const finalResponse = jsonResponse?.result?.final_response;
 
         if (Array.isArray(finalResponse) && finalResponse.length > 0 && finalResponse[0].text) {
             content = finalResponse[0].text;
             if (content.trim().length < 5) content = "⚠️ AI 回傳內容過於簡短，可能因數據源受限。";
+        } else if (typeof finalResponse === 'string' && finalResponse.trim()) {
+            content = finalResponse;
         } else if (jsonResponse?.error) {
             content = `❌ 系統錯誤: ${jsonResponse.error}`;
         } else {
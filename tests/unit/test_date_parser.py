@@ -0,0 +1,57 @@
+import pytest
+from datetime import date
+from app.utils.date_parser import parse_date_range
+
+# 以 2026-03-18 (星期三) 作為「今天」
+NOW = date(2026, 3, 18)
+
+DATE_CORPUS = [
+    # 固定偏移的單日
+    ("今天血壓如何", ("2026-03-18", "2026-03-18")),
+    ("昨天的紀錄", ("2026-03-17", "2026-03-17")),
+    ("前天", ("2026-03-16", "2026-03-16")),
+    ("大前天量的", ("2026-03-15", "2026-03-15")),
+    ("yesterday", ("2026-03-17", "2026-03-17")),
+    # 星期幾
+    ("上週五", ("2026-03-13", "2026-03-13")),
+    ("上星期一的血壓", ("2026-03-09", "2026-03-09")),
+    ("上上週三", ("2026-03-04", "2026-03-04")),
+    ("這週一", ("2026-03-16", "2026-03-16")),
+    ("週日", ("2026-03-15", "2026-03-15")),
+    ("last friday", ("2026-03-13", "2026-03-13")),
+    # 最近 N 天 / 週 / 月
+    ("這三天", ("2026-03-16", "2026-03-18")),
+    ("最近7天", ("2026-03-12", "2026-03-18")),
+    ("近十四天", ("2026-03-05", "2026-03-18")),
+    ("最近兩週", ("2026-03-05", "2026-03-18")),
+    ("最近3個月", ("2025-12-19", "2026-03-18")),
+    ("past two weeks", ("2026-03-05", "2026-03-18")),
+    ("last 3 days", ("2026-03-16", "2026-03-18")),
+    # 整週 / 整月 / 整年
+    ("上週", ("2026-03-09", "2026-03-15")),
+    ("這週", ("2026-03-16", "2026-03-18")),
+    ("上個月", ("2026-02-01", "2026-02-28")),
+    ("本月", ("2026-03-01", "2026-03-18")),
+    ("今年", ("2026-01-01", "2026-03-18")),
+    ("去年", ("2025-01-01", "2025-12-31")),
+    # 明確日期與區間
+    ("2024-03-01", ("2024-03-01", "2024-03-01")),
+    ("2024年3月1日", ("2024-03-01", "2024-03-01")),
+    ("2024/02/10 - 2024/02/20", ("2024-02-10", "2024-02-20")),
+    ("3/1~3/7", ("2026-03-01", "2026-03-07")),
+    ("3/1-3/7", ("2026-03-01", "2026-03-07")),
+    ("3月1日到3月7日", ("2026-03-01", "2026-03-07")),
+    # 省略年份且晚於今天時視為去年
+    ("12/25", ("2025-12-25", "2025-12-25")),
+    # 無法確定範圍
+    ("最近", None),
+    ("我最近血壓正常嗎？", None),
+    ("血壓 120/80 正常嗎", None),
+    ("你好", None),
+    ("", None),
+]
+
+
+@pytest.mark.parametrize("text, expected", DATE_CORPUS)
+def test_parse_date_range_corpus(text, expected):
+    assert parse_date_range(text, NOW) == expected
@@ -3,6 +3,7 @@ import json
 from unittest.mock import MagicMock, patch, AsyncMock
 from app.services.medical.nodes.expert import ExpertNodes
 from app.schemas.agent import ChartParams
+from app.services.chart_cache import ChartCache
 
 @pytest.fixture
 def expert_nodes():
@@ -27,7 +28,7 @@ async def test_node_device_expert(expert_nodes):
             mock_knowledge.ainvoke.assert_called_with({"query": "如何使用血壓計？"})
 
 @pytest.mark.asyncio
-async def test_node_visualizer(expert_nodes):
+async def test_node_visualizer(expert_nodes, tmp_path):
     # Mock LLM with structured output
     mock_structured_llm = MagicMock()
     params = ChartParams(
@@ -40,15 +41,165 @@ async def test_node_visualizer(expert_nodes):
     mock_structured_llm.ainvoke = AsyncMock(return_value=params)
     expert_nodes.llm.with_structured_output.return_value = mock_structured_llm
     
-    with patch("app.services.medical.nodes.expert.plot_health_chart") as mock_plot:
-        mock_plot.invoke.return_value = "base64_chart_data"
+    with patch("app.services.medical.nodes.expert.chart_pool.render_bytes",
+               new=AsyncMock(return_value=b"chart-bytes")) as mock_plot, \
+         patch("app.services.medical.nodes.expert.chart_cache", ChartCache(str(tmp_path), secret="test-secret")):
         
         state = {
             "user_id": "user123",
-            "input_message": "幫我畫圖",
+            # 需求含資料以外的指標，無法以規則推導，交由 LLM 決定參數
+            "input_message": "幫我畫體重和血壓的圖",
             "context_data": json.dumps([{"sys": 120, "dia": 80}])
         }
         res = await expert_nodes.node_visualizer(state)
         
-        assert "base64_chart_data" in res["final_response"]
-        assert "血壓趨勢" in str(mock_plot.invoke.call_args)
+        # 回覆只帶圖表 URL，圖檔寫入內容雜湊命名的快取
+        assert "/api/v1/charts/" in res["final_response"]
+        assert "base64" not in res["final_response"]
+        assert mock_plot.call_args.kwargs["title"] == "血壓趨勢"
+        # 繪圖直接使用解析後的紀錄容器，不再傳遞 JSON 字串
+        assert len(mock_plot.call_args.args[0]) == 1
+        assert len(list(tmp_path.iterdir())) == 1
+
+        # 相同數據與參數再次請求時直接命中快取
+        res2 = await expert_nodes.node_visualizer(state)
+        assert res2["final_response"] == res["final_response"]
+        assert mock_plot.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_node_visualizer_fast_path_skips_llm(expert_nodes, tmp_path):
+    with patch("app.services.medical.nodes.expert.chart_pool.render_bytes",
+               new=AsyncMock(return_value=b"chart-bytes")) as mock_plot, \
+         patch("app.services.medical.nodes.expert.chart_cache", ChartCache(str(tmp_path), secret="test-secret")):
+        state = {
+            "user_id": "user123",
+            "input_message": "好",
+            "analysis_summary": "您的血壓大致穩定。需要幫您繪製心率的長條圖嗎？",
+            "context_data": json.dumps([{"date": "2026-03-01 08:00", "sys": 120, "dia": 80, "pul": 72}])
+        }
+        res = await expert_nodes.node_visualizer(state)
+
+        expert_nodes.llm.with_structured_output.assert_not_called()
+        assert "/api/v1/charts/" in res["final_response"]
+        kwargs = mock_plot.call_args.kwargs
+        assert (kwargs["chart_type"], kwargs["columns"], kwargs["unit"]) == ("bar", ["pul"], "bpm")
+
+
+@pytest.mark.asyncio
+async def test_node_visualizer_client_side_spec(expert_nodes):
+    with patch("app.services.medical.nodes.expert.chart_pool.render_bytes",
+               new=AsyncMock()) as mock_plot:
+        state = {
+            "user_id": "user123",
+            "input_message": "畫血壓趨勢圖",
+            "chart_format": "json",
+            "context_data": json.dumps([{"date": "2026-03-01 08:00", "sys": 120, "dia": 80, "pul": 72}])
+        }
+        res = await expert_nodes.node_visualizer(state)
+
+        # 伺服器不繪圖，只回傳序列資料給瀏覽器
+        mock_plot.assert_not_called()
+        assert "![Health Chart]" not in res["final_response"]
+        spec = res["ui_data"]["chart"]
+        assert spec["type"] == "line" and [s["values"] for s in spec["series"]] == [[120.0], [80.0]]
+
+
+@pytest.mark.asyncio
+async def test_node_visualizer_falls_back_to_llm_without_metric(expert_nodes, tmp_path):
+    structured_llm = MagicMock()
+    structured_llm.ainvoke = AsyncMock(return_value=ChartParams(
+        title="心率趨勢", chart_type="line", columns=["pul"], labels=["心率"], unit="bpm"))
+    expert_nodes.llm.with_structured_output.return_value = structured_llm
+    with patch("app.services.medical.nodes.expert.chart_pool.render_bytes",
+               new=AsyncMock(return_value=b"chart-bytes")) as mock_plot, \
+         patch("app.services.medical.nodes.expert.chart_cache", ChartCache(str(tmp_path), secret="test-secret")):
+        state = {
+            "user_id": "user123",
+            "input_message": "幫我畫圖",
+            "context_data": json.dumps([{"date": "2026-03-01 08:00", "sys": 120, "dia": 80, "pul": 72}])
+        }
+        await expert_nodes.node_visualizer(state)
+
+    # 沒有指名指標，規則不猜測，交由 LLM 決定
+    structured_llm.ainvoke.assert_awaited_once()
+    assert mock_plot.call_args.kwargs["columns"] == ["pul"]
+
+
+@pytest.mark.asyncio
+async def test_node_visualizer_fetches_requested_range(expert_nodes, tmp_path):
+    from app.services.blob_store import BlobStore
+    from app.services.medical import records as record_module
+    from app.utils.health_records import HealthRecords
+
+    march = HealthRecords.from_history([{"date": "2026-03-01 08:00", "sys": 120, "dia": 80}])
+    april = json.dumps({"status": "success", "total": 2, "history": [
+        {"date": "2026-04-01 08:00", "sys": 130, "dia": 85},
+        {"date": "2026-04-02 08:00", "sys": 132, "dia": 86},
+    ]})
+    fetch = MagicMock()
+    fetch.ainvoke = AsyncMock(return_value=april)
+    store = BlobStore(str(tmp_path / "b.sqlite"))
+    with patch.object(record_module, "record_blobs", store), \
+         patch("app.services.medical.nodes.expert.get_user_health_data", fetch), \
+         patch("app.services.medical.nodes.expert.chart_pool.render_bytes",
+               new=AsyncMock(return_value=b"chart-bytes")) as mock_plot, \
+         patch("app.services.medical.nodes.expert.chart_cache", ChartCache(str(tmp_path / "charts"), secret="test-secret")):
+        march_ref = await record_module.store_records("user123", march, "2026-03-01", "2026-03-31")
+        state = {
+            "user_id": "user123",
+            "input_message": "畫上個月的血壓圖",
+            "query_start": "2026-04-01",
+            "query_end": "2026-04-30",
+            "records_ref": march_ref,
+        }
+        res = await expert_nodes.node_visualizer(state)
+
+    # State 中是三月的紀錄，本輪要求四月：重新抓取並更新 handle
+    fetch.ainvoke.assert_awaited_once_with(
+        {"user_id": "user123", "start_date": "2026-04-01", "end_date": "2026-04-30"})
+    assert len(mock_plot.call_args.args[0]) == 2
+    assert (res["records_ref"]["start"], res["records_ref"]["end"]) == ("2026-04-01", "2026-04-30")
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_node_visualizer_keeps_or_refreshes_records_ref(expert_nodes, tmp_path):
+    from app.services.blob_store import BlobStore
+    from app.services.medical import records as record_module
+    from app.utils.health_records import HealthRecords
+
+    history = json.dumps({"status": "success", "total": 1, "history": [
+        {"date": "2026-04-01 08:00", "sys": 130, "dia": 85},
+    ]})
+    empty = json.dumps({"status": "success", "total": 0, "history": []})
+    fetch = MagicMock()
+    store = BlobStore(str(tmp_path / "b.sqlite"))
+    with patch.object(record_module, "record_blobs", store), \
+         patch("app.services.medical.nodes.expert.get_user_health_data", fetch), \
+         patch("app.services.medical.nodes.expert.chart_pool.render_bytes",
+               new=AsyncMock(return_value=b"chart-bytes")), \
+         patch("app.services.medical.nodes.expert.chart_cache", ChartCache(str(tmp_path / "charts"), secret="test-secret")):
+        # State 中沒有紀錄：後備抓取的結果寫入 blob store，並回傳新的 handle
+        fetch.ainvoke = AsyncMock(return_value=history)
+        res = await expert_nodes.node_visualizer({"user_id": "user123", "input_message": "畫血壓圖"})
+        assert await store.get(res["records_ref"]["hash"]) is not None
+
+        # 指定區間查無紀錄時，不以 None 覆寫 State 中原有的 handle
+        march = HealthRecords.from_history([{"date": "2026-03-01 08:00", "sys": 120, "dia": 80}])
+        march_ref = await record_module.store_records("user123", march, "2026-03-01", "2026-03-31")
+        fetch.ainvoke = AsyncMock(return_value=empty)
+        # 沒有數據可推導參數，交由 LLM 決定
+        structured_llm = MagicMock()
+        structured_llm.ainvoke = AsyncMock(return_value=ChartParams(
+            title="血壓趨勢", chart_type="line", columns=["sys", "dia"], labels=["收縮壓", "舒張壓"], unit="mmHg"))
+        expert_nodes.llm.with_structured_output.return_value = structured_llm
+        res = await expert_nodes.node_visualizer({
+            "user_id": "user123",
+            "input_message": "畫上個月的血壓圖",
+            "query_start": "2026-04-01",
+            "query_end": "2026-04-30",
+            "records_ref": march_ref,
+        })
+        assert "records_ref" not in res
+    await store.close()
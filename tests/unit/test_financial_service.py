@@ -58,3 +58,28 @@ async def test_node_final_decision(financial_service, fake_llm_factory):
         res = await financial_service.node_final_decision(state)
         
         assert res["final_response"] == "最終建議：買入"
+
+@pytest.mark.asyncio
+async def test_run_manual_batch_shares_market_data(financial_service, fake_llm_factory):
+    financial_service.llm = fake_llm_factory(["低風險", "建議 A", "低風險", "建議 B"])
+
+    with patch("app.services.financial_service.get_batch_stock_prices") as mock_batch, \
+            patch("app.services.financial_service.get_stock_price") as mock_price, \
+            patch("app.services.financial_service.get_market_news") as mock_news, \
+            patch("app.services.financial_service.load_specialized_skill") as mock_skill:
+        mock_batch.return_value = {"2330.TW": "2330.TW 當前價: 1000.00 TWD"}
+        mock_price.invoke.return_value = "AAPL 當前價: 200.00 USD"
+        mock_news.invoke.return_value = "新聞"
+        mock_skill.invoke.return_value = "金融專家技能配置"
+
+        results = [r async for r in financial_service.run_manual_batch(["2330", "AAPL"], concurrency=2)]
+
+        # 股價以一次批次下載取得，只有缺漏的代號才逐檔查詢
+        mock_batch.assert_called_once_with(["2330.TW", "AAPL"])
+        mock_price.invoke.assert_called_once_with({"symbol": "AAPL"})
+        assert mock_news.invoke.call_count == 2
+
+    by_symbol = {symbol: (result, error) for symbol, result, error in results}
+    assert set(by_symbol) == {"2330", "AAPL"}
+    assert "1000.00" in by_symbol["2330"][0]["data_raw"]
+    assert by_symbol["AAPL"][1] is None
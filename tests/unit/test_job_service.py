@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from app.services.job_service import JobStore, ResearchJobManager, JobQueueFull
+
+
+async def _wait_for_status(manager, job_id, statuses, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        job = await manager.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"任務未在時限內進入 {statuses}")
+
+
+@pytest.mark.asyncio
+async def test_job_runs_in_background_and_persists(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite")
+
+    async def fake_runner(payload, on_step):
+        await on_step({"node": "model", "detail": "呼叫工具: get_stock_price"})
+        return {"final_response": f"{payload['symbol']} 建議持有", "steps": []}
+
+    manager = ResearchJobManager(JobStore(db_path), {"official_research": fake_runner}, concurrency=1)
+    await manager.start()
+    job = await manager.submit("official_research", {"symbol": "2330"})
+    assert job["status"] == "queued"
+
+    done = await _wait_for_status(manager, job["job_id"], {"succeeded"})
+    assert done["result"]["final_response"] == "2330 建議持有"
+    assert done["steps"][0]["detail"] == "呼叫工具: get_stock_price"
+    await manager.close()
+
+    # 重啟後仍可讀取已完成的結果
+    restarted = ResearchJobManager(JobStore(db_path), {"official_research": fake_runner})
+    await restarted.start()
+    job_after = await restarted.get(job["job_id"])
+    assert job_after["status"] == "succeeded"
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_job_queue_bound_and_failure(tmp_path):
+    release = asyncio.Event()
+
+    async def blocking_runner(payload, on_step):
+        await release.wait()
+        raise RuntimeError("代理執行失敗")
+
+    manager = ResearchJobManager(JobStore(str(tmp_path / "jobs.sqlite")),
+                                 {"official_research": blocking_runner},
+                                 concurrency=1, queue_size=1)
+    await manager.start()
+    first = await manager.submit("official_research", {"symbol": "AAPL"})
+    await _wait_for_status(manager, first["job_id"], {"running"})
+    await manager.submit("official_research", {"symbol": "MSFT"})
+    with pytest.raises(JobQueueFull):
+        await manager.submit("official_research", {"symbol": "TSLA"})
+
+    release.set()
+    failed = await _wait_for_status(manager, first["job_id"], {"failed"})
+    assert failed["error"] == "代理執行失敗"
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submits_never_overfill_queue(tmp_path):
+    release = asyncio.Event()
+
+    async def blocking_runner(payload, on_step):
+        await release.wait()
+        return {}
+
+    manager = ResearchJobManager(JobStore(str(tmp_path / "jobs.sqlite")),
+                                 {"official_research": blocking_runner},
+                                 concurrency=1, queue_size=2)
+    await manager.start()
+    first = await manager.submit("official_research", {"symbol": "AAPL"})
+    await _wait_for_status(manager, first["job_id"], {"running"})
+    # 同時送出的請求在寫入 SQLite 期間互相搶位，多出的請求只能得到 JobQueueFull
+    results = await asyncio.gather(*[
+        manager.submit("official_research", {"symbol": f"S{i}"}) for i in range(5)
+    ], return_exceptions=True)
+    accepted = [r for r in results if isinstance(r, dict)]
+    assert len(accepted) == 2
+    assert all(isinstance(r, JobQueueFull) for r in results if not isinstance(r, dict))
+    for job in accepted:
+        assert (await manager.get(job["job_id"]))["status"] == "queued"
+    release.set()
+    await manager.close()
@@ -0,0 +1,37 @@
+from unittest.mock import patch
+
+from app.core.config import settings
+from app.services.llm_registry import LLMRegistry
+
+
+def test_registry_shares_clients_per_key():
+    """相同 provider / model / 參數共用同一個實例，tier 未設定時沿用預設模型"""
+    registry = LLMRegistry()
+    with patch.object(settings, "llm_provider", "google"), \
+         patch.object(settings, "llm_tier_models", {"router": "gemini-2.5-flash-lite"}):
+        default = registry.get()
+        assert registry.get() is default
+        # analysis 未設定模型，與預設共用同一個實例
+        assert registry.get("analysis") is default
+        assert registry.has_tier("router") and not registry.has_tier("analysis")
+
+        router = registry.get("router")
+        assert router is not default
+        assert router.model.endswith("gemini-2.5-flash-lite")
+        # 參數不同視為不同的用戶端
+        assert registry.get(temperature=0.7) is not default
+
+    stats = registry.stats()
+    assert stats["clients"] == 3
+    assert stats["misses"] == 3
+    assert stats["hits"] == 2
+
+
+def test_registry_rejects_unknown_provider():
+    registry = LLMRegistry()
+    with patch.object(settings, "llm_provider", "unknown"):
+        try:
+            registry.get()
+            assert False, "應拋出 ValueError"
+        except ValueError as e:
+            assert "unknown" in str(e)
@@ -0,0 +1,329 @@
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from datetime import date
+import httpx
+import pytest
+from fastapi import HTTPException
+from unittest.mock import patch
+
+from app.core.config import settings
+from app.services.tools import medical_tools
+from app.services.tools.medical_tools import HealthRecordPager, get_user_health_data
+from app.services.health_store import HealthRecordStore
+from app.services.blob_store import BlobStore
+from app.services.medical import records
+from app.utils.health_records import HealthRecords
+from app.services.chart_pool import ChartRenderPool, ChartRenderBusy
+from app.services.charts import build_chart_spec, render_health_chart
+from app.services.chart_cache import ChartCache
+from app.api import charts_router
+from app.utils.http_client import PooledHttpClient
+
+
+def _fake_bpm_api(total: int, requests: list):
+    """模擬 BPM API：依 offset / limit 回傳紀錄，日期以 offset 遞增"""
+
+    def handler(request):
+        params = request.url.params
+        requests.append(dict(params))
+        offset, limit = int(params["offset"]), int(params["limit"])
+        data = [{
+            "date": f"{params['start']} 08:{i % 60:02d}",
+            "sys": 120,
+            "dia": 80,
+            "pul": 70,
+        } for i in range(offset, min(offset + limit, total))]
+        return httpx.Response(200, json={"data": data, "total_num": total})
+
+    return PooledHttpClient("bpm_test", "http://bpm.test", backoff=0,
+                            transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.asyncio
+async def test_get_user_health_data_fetches_all_pages():
+    requests = []
+    client = _fake_bpm_api(250, requests)
+    with patch.object(medical_tools, "bpm_client", client), \
+         patch.object(settings, "health_cache_enabled", False):
+        raw = await get_user_health_data.ainvoke({
+            "user_id": "u1", "start_date": "2026-03-01", "end_date": "2026-03-07"
+        })
+    data = json.loads(raw)
+    assert data["total"] == 250
+    assert len(data["history"]) == 250
+    assert data["truncated"] is False
+    assert sorted(int(r["offset"]) for r in requests) == [0, 100, 200]
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_pager_respects_record_cap_and_windows():
+    requests = []
+    client = _fake_bpm_api(1000, requests)
+    with patch.object(medical_tools, "bpm_client", client):
+        pager = HealthRecordPager("2026-01-01", "2026-03-31", page_size=100,
+                                  concurrency=2, max_records=250, window_days=30)
+        records = [r async for page in pager.pages() for r in page]
+
+    # 以頁為單位停止，只抓最新一個視窗的前三頁
+    assert len(records) == 300
+    assert pager.truncated is True
+    assert {r["start"] for r in requests} == {"2026-03-02"}
+    assert len(pager.windows) == 3
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_health_cache_fetches_only_missing_ranges(tmp_path):
+    requests = []
+    client = _fake_bpm_api(5, requests)
+    store = HealthRecordStore(str(tmp_path / "health.sqlite"), settled_ttl_seconds=3600)
+    with patch.object(medical_tools, "bpm_client", client), \
+         patch.object(medical_tools, "health_store", store), \
+         patch.object(settings, "health_cache_enabled", True):
+        args = {"user_id": "u1", "start_date": "2024-03-01", "end_date": "2024-03-07"}
+        first = json.loads(await get_user_health_data.ainvoke(args))
+        assert len(requests) == 1
+        assert first["total"] == 5
+
+        # 相同範圍再問一次，完全由本地快取回答
+        again = json.loads(await get_user_health_data.ainvoke(args))
+        assert len(requests) == 1
+        assert again["history"] == first["history"]
+
+        # 擴大範圍時只補抓缺少的區間
+        await get_user_health_data.ainvoke({**args, "end_date": "2024-03-10"})
+        assert len(requests) == 2
+        assert (requests[-1]["start"], requests[-1]["end"]) == ("2024-03-08", "2024-03-10")
+    await client.close()
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_health_store_freshness_and_deletions(tmp_path):
+    store = HealthRecordStore(str(tmp_path / "health.sqlite"), recent_ttl_seconds=0)
+    records = [{"date": "2024-03-01 08:00", "sys": 120, "dia": 80, "pul": 70},
+               {"date": "2024-03-01 20:00", "sys": 130, "dia": 85, "pul": 72}]
+    await store.replace_range("u1", "2024-03-01", "2024-03-01", records)
+    assert await store.missing_ranges("u1", "2024-03-01", "2024-03-02") == [("2024-03-02", "2024-03-02")]
+
+    # 遠端刪除一筆後重新同步，本地也應移除
+    await store.replace_range("u1", "2024-03-01", "2024-03-01", records[:1])
+    assert len(await store.query("u1", "2024-03-01", "2024-03-01")) == 1
+
+    # 當天才同步的今日資料屬於近期資料，使用短 TTL (此處為 0，立即過期)
+    today = date.today().isoformat()
+    await store.replace_range("u1", today, today, [])
+    assert await store.missing_ranges("u1", today, today) == [(today, today)]
+
+    # 被截斷 (不完整) 的同步會讓該範圍失效，下次查詢時重新同步
+    await store.replace_range("u1", "2024-03-01", "2024-03-01", records[:1], complete=False)
+    assert await store.missing_ranges("u1", "2024-03-01", "2024-03-01") == [("2024-03-01", "2024-03-01")]
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_health_store_keeps_same_minute_readings(tmp_path):
+    store = HealthRecordStore(str(tmp_path / "health.sqlite"))
+    # 同一分鐘連續量三次血壓，三筆都應保留且維持順序
+    records = [{"date": "2024-03-01 08:00", "sys": sys, "dia": 80, "pul": 70, "note": ""}
+               for sys in (128, 124, 121)]
+    await store.replace_range("u1", "2024-03-01", "2024-03-01", records)
+    assert await store.query("u1", "2024-03-01", "2024-03-01") == records
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_fetches_are_coalesced():
+    requests = []
+    client = _fake_bpm_api(3, requests)
+    args = {"user_id": "u1", "start_date": "2026-03-01", "end_date": "2026-03-07"}
+    with patch.object(medical_tools, "bpm_client", client), \
+         patch.object(settings, "health_cache_enabled", False):
+        results = await asyncio.gather(*[get_user_health_data.ainvoke(args) for _ in range(3)])
+    assert len(set(results)) == 1
+    assert len(requests) == 1
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_blob_store_dedup_and_gc(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs.sqlite"), gc_grace_seconds=0)
+    first = await store.put("thread-a", '{"history": [1]}')
+    assert await store.put("thread-b", '{"history": [1]}') == first
+
+    # thread-a 改指向新內容後，舊 blob 仍被 thread-b 引用，不會被回收
+    second = await store.put("thread-a", '{"history": [2]}')
+    assert await store.gc() == 0
+    await store.put("thread-b", '{"history": [3]}')
+    assert await store.gc() == 1
+    assert await store.get(first) is None
+    assert await store.get(second) == '{"history": [2]}'
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_load_records_refetches_collected_blob(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs.sqlite"))
+    requests = []
+    client = _fake_bpm_api(3, requests)
+    with patch.object(records, "record_blobs", store), \
+         patch.object(medical_tools, "bpm_client", client), \
+         patch.object(settings, "health_cache_enabled", False):
+        stored = HealthRecords.from_json('{"history": []}')
+        ref = await records.store_records("u1", stored, "2026-03-01", "2026-03-01")
+        assert await records.load_records({"records_ref": ref}) == '{"history": []}'
+        assert await records.load_record_set({"records_ref": ref}) is stored
+
+        # blob 已被回收時依 handle 範圍重新抓取
+        stale = {**ref, "hash": "0" * 64}
+        raw = await records.load_records({"records_ref": stale})
+        assert len(json.loads(raw)["history"]) == 3
+
+        # 重新抓取後以與 store_records 相同的序列化寫入，並回傳新的 handle
+        refetched, new_ref = await records.resolve_record_set({"records_ref": stale})
+        assert len(refetched) == 3 and new_ref["hash"] != stale["hash"]
+        assert new_ref["hash"] == hashlib.sha256(refetched.to_json().encode("utf-8")).hexdigest()
+        assert await store.get(new_ref["hash"]) == refetched.to_json()
+        # 寫回新 handle 後不再重新抓取
+        fetches = len(requests)
+        again, same_ref = await records.resolve_record_set({"records_ref": new_ref})
+        assert len(again) == 3 and same_ref == new_ref and len(requests) == fetches
+        assert await records.load_records({"context_data": "legacy"}) == "legacy"
+    await store.close()
+    await client.close()
+
+
+def test_health_records_columnar_roundtrip():
+    raw = json.dumps({
+        "status": "success",
+        "history": [
+            {"date": "2026-03-01 08:05", "sys": 120, "dia": 80, "pul": 70, "note": "早上"},
+            {"date": "2026-03-01 20:30", "sys": 135, "dia": None, "pul": 75, "note": "早上"},
+        ],
+        "total": 2,
+    }, ensure_ascii=False)
+    records = HealthRecords.from_json(raw)
+
+    assert len(records) == 2 and records.total == 2
+    assert records.note_table == ["早上"]
+    assert records.column("sys").tolist() == [120, 135]
+    assert not records.column("sys").flags.writeable
+    assert records.frame()["dia"].isna().tolist() == [False, True]
+    # 未修改的容器直接沿用原始字串
+    assert records.to_json() is raw
+    assert records.to_history()[1] == {
+        "date": "2026-03-01 20:30", "sys": 135, "dia": None, "pul": 75, "note": "早上"
+    }
+    assert HealthRecords.from_json('{"status": "error"}').status == "error"
+
+
+@pytest.mark.asyncio
+async def test_chart_pool_renders_in_worker_process():
+    records = HealthRecords.from_history([{
+        "date": f"2026-03-{day:02d} 08:00", "sys": 120 + day, "dia": 80, "pul": 70
+    } for day in range(1, 8)])
+    pool = ChartRenderPool(workers=1, max_queue=1, timeout=60)
+    await pool.start()
+    try:
+        render = asyncio.create_task(pool.render(records, title="血壓", chart_type="line"))
+        await asyncio.sleep(0)
+        assert pool.queue_depth == 1
+        with pytest.raises(ChartRenderBusy):
+            await pool.render(records)
+        assert (await render).startswith("data:image/png;base64,")
+        assert pool.queue_depth == 0
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_chart_pool_recovers_from_crashed_worker():
+    records = HealthRecords.from_history([{"date": "2026-03-01 08:00", "sys": 120, "dia": 80}])
+    pool = ChartRenderPool(workers=1, max_queue=2, timeout=60)
+    await pool.start()
+    try:
+        restarts = pool.stats()["restarts"]
+        # 模擬 worker 被 OOM killer 終止
+        for process in list(pool._executor._processes.values()):
+            process.kill()
+            process.join()
+        assert (await pool.render(records, title="血壓")).startswith("data:image/png;base64,")
+        assert (await pool.render(records, title="血壓")).startswith("data:image/png;base64,")
+        assert pool.stats()["restarts"] == restarts + 1
+    finally:
+        await pool.close()
+
+
+@pytest.mark.parametrize("fmt, prefix", [("png", "data:image/png;base64,"),
+                                         ("webp", "data:image/webp;base64,"),
+                                         ("svg", "data:image/svg+xml;base64,")])
+def test_chart_renderer_formats_in_parallel_threads(fmt, prefix):
+    records = HealthRecords.from_history([{
+        "date": f"2026-{month:02d}-{day:02d} 08:00", "sys": 110 + day, "dia": 75, "pul": 70
+    } for month in range(1, 13) for day in range(1, 29)])
+    # Figure 物件彼此獨立，多個執行緒同時繪圖不會互相干擾
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(
+            lambda chart_type: render_health_chart(records, chart_type=chart_type, fmt=fmt,
+                                                   max_points=100),
+            ["line", "bar", "scatter", "line"]))
+    assert all(r.startswith(prefix) for r in results), results
+
+
+@pytest.mark.asyncio
+async def test_chart_cache_lru_eviction_and_route(tmp_path):
+    records = HealthRecords.from_history([{"date": "2026-03-01 08:00", "sys": 120, "dia": 80}])
+    cache = ChartCache(str(tmp_path), secret="test-secret", max_bytes=250)
+    key_a = cache.key(records, {"title": "A", "fmt": "png"})
+    key_b = cache.key(records, {"title": "B", "fmt": "png"})
+    key_c = cache.key(records, {"title": "C", "fmt": "png"})
+    # 相同數據與參數 (不論鍵順序) 得到相同 key
+    assert key_a == cache.key(records, {"fmt": "png", "title": "A"}) != key_b
+    # 檔名依賴伺服器密鑰：不同密鑰或單純的 sha256 都無法得到相同檔名
+    assert key_a != ChartCache(str(tmp_path), secret="other").key(records, {"title": "A", "fmt": "png"})
+    plain = hashlib.sha256(records.fingerprint().encode("ascii"))
+    plain.update(json.dumps({"fmt": "png", "title": "A"}, sort_keys=True).encode("utf-8"))
+    assert key_a != plain.hexdigest()
+
+    cache.put(key_a, "png", b"a" * 100)
+    cache.put(key_b, "png", b"b" * 100)
+    os.utime(cache.path(key_a, "png"), (1, 1))
+    os.utime(cache.path(key_b, "png"), (2, 2))
+    assert cache.get(key_a, "png")  # 命中後成為最近使用
+    cache.put(key_c, "png", b"c" * 100)
+    # 超過容量時淘汰最久未使用的 B
+    assert cache.get(key_b, "png") is None
+    assert cache.get(key_a, "png") and cache.get(key_c, "png")
+
+    with patch.object(charts_router, "chart_cache", cache):
+        response = await charts_router.get_chart(f"{key_a}.png")
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert response.media_type == "image/png"
+        for bad_name in (f"{key_b}.png", f"{key_a}.exe", "../secret.png"):
+            with pytest.raises(HTTPException) as exc:
+                await charts_router.get_chart(bad_name)
+            assert exc.value.status_code == 404
+
+
+def test_chart_spec_is_compact_and_downsampled():
+    history = [{
+        "date": f"2026-{month:02d}-{day:02d} 08:00", "sys": 110 + day, "dia": 75, "pul": 70
+    } for month in range(1, 13) for day in range(1, 29)]
+    history[5]["sys"] = None
+    spec = build_chart_spec(HealthRecords.from_history(history), title="血壓趨勢",
+                            columns=["sys", "dia", "pul"], labels=["收縮壓", "舒張壓", "心率"],
+                            unit="mmHg / bpm", max_points=60)
+    assert spec["total"] == len(history) and spec["points"] <= 60
+    assert spec["x"][0] == "2026-01-01T08:00" and spec["x"][-1] == "2026-12-28T08:00"
+    assert all(len(s["values"]) == spec["points"] for s in spec["series"])
+    # 第三條序列沿用預設配色循環，參考線只包含血壓欄位
+    assert [s["key"] for s in spec["series"]] == ["sys", "dia", "pul"] and spec["series"][2]["color"]
+    assert [(t["key"], t["value"]) for t in spec["thresholds"]] == [("sys", 120), ("dia", 80)]
+    assert len(json.dumps(spec, ensure_ascii=False)) < 8 * 1024
+
+    spec = build_chart_spec(HealthRecords.from_history(history[:7]), columns=["sys"])
+    assert spec["series"][0]["values"][5] is None
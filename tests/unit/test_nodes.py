@@ -7,6 +7,10 @@ from app.services.medical.nodes.analyst import HealthAnalystNodes
 
 from unittest.mock import MagicMock, AsyncMock
 from app.services.medical.nodes.router import RouterNode, RouterOutput
+from app.services.medical.nodes.fast_router import FastRouter
+from app.services.medical.nodes.chart_inference import infer_chart_params
+from app.utils.health_records import HealthRecords
+from app.utils.registry_loader import load_skills_registry
 
 # ------------------------------------------------------------------
 # 1. 測試 RouterNode (使用 Unified Router)
@@ -48,6 +52,83 @@ async def test_router_logic_and_llm_intent(mock_state):
     assert res_query.update["query_start"] == "2026-01-01"
 
 
+
+def test_fast_router_rules():
+    valid_ids = ["device_expert", "health_analyst", "health_query", "visualizer", "general"]
+    fast = FastRouter(valid_ids, load_skills_registry())
+
+    assert fast.classify("err 3")[0] == "device_expert"
+    assert fast.classify("螢幕出現 ERR-2 怎麼辦")[0] == "device_expert"
+    assert fast.classify("電池符號一直閃")[0] == "device_expert"
+    # 「血壓計」屬於設備關鍵字，不應被當成血壓數據查詢
+    assert fast.classify("血壓計要怎麼清潔")[0] == "device_expert"
+    assert fast.classify("你好！")[0] == "general"
+    assert fast.classify("好", "需要我為您繪製趨勢分析圖表嗎？")[0] == "visualizer"
+    assert fast.classify("不用了，謝謝", "需要我為您繪製趨勢分析圖表嗎？")[0] == "general"
+    assert fast.classify("好的，麻煩你", "需要我為您繪製趨勢分析圖表嗎？")[0] == "visualizer"
+    # 繪圖提議之後的一般問題不應被當成確認 / 拒絕
+    offer = "需要我為您繪製趨勢分析圖表嗎？"
+    for message in ("請問血壓計怎麼清潔", "要怎麼更換電池", "是不是血壓太高了", "對了，昨天的血壓呢",
+                    "可以告訴我上週血壓正常嗎"):
+        result = fast.classify(message, offer)
+        assert result is None or result[0] != "visualizer", message
+    result = fast.classify("不好意思，我想問上週的血壓", offer)
+    assert result is None or result[0] != "general"
+    # 「畫面」「計畫」不是繪圖需求
+    for message in ("我想看這個畫面的說明", "計畫表"):
+        result = fast.classify(message)
+        assert result is None or result[0] != "visualizer", message
+    assert fast.classify("幫我畫上個月的血壓圖")[0] == "visualizer"
+
+    # 數據查詢需要日期，信心分數低於門檻，交由 LLM
+    intent, confidence, _ = fast.classify("我上週的血壓正常嗎")
+    assert intent == "health_analyst" and confidence < 0.8
+    assert fast.classify("那昨天呢？") is None
+    # 本地解析出日期時直接採用
+    dated = ("2026-03-09", "2026-03-15")
+    assert fast.classify("上週的血壓紀錄", date_range=dated)[:2] == ("health_query", 0.9)
+    assert fast.classify("那昨天呢？", last_intent="health_analyst",
+                         date_range=dated)[0] == "health_analyst"
+    # 不在 valid_ids 內的意圖不會被採用
+    assert FastRouter(["general"]).classify("err 3") is None
+
+
+def test_infer_chart_params_rules():
+    records = HealthRecords.from_history([
+        {"date": "2026-03-01 08:00", "sys": 120, "dia": 80, "pul": 70},
+        {"date": "2026-03-07 08:00", "sys": 130, "dia": 85, "pul": 75},
+    ])
+    params = infer_chart_params("幫我畫血壓圖", records)
+    assert (params.chart_type, params.columns, params.unit) == ("line", ["sys", "dia"], "mmHg")
+    assert params.title == "血壓趨勢 (2026-03-01 ~ 2026-03-07)"
+    params = infer_chart_params("畫脈搏的長條圖", records)
+    assert (params.chart_type, params.columns, params.labels) == ("bar", ["pul"], ["心率"])
+    params = infer_chart_params("血壓跟心率的散佈圖", records)
+    assert params.columns == ["pul", "sys", "dia"] and params.unit == "bpm / mmHg"
+    # 確認繪圖提議時，沿用先前分析中提議的指標
+    assert infer_chart_params("好", records, "心率偏快。要幫您畫心率趨勢圖嗎？").columns == ["pul"]
+
+    # 模糊或無法滿足的需求交由 LLM
+    assert infer_chart_params("幫我畫圖", records) is None
+    assert infer_chart_params("畫長條圖", records, "整體來說數值穩定。") is None
+    assert infer_chart_params("畫體重趨勢", records) is None
+    assert infer_chart_params("不要心率，畫其他的", records) is None
+    assert infer_chart_params("長條圖還是折線圖比較好", records) is None
+    no_pulse = HealthRecords.from_history([{"date": "2026-03-01 08:00", "sys": 120, "dia": 80}])
+    assert infer_chart_params("畫心率", no_pulse) is None
+
+
+@pytest.mark.asyncio
+async def test_router_fast_path_skips_llm(mock_state):
+    fake_llm = MagicMock()
+    router = RouterNode(llm=fake_llm, manifest="...", valid_ids=["device_expert", "general"])
+    mock_state["input_message"] = "Err 5"
+
+    res = await router.node_router(mock_state)
+    assert res.update["intent"] == "device_expert"
+    assert res.update["skill_instructions"]
+    fake_llm.with_structured_output.assert_not_called()
+
 # ------------------------------------------------------------------
 # 3. 測試 HealthAnalyst (緊急狀況識別)
 # ------------------------------------------------------------------
@@ -75,6 +156,27 @@ async def test_health_analyst_emergency_flag(fake_llm_factory, mock_state):
     assert "請立即就醫" in res["final_response"]
 
 
+@pytest.mark.asyncio
+async def test_health_analyst_normal_clears_precheck(mock_state):
+    llm = MagicMock()
+    llm.ainvoke = AsyncMock(return_value=AIMessage(content="[NORMAL] 單次讀數疑似量測誤差，之後已恢復正常。"))
+    analyst_nodes = HealthAnalystNodes(llm=llm)
+    mock_state.update({
+        "context_data": json.dumps({"history": [{"sys": 185, "dia": 90}, {"sys": 122, "dia": 80}], "total": 2}),
+        "input_message": "幫我分析",
+        "data_count": 2,
+        "emergency_alerts": [{"rule": "hypertensive_crisis", "description": "血壓達高血壓危象範圍",
+                              "count": 1, "latest": {"sys": 185, "dia": 90}}],
+    })
+
+    res = await analyst_nodes.node_health_analyst(mock_state)
+    # 預檢結果會放進 prompt，LLM 以 [NORMAL] 解除警示
+    prompt = "\n".join(m.content for m in llm.ainvoke.call_args.args[0])
+    assert "血壓達高血壓危象範圍" in prompt and "[NORMAL]" in prompt
+    assert res["is_emergency"] is False
+    assert "[NORMAL]" not in res["final_response"]
+
+
 @pytest.mark.asyncio
 async def test_analyst_handle_api_error(fake_llm_factory):
     # 模擬 API 故障的情況
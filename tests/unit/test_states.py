@@ -1,6 +1,7 @@
 # tests/unit/test_state.py
 import pytest
 import operator
+from unittest.mock import MagicMock
 from langchain_core.messages import HumanMessage, AIMessage
 from langgraph.checkpoint.memory import MemorySaver
 from app.services.medical.state import AgentState
@@ -40,6 +41,17 @@ async def medical_service(fake_llm_factory):
     await service.close()
 
 
+# 以 MagicMock LLM 編譯完整流程圖，各測試自行設定 LLM 的回傳值
+@pytest.fixture
+async def graph_service():
+    service = MedicalAgentService()
+    service.llm = MagicMock()
+    service.memory = MemorySaver()
+    service.app = service._build_workflow().compile(checkpointer=service.memory)
+    yield service
+    await service.close()
+
+
 # 測試記憶隔離性 (整合測試)
 
 
@@ -83,3 +95,198 @@ def test_state_intent_overwrite():
     # 在 TypedDict 中，這只是簡單的 key 覆蓋
     state_initial.update(state_update)
     assert state_initial["intent"] == "health_analyst"
+
+
+
+# 測試流程圖快取：串流只傳節點增量事件，不再夾帶完整 Mermaid 原始碼
+@pytest.mark.asyncio
+async def test_graph_diagram_cached_and_node_events(graph_service):
+    from unittest.mock import AsyncMock
+    from app.services.medical.nodes.router import RouterOutput
+
+    llm = graph_service.llm
+    structured_llm = MagicMock()
+    structured_llm.ainvoke = AsyncMock(return_value=RouterOutput(intent="general", reasoning="問候"))
+    llm.with_structured_output.return_value = structured_llm
+    llm.ainvoke = AsyncMock(return_value=AIMessage(content="您好"))
+
+    diagram = await graph_service.get_graph_diagram()
+    assert diagram["version"] == graph_service.graph_version
+    assert "router" in diagram["mermaid"]
+
+    events = [e async for e in graph_service.handle_chat(user_id="user_C", message="你好")]
+
+    assert not any(e["type"] == "graph" for e in events)
+    node_events = [e for e in events if e["type"] == "node"]
+    assert [e["node"] for e in node_events] == ["router", "general_assistant"]
+    assert all(e["graph_version"] == diagram["version"] for e in node_events)
+    final = next(e for e in events if e["type"] == "final")
+    assert final["data"]["graph_version"] == diagram["version"]
+    assert "graph" not in final["data"]
+
+
+@pytest.mark.asyncio
+async def test_precheck_emergency_streams_before_final(graph_service, tmp_path):
+    import json
+    from unittest.mock import AsyncMock, patch
+    from app.services.blob_store import BlobStore
+    from app.services.medical.nodes.router import RouterOutput
+
+    llm = graph_service.llm
+    structured_llm = MagicMock()
+    structured_llm.ainvoke = AsyncMock(return_value=RouterOutput(
+        intent="health_query", query_start="2026-03-01", query_end="2026-03-02", reasoning="查詢"))
+    llm.with_structured_output.return_value = structured_llm
+
+    from datetime import datetime, timedelta
+
+    # 預檢只看近期讀數：一小時前的危險讀數立即警示，上個月的不會
+    recent = (datetime.now() - timedelta(hours=1)).strftime("%Y-%m-%d %H:%M")
+    payload = json.dumps({
+        "status": "success",
+        "history": [{"date": "2026-03-01 08:00", "sys": 200, "dia": 95, "pul": 35},
+                    {"date": recent, "sys": 185, "dia": 95, "pul": 80}],
+        "total": 2,
+    })
+    fetch = MagicMock()
+    fetch.ainvoke = AsyncMock(return_value=payload)
+    with patch("app.services.medical.nodes.analyst.get_user_health_data", fetch), \
+         patch("app.services.medical.records.record_blobs", BlobStore(str(tmp_path / "b.sqlite"))):
+        events = [e async for e in graph_service.handle_chat(user_id="user_E", message="查一下三月初的紀錄")]
+
+    types = [e["type"] for e in events]
+    assert types.index("emergency") < types.index("final")
+    alert = next(e for e in events if e["type"] == "emergency")
+    assert alert["alerts"][0]["rule"] == "hypertensive_crisis"
+    # 舊讀數的心率過慢不在近期範圍內，危象讀數也不重複計入「血壓過高」
+    assert [a["rule"] for a in alert["alerts"]] == ["hypertensive_crisis"]
+    assert alert["alerts"][0]["count"] == 1
+    assert next(e for e in events if e["type"] == "final")["data"]["is_emergency"] is True
+
+
+@pytest.mark.asyncio
+async def test_speculative_prefetch_adopted_by_fetch_records(graph_service, tmp_path):
+    import asyncio
+    import json
+    from unittest.mock import AsyncMock, patch
+    from app.services.blob_store import BlobStore
+    from app.services.medical.nodes.router import RouterOutput
+    from app.utils.metrics import metrics
+
+    payload = json.dumps({
+        "status": "success",
+        "history": [{"date": "2026-03-01 08:00", "sys": 120, "dia": 80, "pul": 70}],
+        "total": 1,
+    })
+    fetch_started = asyncio.Event()
+    router_done = asyncio.Event()
+
+    async def slow_fetch(args):
+        fetch_started.set()
+        await router_done.wait()
+        return payload
+
+    async def router_llm(prompt):
+        # Router LLM 執行時預取已在進行中
+        await asyncio.wait_for(fetch_started.wait(), timeout=1)
+        router_done.set()
+        return RouterOutput(intent="health_query", reasoning="查詢")
+
+    llm = graph_service.llm
+    structured_llm = MagicMock()
+    structured_llm.ainvoke = AsyncMock(side_effect=router_llm)
+    llm.with_structured_output.return_value = structured_llm
+
+    prefetch_call = MagicMock()
+    prefetch_call.ainvoke = AsyncMock(side_effect=slow_fetch)
+    node_call = MagicMock()
+    node_call.ainvoke = AsyncMock(return_value=payload)
+    hits = metrics.get("prefetch.hits")
+    # 沒有健康關鍵字，FastRouter 無法判斷，需要 Router LLM
+    message = "2026-03-01 到 2026-03-02 的狀況"
+    assert graph_service.prefetcher.fast_router.classify(message, date_range=("2026-03-01", "2026-03-02")) is None
+    with patch("app.services.medical.prefetch.get_user_health_data", prefetch_call), \
+         patch("app.services.medical.nodes.analyst.get_user_health_data", node_call), \
+         patch("app.services.medical.records.record_blobs", BlobStore(str(tmp_path / "b.sqlite"))):
+        events = [e async for e in graph_service.handle_chat(user_id="user_F", message=message)]
+
+    structured_llm.ainvoke.assert_awaited_once()
+    prefetch_call.ainvoke.assert_awaited_once_with(
+        {"user_id": "user_F", "start_date": "2026-03-01", "end_date": "2026-03-02"})
+    node_call.ainvoke.assert_not_called()
+    assert metrics.get("prefetch.hits") == hits + 1
+    assert "1 筆" in next(e for e in events if e["type"] == "final")["data"]["text"]
+    assert graph_service.prefetcher.stats()["pending"] == 0
+
+    # 規則已能決定意圖的訊息不會呼叫 LLM，不預取
+    assert not graph_service.prefetcher.maybe_start("user_F", "查詢 2026-03-01 到 2026-03-02 的血壓紀錄")
+
+
+@pytest.mark.asyncio
+async def test_chart_offer_confirmed_through_graph(graph_service, tmp_path):
+    import json
+    from unittest.mock import AsyncMock, patch
+    from app.services.blob_store import BlobStore
+    from app.services.chart_cache import ChartCache
+    from app.services.medical.nodes.router import RouterOutput
+
+    llm = graph_service.llm
+    structured_llm = MagicMock()
+    structured_llm.ainvoke = AsyncMock(return_value=RouterOutput(
+        intent="health_analyst", query_start="2026-03-01", query_end="2026-03-05", reasoning="分析"))
+    llm.with_structured_output.return_value = structured_llm
+    llm.ainvoke = AsyncMock(return_value=AIMessage(content="您的血壓大致穩定。"))
+
+    payload = json.dumps({
+        "status": "success",
+        "history": [{"date": f"2026-03-0{day} 08:00", "sys": 120 + day, "dia": 80, "pul": 70}
+                    for day in range(1, 6)],
+        "total": 5,
+    })
+    fetch = MagicMock()
+    fetch.ainvoke = AsyncMock(return_value=payload)
+    with patch("app.services.medical.nodes.analyst.get_user_health_data", fetch), \
+         patch("app.services.medical.nodes.expert.chart_pool.render_bytes",
+               new=AsyncMock(return_value=b"chart")) as mock_plot, \
+         patch("app.services.medical.nodes.expert.chart_cache", ChartCache(str(tmp_path / "charts"), secret="test-secret")), \
+         patch("app.services.medical.records.record_blobs", BlobStore(str(tmp_path / "b.sqlite"))):
+        first = [e async for e in graph_service.handle_chat(user_id="user_G", message="我最近還好嗎")]
+        assert "繪製血壓趨勢圖表嗎" in next(e for e in first if e["type"] == "final")["data"]["text"]
+        events = [e async for e in graph_service.handle_chat(user_id="user_G", message="好的")]
+
+    # 第二輪由上一輪的回覆判斷為確認繪圖 (不呼叫 Router LLM)，繪圖參數也由規則決定
+    assert structured_llm.ainvoke.await_count == 1
+    assert [e["node"] for e in events if e["type"] == "node"] == ["router", "visualizer"]
+    assert mock_plot.call_args.kwargs["columns"] == ["sys", "dia"]
+    assert len(mock_plot.call_args.args[0]) == 5
+    fetch.ainvoke.assert_awaited_once()
+    assert "/api/v1/charts/" in next(e for e in events if e["type"] == "final")["data"]["text"]
+
+
+@pytest.mark.asyncio
+async def test_resume_applies_requested_chart_format(graph_service, tmp_path):
+    import json
+    from unittest.mock import AsyncMock, patch
+    from app.services.blob_store import BlobStore
+    from app.services.medical.nodes.router import RouterOutput
+
+    llm = graph_service.llm
+    structured_llm = MagicMock()
+    structured_llm.ainvoke = AsyncMock(return_value=RouterOutput(intent="health_query", reasoning="查詢"))
+    llm.with_structured_output.return_value = structured_llm
+    fetch = MagicMock()
+    fetch.ainvoke = AsyncMock(return_value=json.dumps({"status": "success", "history": [], "total": 0}))
+    config = {"configurable": {"thread_id": "user_H"}}
+    with patch("app.services.medical.nodes.analyst.get_user_health_data", fetch), \
+         patch("app.services.medical.records.record_blobs", BlobStore(str(tmp_path / "b.sqlite"))):
+        # 沒有日期時中斷等待補充
+        [e async for e in graph_service.handle_chat(user_id="user_H", message="幫我查紀錄", chart_format="png")]
+        state = await graph_service.app.aget_state(config)
+        assert any(task.interrupts for task in state.tasks)
+
+        # 補充日期的這次請求改用 json，resume 時一併寫入 State
+        [e async for e in graph_service.handle_chat(user_id="user_H", message="2026-03-01 到 2026-03-02",
+                                                    chart_format="json")]
+    state = await graph_service.app.aget_state(config)
+    assert state.values["chart_format"] == "json"
+    fetch.ainvoke.assert_awaited_once()
@@ -1,7 +1,21 @@
+import asyncio
+import time
+from datetime import datetime
 import pytest
 import json
 import os
 from app.utils.registry_loader import load_skills_registry, get_manifest_for_prompt, get_valid_ids
+from app.utils.sse import encode_event, coalesce_stream, cancel_on_disconnect
+from app.utils.concurrency import RunLimiter, RunQueueFull
+from app.utils.replay import ReplayRegistry
+from app.utils.llm_cache import SQLiteLLMCache
+from app.utils.metrics import metrics
+from app.utils.http_client import PooledHttpClient
+from app.utils.singleflight import SingleFlight
+from app.utils.health_records import HealthRecords
+from app.utils.downsample import lttb_indices, downsample_indices
+from app.utils.health_stats import summarize, build_analysis_input, detect_emergencies
+import httpx
 
 def test_load_skills_registry(tmp_path):
     # 建立一個暫時的 registry.json
@@ -54,3 +68,337 @@ def test_load_skills_registry_error():
     # 測試檔案不存在的情況
     registry = load_skills_registry("non_existent_file.json")
     assert registry == {"skills": []}
+
+
+def test_encode_event_wire_format():
+    frame = encode_event({"type": "stream", "content": "血壓"})
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    assert json.loads(frame[6:].decode("utf-8")) == {"type": "stream", "content": "血壓"}
+
+
+async def _fake_events(events, delay=0.0):
+    for e in events:
+        if delay:
+            await asyncio.sleep(delay)
+        yield e
+
+
+@pytest.mark.asyncio
+async def test_coalesce_stream_merges_until_boundary():
+    source = [
+        {"type": "status", "content": "分析中"},
+        {"type": "stream", "content": "您的"},
+        {"type": "stream", "content": "血壓"},
+        {"type": "stream", "content": "正常"},
+        {"type": "final", "data": {}},
+    ]
+    out = [e async for e in coalesce_stream(_fake_events(source), flush_interval_ms=1000, max_chars=1000)]
+    assert [e["type"] for e in out] == ["status", "stream", "final"]
+    assert out[1]["content"] == "您的血壓正常"
+
+
+@pytest.mark.asyncio
+async def test_coalesce_stream_flushes_by_size_and_time():
+    source = [{"type": "stream", "content": "ab"} for _ in range(4)]
+    by_size = [e async for e in coalesce_stream(_fake_events(source), flush_interval_ms=1000, max_chars=4)]
+    assert [e["content"] for e in by_size] == ["abab", "abab"]
+
+    by_time = [e async for e in coalesce_stream(_fake_events(source, delay=0.05), flush_interval_ms=10, max_chars=1000)]
+    assert len(by_time) == 4
+
+
+@pytest.mark.asyncio
+async def test_cancel_on_disconnect_cancels_upstream():
+    state = {"cancelled": False, "disconnected": False}
+
+    async def slow_run():
+        yield {"type": "status", "content": "分析中"}
+        try:
+            await asyncio.sleep(10)  # 模擬長時間的 LLM 呼叫
+            yield {"type": "final", "data": {}}
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def is_disconnected():
+        return state["disconnected"]
+
+    # 模擬在 LLM 執行期間瀏覽器關閉連線
+    asyncio.get_running_loop().call_later(0.05, state.update, {"disconnected": True})
+    abandoned = []
+    out = []
+    async for event in cancel_on_disconnect(slow_run(), is_disconnected, poll_interval_ms=10,
+                                            on_disconnect=lambda: abandoned.append(1)):
+        out.append(event)
+
+    assert [e["type"] for e in out] == ["status"]
+    assert state["cancelled"] is True
+    assert abandoned == [1]
+
+
+@pytest.mark.asyncio
+async def test_run_limiter_serializes_thread_and_rejects_overflow():
+    limiter = RunLimiter(max_inflight=4, thread_queue_size=1, max_queued=4, retry_after=5)
+    order = []
+
+    async def run(slot, tag):
+        async with slot:
+            order.append(f"{tag}-start")
+            await asyncio.sleep(0.02)
+            order.append(f"{tag}-end")
+
+    first = limiter.reserve("user_A")
+    second = limiter.reserve("user_A")
+    assert second.would_wait is False  # 尚未有人真正取得鎖
+    with pytest.raises(RunQueueFull) as exc:
+        limiter.reserve("user_A")
+    assert exc.value.retry_after == 5
+
+    await asyncio.gather(run(first, "a1"), run(second, "a2"))
+    assert order == ["a1-start", "a1-end", "a2-start", "a2-end"]
+    assert limiter.stats()["threads"] == 0
+
+
+@pytest.mark.asyncio
+async def test_run_limiter_global_cap():
+    limiter = RunLimiter(max_inflight=1, thread_queue_size=2, max_queued=1)
+    running = limiter.reserve("user_A")
+    queued = limiter.reserve("user_B")
+    with pytest.raises(RunQueueFull):
+        limiter.reserve("user_C")
+
+    async with running:
+        assert queued.would_wait is True
+        assert limiter.stats() == {"inflight": 1, "queued": 1, "threads": 2, "max_inflight": 1}
+    queued.release()
+    assert limiter.stats()["inflight"] == 0 and limiter.stats()["queued"] == 0
+
+
+def test_encode_event_with_id():
+    frame = encode_event({"type": "status", "content": "ok"}, "run1:3")
+    assert frame.startswith(b"id: run1:3\ndata: ")
+
+
+@pytest.mark.asyncio
+async def test_replay_registry_resume_from_last_event_id():
+    registry = ReplayRegistry(max_events=10, grace_seconds=5)
+    finished = []
+    source = [{"type": "stream", "content": str(i)} for i in range(5)]
+    stream = registry.start("user_A", _fake_events(source, delay=0.01), on_finish=lambda: finished.append(1))
+
+    # 第一次連線只讀到第 2 個事件就斷線
+    first = []
+    async for seq, event in stream.subscribe(0):
+        first.append(event["content"])
+        if seq == 2:
+            break
+    assert first == ["0", "1"]
+
+    # 以 Last-Event-ID = run:2 續傳，拿到剩餘事件且不重新執行
+    assert registry.get(stream.run_id) is stream
+    assert stream.can_resume(2)
+    rest = [event["content"] async for _, event in stream.subscribe(2)]
+    assert rest == ["2", "3", "4"]
+    assert stream.done and finished == [1]
+    assert not stream.can_resume(99)
+
+
+@pytest.mark.asyncio
+async def test_replay_registry_cancels_after_grace():
+    abandoned = []
+    registry = ReplayRegistry(grace_seconds=0.02, on_abandon=abandoned.append)
+
+    async def slow_run():
+        yield {"type": "status", "content": "分析中"}
+        await asyncio.sleep(10)
+        yield {"type": "final", "data": {}}
+
+    stream = registry.start("user_A", slow_run())
+    async for _ in stream.subscribe(0):
+        break  # 客戶端斷線且不再重連
+
+    await asyncio.sleep(0.1)
+    assert abandoned == [stream]
+    assert stream.task.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_llm_cache_hits_and_lru(tmp_path, fake_llm_factory):
+    """相同 prompt 第二次直接從 SQLite 取回，不再呼叫模型"""
+    metrics.reset()
+    cache = SQLiteLLMCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    llm = fake_llm_factory(["第一次", "第二次", "第三次"])
+    llm.cache = cache
+
+    assert (await llm.ainvoke("你好")).content == "第一次"
+    assert (await llm.ainvoke("你好")).content == "第一次"
+    assert metrics.get("llm_cache.hits") == 1
+    assert metrics.get("llm_cache.misses") == 1
+
+    await llm.ainvoke("問題 A")
+    await llm.ainvoke("問題 B")
+    # 上限 2 筆，最久未使用的「你好」被淘汰
+    assert cache.stats()["entries"] == 2
+    assert metrics.get("llm_cache.evictions") == 1
+    cache.close()
+
+
+def test_llm_cache_ttl_per_node(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "cache.sqlite"),
+                           ttl_seconds={"default": -1})
+    # TTL <= 0 的節點不寫入也不查詢
+    cache.update("prompt", "llm", [])
+    assert cache.lookup("prompt", "llm") is None
+    assert cache.stats()["entries"] == 0
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_pooled_http_client_retries_5xx_and_connect_errors():
+    metrics.reset()
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("connection refused", request=request)
+        if len(calls) == 2:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"ok": True})
+
+    client = PooledHttpClient("test_api", "http://api.test", retries=2, backoff=0,
+                              transport=httpx.MockTransport(handler))
+    response = await client.get("/data", params={"a": 1})
+    assert response.json() == {"ok": True}
+    assert len(calls) == 3
+    assert metrics.get("http.test_api.retries") == 2
+
+    # 重試次數用完後回傳最後的 5xx 回應
+    calls.clear()
+    client.retries = 0
+    calls.append(None)
+    assert (await client.get("/data")).status_code == 503
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_singleflight_shares_inflight_calls():
+    metrics.reset()
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*[flight.do("k", fetch) for _ in range(5)])
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.stats()["deduplicated"] == 4
+    assert flight.stats()["top_keys"] == [{"key": "k", "deduplicated": 4}]
+
+    # 完成後不保留結果，下一次呼叫會重新執行
+    await flight.do("k", fetch)
+    assert len(calls) == 2
+
+    # 某個呼叫者取消不影響其他等待者
+    first = asyncio.create_task(flight.do("k2", fetch))
+    second = asyncio.create_task(flight.do("k2", fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "result"
+
+
+@pytest.mark.asyncio
+async def test_singleflight_sync_calls_from_threads():
+    flight = SingleFlight("test_sync")
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        return 42
+
+    results = await asyncio.gather(
+        *[asyncio.to_thread(flight.do_sync, "AAPL", fetch) for _ in range(4)])
+    assert results == [42] * 4
+    assert len(calls) == 1
+
+
+def _bp_records(days: int) -> HealthRecords:
+    history = []
+    for day in range(1, days + 1):
+        history.append({"date": f"2026-03-{day:02d} 07:30", "sys": 120 + day, "dia": 80, "pul": 70})
+        history.append({"date": f"2026-03-{day:02d} 21:00", "sys": 130 + day, "dia": 85, "pul": 72})
+    return HealthRecords.from_history(history, meta={"status": "success", "total": len(history)})
+
+
+def test_health_summary_statistics():
+    summary = summarize(_bp_records(30))
+
+    assert summary["count"] == 60
+    assert summary["sys"]["min"] == 121 and summary["sys"]["max"] == 160
+    assert summary["morning_evening"]["morning"]["sys_mean"] == 135.5
+    assert summary["morning_evening"]["evening"]["sys_mean"] == 145.5
+    # 每天上升 1 mmHg
+    assert summary["trend_per_week"]["sys"] == pytest.approx(7, abs=0.5)
+    assert sum(summary["aha_categories"].values()) == 60
+    assert summary["out_of_range"]["high"] == 1
+    assert summary["out_of_range"]["readings"][0]["date"] == "2026-03-30 21:00"
+
+
+def test_analysis_input_is_bounded():
+    small, large = _bp_records(5), _bp_records(31)
+    assert build_analysis_input(large, "raw") == large.to_json()
+    assert "(20 / 62 筆)" in build_analysis_input(large, "summary", 20)
+    # 摘要模式的長度不隨筆數線性成長
+    assert len(build_analysis_input(large)) < len(build_analysis_input(small)) * 2
+
+
+def test_detect_emergencies_rules():
+    records = HealthRecords.from_history([
+        {"date": "2026-03-01 08:00", "sys": 128, "dia": 82, "pul": 70},
+        {"date": "2026-03-02 08:00", "sys": 165, "dia": 92, "pul": 125},
+        {"date": "2026-03-03 08:00", "sys": 120, "dia": 121, "pul": 70},
+    ])
+    now = datetime(2026, 3, 3, 12, 0)
+    alerts = {a["rule"]: a for a in detect_emergencies(records, window_hours=72, now=now)}
+
+    assert set(alerts) == {"hypertensive_crisis", "severe_hypertension", "tachycardia"}
+    assert alerts["hypertensive_crisis"]["latest"]["date"] == "2026-03-03 08:00"
+    # 危象讀數不重複計入「血壓過高」
+    assert alerts["severe_hypertension"]["count"] == 1
+    assert alerts["severe_hypertension"]["latest"]["date"] == "2026-03-02 08:00"
+    assert detect_emergencies(_bp_records(5), window_hours=24 * 30, now=now) == []
+    # 只檢查近期讀數：前一天的心率過快不觸發即時警示
+    recent = {a["rule"]: a for a in detect_emergencies(records, window_hours=24, now=now)}
+    assert set(recent) == {"hypertensive_crisis"}
+    # 查詢上個月的紀錄時不觸發
+    assert detect_emergencies(records, now=datetime(2026, 4, 15)) == []
+
+
+def test_detect_emergencies_reports_most_severe_bp_rule_once():
+    records = HealthRecords.from_history([{"date": "2026-03-03 08:00", "sys": 185, "dia": 125, "pul": 70}])
+    alerts = detect_emergencies(records, now=datetime(2026, 3, 3, 12, 0))
+    assert [a["rule"] for a in alerts] == ["hypertensive_crisis"]
+
+
+def test_detect_emergencies_ignores_future_readings():
+    records = HealthRecords.from_history([{"date": "2026-03-05 08:00", "sys": 185, "dia": 125, "pul": 130}])
+    # 時間晚於 now 的讀數 (時鐘偏差) 不算近期
+    assert detect_emergencies(records, now=datetime(2026, 3, 3, 12, 0)) == []
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    import numpy as np
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50)
+    y[437] = 10  # 單一尖峰必須被保留
+
+    kept = lttb_indices(x, y, 100)
+    assert len(kept) == 100
+    assert kept[0] == 0 and kept[-1] == 999 and 437 in kept
+    assert np.all(np.diff(kept) > 0)
+    assert len(downsample_indices(x, [y, -y], 100)) <= 100
+    assert len(downsample_indices(x[:50], [y[:50]], 100)) == 50